@@ -0,0 +1,202 @@
+# app/benchmark.py
+"""
+Reproducible solver benchmark.
+
+    python -m app.benchmark run --suite quick --out bench.json
+    python -m app.benchmark compare old.json new.json
+
+Every case (solver x distribution x size) runs in a fresh process on a seeded instance
+from app.simulator, so timings and peak RSS are not polluted by earlier cases. Each record
+has wall time, meta.timings stages, peak memory, closed-route cost, feasibility and the gap
+to the best solver on the same instance. Offline and CPU-only.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+SUITES = {
+    "smoke": {"sizes": (10, 100), "seeds": (0,)},
+    "quick": {"sizes": (10, 100, 1000), "seeds": (0,)},
+    "full": {"sizes": (10, 100, 1000, 5000, 20000, 50000), "seeds": (0, 1)},
+}
+SOLVERS = ("ortools", "hybrid", "decomposed", "portfolio")
+# Largest instance each solver is run on (dense OR-Tools models do not fit beyond this).
+SOLVER_MAX_ORDERS = {"ortools": 2000, "portfolio": 2000, "decomposed": 20000, "hybrid": 50000}
+# Wall clock allowed past the time limit before a case is killed and recorded as a timeout.
+CASE_GRACE_S = 300
+
+
+def _rss_mb(who=resource.RUSAGE_SELF) -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return round(resource.getrusage(who).ru_maxrss * scale / 1e6, 1)
+
+
+def _run_case(case: Dict, conn):
+    """Child process: build the instance, solve it once, send back the measurements."""
+    import numpy as np
+    from app.optimize import run_optimize
+    from app.portfolio import fit_to_fleet, route_cost_m
+    from app.simulator import generate_instance
+
+    rss_base = _rss_mb()
+    inst = generate_instance(case["n_orders"], case["distribution"], seed=case["seed"])
+    t = time.perf_counter()
+    # hybrid gets one cluster per vehicle (as in the portfolio); decomposed picks its own k
+    cluster_k = len(inst["vehicles"]) if case["solver"] == "hybrid" else None
+    res = run_optimize(case["solver"], inst["depot"], inst["vehicles"], inst["orders"], cluster_k=cluster_k,
+                       time_limit_seconds=case["time_limit"], scenario_key=None)
+    wall = time.perf_counter() - t
+
+    depot, orders = inst["depot"], inst["orders"]
+    pts = np.array([[depot["lat"], depot["lon"]]] + [[o["lat"], o["lon"]] for o in orders])
+    routes = res.get("routes_idx") or []
+    served = sorted(n for r in routes for n in r if n != 0)
+    demands = [0] + [o["demand"] for o in orders]
+    out = dict(case, spec=inst["spec"], wall_s=round(wall, 3), timings=res["meta"].get("timings"),
+               rss_base_mb=rss_base, rss_peak_mb=_rss_mb(), children_rss_peak_mb=_rss_mb(resource.RUSAGE_CHILDREN),
+               status=res["meta"].get("msg") or "ok", reported_distance_m=res.get("distance_m"),
+               served=len(set(served)), duplicates=len(served) - len(set(served)))
+    if routes:
+        # one yardstick for all solvers: closed routes (hybrid reports open ones)
+        out["cost_m"] = route_cost_m(pts, routes)
+        out["routes"] = sum(1 for r in routes if any(n != 0 for n in r))
+        fits = fit_to_fleet(routes, demands, [v["capacity"] for v in inst["vehicles"]])
+        out["feasible"] = fits is not None and out["served"] == len(orders) and not out["duplicates"]
+    conn.send(out)
+    conn.close()
+
+
+def run_case(case: Dict) -> Dict:
+    ctx = mp.get_context("spawn")  # clean interpreter: peak RSS belongs to this case only
+    recv, send = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_run_case, args=(case, send))
+    t = time.perf_counter()
+    proc.start()
+    send.close()
+    budget = case["time_limit"] + CASE_GRACE_S
+    if recv.poll(budget):
+        try:
+            rec = recv.recv()
+        except EOFError:
+            rec = dict(case, status="crashed")
+    else:
+        rec = dict(case, status="timeout" if proc.is_alive() else "crashed")
+    proc.join(5)
+    if proc.is_alive():
+        proc.kill()
+        proc.join()
+    if rec["status"] in ("timeout", "crashed"):
+        rec.update(wall_s=round(time.perf_counter() - t, 3), exitcode=proc.exitcode)
+    return rec
+
+
+def add_gaps(records: List[Dict]):
+    """gap_pct: cost over the best feasible cost any solver found on the same instance."""
+    best: Dict[tuple, int] = {}
+    for r in records:
+        if r.get("feasible"):
+            k = (r["distribution"], r["n_orders"], r["seed"])
+            best[k] = min(best.get(k, r["cost_m"]), r["cost_m"])
+    for r in records:
+        b = best.get((r["distribution"], r["n_orders"], r["seed"]))
+        if r.get("feasible") and b:
+            r["gap_pct"] = round(100.0 * (r["cost_m"] - b) / b, 2)
+
+
+def environment() -> Dict:
+    import numpy
+    env = {"python": platform.python_version(), "platform": platform.platform(), "machine": platform.machine(),
+           "cpu_count": os.cpu_count(), "numpy": numpy.__version__}
+    try:
+        import ortools
+        env["ortools"] = ortools.__version__
+    except (ImportError, AttributeError):
+        pass
+    try:
+        env["git_commit"] = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                           timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        env["git_commit"] = None
+    return env
+
+
+def case_key(r: Dict) -> str:
+    return f"{r['solver']}/{r['distribution']}/{r['n_orders']}/seed{r['seed']}"
+
+
+def run_suite(suite: str = "quick", solvers=SOLVERS, distributions=None, time_limit: int = 10,
+              sizes=None, seeds=None, log=print) -> Dict:
+    from app.simulator import DISTRIBUTIONS
+    conf = SUITES[suite]
+    cases = [{"solver": s, "distribution": d, "n_orders": n, "seed": seed, "time_limit": time_limit}
+             for n in (sizes or conf["sizes"]) for d in (distributions or DISTRIBUTIONS)
+             for seed in (seeds or conf["seeds"]) for s in solvers if n <= SOLVER_MAX_ORDERS[s]]
+    records = []
+    t0 = time.time()
+    for i, case in enumerate(cases, 1):
+        rec = run_case(case)
+        records.append(rec)
+        log(f"[{i}/{len(cases)}] {case_key(rec)}: {rec['status']} {rec.get('wall_s')}s "
+            f"cost={rec.get('cost_m')} rss={rec.get('rss_peak_mb')}MB")
+    add_gaps(records)
+    return {"suite": suite, "time_limit": time_limit, "created_at": t0, "env": environment(), "cases": records}
+
+
+def compare(old: Dict, new: Dict) -> List[Dict]:
+    """Per case: new/old ratios of wall time, cost and peak RSS (> 1 means new is worse)."""
+    before = {case_key(r): r for r in old["cases"]}
+    rows = []
+    for r in new["cases"]:
+        o = before.get(case_key(r))
+        if o is None:
+            continue
+        row = {"case": case_key(r), "status": f"{o['status']}->{r['status']}"}
+        for field in ("wall_s", "cost_m", "rss_peak_mb"):
+            if o.get(field) and r.get(field) is not None:
+                row[field] = round(r[field] / o[field], 3)
+        rows.append(row)
+    return rows
+
+
+def main(argv: Optional[List[str]] = None):
+    p = argparse.ArgumentParser(prog="python -m app.benchmark")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    run = sub.add_parser("run", help="run a suite and write JSON results")
+    run.add_argument("--suite", choices=sorted(SUITES), default="quick")
+    run.add_argument("--solvers", nargs="+", choices=SOLVERS, default=list(SOLVERS))
+    run.add_argument("--distributions", nargs="+", default=None)
+    run.add_argument("--sizes", nargs="+", type=int, default=None)
+    run.add_argument("--seeds", nargs="+", type=int, default=None)
+    run.add_argument("--time-limit", type=int, default=10)
+    run.add_argument("--out", default="bench_output.json")
+    cmp_ = sub.add_parser("compare", help="compare two result files (old new)")
+    cmp_.add_argument("old")
+    cmp_.add_argument("new")
+    args = p.parse_args(argv)
+
+    if args.cmd == "run":
+        result = run_suite(args.suite, args.solvers, args.distributions, args.time_limit, args.sizes, args.seeds)
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=1)
+        print(f"wrote {len(result['cases'])} cases to {args.out}")
+    else:
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        print(f"{'case':45} {'status':12} {'time':>7} {'cost':>7} {'rss':>7}")
+        for row in compare(old, new):
+            print(f"{row['case']:45} {row['status']:12} {row.get('wall_s', '-'):>7} {row.get('cost_m', '-'):>7} "
+                  f"{row.get('rss_peak_mb', '-'):>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,97 @@
-from sqlalchemy import create_engine, Column, String, JSON
+import os
+from sqlalchemy import create_engine, event, inspect, text, Column, String, JSON, Float, Integer
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-DB_URL = 'sqlite:///qpp.db'
-engine = create_engine(DB_URL, connect_args={"check_same_thread": False})
+DB_URL = os.environ.get("QF_DB_URL", 'sqlite:///qpp.db')
+# Upserts use INSERT .. ON CONFLICT DO UPDATE, which these two dialects share
+SUPPORTED_DIALECTS = ("sqlite", "postgresql")
+engine = create_engine(DB_URL, connect_args={"check_same_thread": False} if DB_URL.startswith("sqlite") else {})
+if engine.dialect.name not in SUPPORTED_DIALECTS:
+    raise RuntimeError(f"QF_DB_URL: {engine.dialect.name} is not supported, use one of {', '.join(SUPPORTED_DIALECTS)}")
 SessionLocal = sessionmaker(bind=engine)
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _):
+        # WAL lets readers in other API workers proceed while one of them writes
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("PRAGMA busy_timeout=5000")
+        cur.close()
 Base = declarative_base()
 
+class Job(Base):
+    __tablename__ = 'jobs'
+    job_id = Column(String, primary_key=True)
+    status = Column(String)
+    result = Column(JSON)
+    error = Column(String)
+    params = Column(JSON)
+    created_at = Column(Float)
+    started_at = Column(Float)
+    finished_at = Column(Float)
+    owner = Column(String)  # JobStore instance (API process) running the job
+    heartbeat_at = Column(Float)  # renewed by the owner while the job is live; stale = owner gone
+
+class Scenario(Base):
+    __tablename__ = 'scenarios'
+    scenario_id = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)  # bumped by every write; caches compare it
+    depot_lat = Column(Float)
+    depot_lon = Column(Float)
+    updated_at = Column(Float)
+
+class ScenarioOrder(Base):
+    __tablename__ = 'scenario_orders'
+    scenario_id = Column(String, primary_key=True)
+    id = Column(String, primary_key=True)
+    lat = Column(Float, nullable=False)
+    lon = Column(Float, nullable=False)
+    demand = Column(Integer, nullable=False, default=1)
+    priority = Column(String, default="normal")
+    position = Column(Integer)  # insertion order within the scenario = node order; upserts keep it
+
+class ScenarioVehicle(Base):
+    __tablename__ = 'scenario_vehicles'
+    scenario_id = Column(String, primary_key=True)
+    id = Column(String, primary_key=True)
+    start_lat = Column(Float, nullable=False)
+    start_lon = Column(Float, nullable=False)
+    capacity = Column(Integer, nullable=False, default=100)
+    position = Column(Integer)
+
+class SolutionCacheRow(Base):
+    __tablename__ = 'solution_cache'
+    key = Column(String, primary_key=True)  # scenario + solver-parameter hash
+    result = Column(JSON)
+    created_at = Column(Float)
+
+def upsert_insert(model):
+    """insert(model) of the engine's dialect, for .on_conflict_do_update(...)."""
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+def _add_missing_columns(table):
+    # create_all() never alters existing tables; older qpp.db files only have the first columns
+    existing = {c["name"] for c in inspect(engine).get_columns(table.name)}
+    added = []
+    with engine.begin() as conn:
+        for col in table.columns:
+            if col.name not in existing:
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(engine.dialect)}'))
+                added.append(col.name)
+    return added
+
 def init_db():
-    class Job(Base):
-        __tablename__ = 'jobs'
-        job_id = Column(String, primary_key=True)
-        status = Column(String)
-        result = Column(JSON)
     Base.metadata.create_all(engine)
+    _add_missing_columns(Job.__table__)
+    for model in (ScenarioOrder, ScenarioVehicle):
+        if "position" in _add_missing_columns(model.__table__):
+            # scenario tables from before the column were SQLite-only and kept node order in rowid
+            with engine.begin() as conn:
+                conn.execute(text(f"UPDATE {model.__tablename__} SET position = rowid"))
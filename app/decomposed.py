@@ -0,0 +1,235 @@
+# app/decomposed.py
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional
+
+import numpy as np
+
+from app.distance import as_latlon_array, haversine_matrix, haversine_pairs
+from app.metrics import Timings
+from app.models import column_array, point_array, take_rows
+from app.preprocessor import cluster_coords
+from app.vrp_solver import solve_vrp
+from app.warm_start import cheapest_insertion
+
+# Target sub-problem size when the caller does not fix the number of clusters.
+ORDERS_PER_CLUSTER = 400
+
+
+def assign_vehicles(cluster_demand: List[int], capacities: List[int]) -> List[List[int]]:
+    """
+    Give every cluster one vehicle (largest demand gets the largest vehicle), then hand
+    the remaining vehicles to whichever cluster is furthest short of its demand.
+    Returns vehicle indices per cluster; needs len(capacities) >= len(cluster_demand).
+    """
+    by_demand = sorted(range(len(cluster_demand)), key=lambda c: -cluster_demand[c])
+    by_cap = sorted(range(len(capacities)), key=lambda v: -capacities[v])
+    assigned: List[List[int]] = [[] for _ in cluster_demand]
+    cap_of = [0] * len(cluster_demand)
+    for c, v in zip(by_demand, by_cap):
+        assigned[c].append(v); cap_of[c] += capacities[v]
+    for v in by_cap[len(cluster_demand):]:
+        c = max(range(len(cluster_demand)), key=lambda c: cluster_demand[c] - cap_of[c])
+        assigned[c].append(v); cap_of[c] += capacities[v]
+    return assigned
+
+
+def balance_clusters(pts: np.ndarray, clusters: List[List[int]], demands: List[int], cluster_cap: List[int]) -> int:
+    """
+    Move orders out of clusters whose demand exceeds their vehicles' capacity into the
+    nearest cluster (by centroid) that still has room, cheapest detour first.
+    clusters hold order indices (node - 1) and are mutated; returns the number of moves.
+    A cluster whose vehicles carry (almost) nothing can end up empty; the caller drops it.
+    """
+    load = [sum(demands[i + 1] for i in idxs) for idxs in clusters]
+    centroids = np.array([pts[[i + 1 for i in idxs]].mean(axis=0) for idxs in clusters])
+    moves = 0
+    for c in range(len(clusters)):
+        if load[c] <= cluster_cap[c]:
+            continue
+        idxs = np.asarray(clusters[c])
+        cd = haversine_matrix(pts[idxs + 1], centroids, unit="km")
+        extra = cd - cd[:, [c]]  # how much further each order is from every other centroid
+        extra[:, c] = np.inf
+        for j in np.argsort(extra.min(axis=1)):
+            if load[c] <= cluster_cap[c]:
+                break
+            order = int(idxs[j]); d = demands[order + 1]
+            for t in np.argsort(extra[j]):
+                if t != c and np.isfinite(extra[j, t]) and load[t] + d <= cluster_cap[t]:
+                    clusters[c].remove(order); clusters[t].append(order)
+                    load[c] -= d; load[t] += d; moves += 1
+                    break
+    return moves
+
+
+def insert_leftovers(pts: np.ndarray, routes: List[List[int]], nodes: List[int], demands: List[int],
+                     caps: List[int]) -> List[int]:
+    """Cheapest feasible insertion of nodes into any route; returns the nodes that fit nowhere."""
+    loads = [sum(demands[n] for n in r) for r in routes]
+    edges = [_route_edges_m(pts, r) for r in routes]
+    left = []
+    for node in nodes:
+        row = haversine_matrix(pts[[node]], pts, unit="m")[0].astype(np.int64)
+        best = cheapest_insertion(row, row, routes, edges,
+                                  (w for w in range(len(routes)) if loads[w] + demands[node] <= caps[w]))
+        if best is None:
+            left.append(node); continue
+        _, w, pos = best
+        routes[w].insert(pos, node); loads[w] += demands[node]
+        edges[w] = _route_edges_m(pts, routes[w])
+    return left
+
+
+def _solve_cluster(args):
+    vehicles, orders, depot, time_limit, search_options = args
+    return solve_vrp(vehicles, orders, depot, time_limit_seconds=time_limit, scenario_key=None, **search_options)
+
+
+def _route_edges_m(pts: np.ndarray, route: List[int]) -> np.ndarray:
+    path = np.asarray([0] + route + [0])
+    return haversine_pairs(pts[path[:-1]], pts[path[1:]], unit="m").astype(np.int64)
+
+
+def boundary_repair(pts: np.ndarray, routes: List[List[int]], route_cluster: List[int], node_cluster: np.ndarray,
+                    centroids: np.ndarray, demands: List[int], caps: List[int], ratio: float = 0.8,
+                    max_passes: int = 2) -> Dict:
+    """
+    Relocate boundary orders (about as close to another cluster's centroid as to their own)
+    into a route of the nearest other cluster when that lowers total distance. Cheapest
+    insertion is evaluated with one haversine row per candidate, so there is no N x N matrix.
+    Mutates routes in place.
+    """
+    # centroid distances decide who is on a boundary and which cluster is its neighbour
+    cd = haversine_matrix(pts[1:], centroids, unit="km")
+    own = cd[np.arange(len(cd)), node_cluster[1:]].copy()
+    cd[np.arange(len(cd)), node_cluster[1:]] = np.inf
+    nearest_other = np.argmin(cd, axis=1)
+    boundary = np.flatnonzero(own >= ratio * cd[np.arange(len(cd)), nearest_other]) + 1
+
+    loads = [sum(demands[n] for n in r) for r in routes]
+    edges = [_route_edges_m(pts, r) for r in routes]
+    where = {n: v for v, r in enumerate(routes) for n in r}
+    moves = 0; saved = 0
+    for _ in range(max_passes):
+        moved = False
+        for node in boundary:
+            v = where.get(int(node))
+            if v is None:
+                continue
+            r = routes[v]; i = r.index(node)
+            row = haversine_matrix(pts[[node]], pts, unit="m")[0].astype(np.int64)
+            prev = 0 if i == 0 else r[i - 1]
+            nxt = 0 if i == len(r) - 1 else r[i + 1]
+            gain = int(edges[v][i] + edges[v][i + 1] - haversine_pairs(pts[[prev]], pts[[nxt]], unit="m")[0])
+            target = int(nearest_other[node - 1])
+            best = cheapest_insertion(row, row, routes, edges,
+                                      (w for w in range(len(routes)) if w != v and route_cluster[w] == target
+                                       and loads[w] + demands[node] <= caps[w]))
+            if best is None or best[0] >= gain:
+                continue
+            _, w, pos = best
+            r.pop(i); routes[w].insert(pos, int(node))
+            loads[v] -= demands[node]; loads[w] += demands[node]
+            edges[v] = _route_edges_m(pts, r); edges[w] = _route_edges_m(pts, routes[w])
+            where[int(node)] = w
+            moves += 1; saved += gain - best[0]; moved = True
+        if not moved:
+            break
+    return {"moves": moves, "saved_m": int(saved), "candidates": int(len(boundary))}
+
+
+def solve_decomposed(vehicles: List[Dict], orders: List[Dict], depot: Dict, time_limit_seconds: int = 15,
+                     cluster_k: Optional[int] = None, repair: bool = True, max_workers: Optional[int] = None,
+                     search_options: Optional[Dict] = None):
+    """
+    Cluster-first, route-second CVRP. Orders are partitioned with cluster_coords, each
+    cluster gets vehicles in proportion to its demand, and the sub-CVRPs are solved in
+    parallel worker processes. Returns the same shape as vrp_solver.solve_vrp
+    (routes[v] belongs to vehicles[v]).
+    """
+    if not depot or not orders or not vehicles:
+        return {"coords": [], "routes": [], "distance": 0, "meta": {"msg":"need depot/vehicles/orders"}}
+    t0 = time.perf_counter()
+    timings = Timings()
+    timings.size.update(orders=len(orders), vehicles=len(vehicles))
+    max_workers = max_workers or os.cpu_count() or 1
+    coords = np.vstack([[float(depot["lat"]), float(depot["lon"])], point_array(orders)]).tolist()
+    demands = [0] + column_array(orders, "demand", 1).tolist()
+    caps = [int(v.get("capacity", 100)) for v in vehicles]
+
+    k = cluster_k or max(max_workers, math.ceil(len(orders) / ORDERS_PER_CLUSTER))
+    k = max(1, min(k, len(vehicles), len(orders)))
+    pts = as_latlon_array(coords)
+    clusters = [idxs for idxs in cluster_coords(coords[1:], k).values() if idxs]
+    balanced = 0
+    while True:
+        fleet = assign_vehicles([sum(demands[i + 1] for i in idxs) for idxs in clusters], caps)
+        balanced += balance_clusters(pts, clusters, demands, [sum(caps[v] for v in f) for f in fleet])
+        if all(clusters):
+            break
+        # balancing emptied a cluster: drop it (no NaN centroid, no empty sub-solve) and
+        # share the vehicles out again; a single cluster never empties, so this ends
+        clusters = [idxs for idxs in clusters if idxs]
+    timings.add("cluster", time.perf_counter() - t0)
+    timings.size["clusters"] = len(clusters)
+
+    # clusters run in batches of max_workers, so split the budget to keep the wall clock
+    batches = math.ceil(len(clusters) / max_workers)
+    sub_limit = max(1, int(time_limit_seconds / batches))
+    jobs = [([vehicles[v] for v in fleet[c]], take_rows(orders, idxs), depot, sub_limit, search_options or {})
+            for c, idxs in enumerate(clusters)]
+    if len(jobs) == 1 or max_workers == 1:
+        results = list(map(_solve_cluster, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(jobs))) as pool:
+            results = list(pool.map(_solve_cluster, jobs))
+    solve_s = time.perf_counter() - t0
+    timings.add("sub_solve", solve_s - timings.stages["cluster"])
+    t_stitch = time.perf_counter()
+
+    # stitch local node ids (1..len(cluster)) back to global ones
+    routes: List[List[int]] = [[] for _ in vehicles]
+    route_cluster = [-1] * len(vehicles)
+    node_cluster = np.zeros(len(coords), dtype=int)
+    leftovers = []
+    cluster_meta = []
+    for c, (idxs, res) in enumerate(zip(clusters, results)):
+        node_cluster[[i + 1 for i in idxs]] = c
+        for v in fleet[c]:
+            route_cluster[v] = c
+        if not res.get("routes"):
+            leftovers.extend(i + 1 for i in idxs)
+        else:
+            for v, local in zip(fleet[c], res["routes"]):
+                routes[v] = [idxs[n - 1] + 1 for n in local if n != 0]
+        cluster_meta.append({"orders": len(idxs), "vehicles": len(fleet[c]), "distance": res.get("distance"),
+                             "status": "ok" if res.get("routes") else res.get("meta", {}).get("msg")})
+
+    meta = {"solver": "decomposed", "clusters": cluster_meta, "workers": min(max_workers, len(jobs)),
+            "sub_time_limit_s": sub_limit, "solve_time_s": round(solve_s, 3), "balance_moves": balanced}
+    if leftovers:
+        # a sub-problem had no feasible solution: place its orders wherever capacity remains
+        left = insert_leftovers(pts, routes, leftovers, demands, caps)
+        meta["reinserted"] = len(leftovers) - len(left)
+        if left:
+            meta["unassigned_orders"] = [orders[n - 1]["id"] for n in left]
+    timings.add("stitch", time.perf_counter() - t_stitch)
+    # boundary repair moves orders by straight-line cost, which would undo travel-time routing
+    road = (search_options or {}).get("metric") == "road"
+    if repair and len(clusters) > 1 and not road:
+        with timings.stage("repair"):
+            centroids = np.array([pts[[i + 1 for i in idxs]].mean(axis=0) for idxs in clusters])
+            meta["repair"] = boundary_repair(pts, routes, route_cluster, node_cluster, centroids, demands, caps)
+
+    total_m = int(sum(_route_edges_m(pts, r).sum() for r in routes if r))
+    # routes start at the depot like solve_vrp's
+    routes = [[0] + r for r in routes]
+    meta["total_time_s"] = round(time.perf_counter() - t0, 3)
+    meta["timings"] = timings.as_dict()
+    out = {"coords": coords, "routes": routes, "distance": total_m, "meta": meta}
+    if road and not leftovers:
+        out["duration_s"] = int(sum(res.get("duration_s") or 0 for res in results))
+    return out
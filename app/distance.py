@@ -0,0 +1,122 @@
+# app/distance.py
+import numpy as np
+from typing import Iterator, Optional, Tuple
+
+EARTH_RADIUS_KM = 6371.0
+
+# Upper bound on the number of matrix cells computed per block. Each block needs a
+# handful of float64 temporaries of this size, so 4M cells keeps the working set
+# around ~100MB no matter how many points there are.
+BLOCK_CELLS = 1 << 22
+
+UNITS = ("km", "m")
+
+
+def as_latlon_array(coords) -> np.ndarray:
+    """Return coords as a contiguous (n, 2) float64 array of (lat, lon)."""
+    arr = np.asarray(coords, dtype=np.float64)
+    if arr.size == 0:
+        return arr.reshape(0, 2)
+    if arr.ndim != 2 or arr.shape[1] != 2:
+        raise ValueError("coords must be a sequence of (lat, lon) pairs")
+    return np.ascontiguousarray(arr)
+
+
+def _block_rows(n_cols: int, block_rows: Optional[int]) -> int:
+    if block_rows:
+        return max(1, int(block_rows))
+    return max(1, BLOCK_CELLS // max(1, n_cols))
+
+
+def iter_haversine_blocks(src, dst=None, block_rows: Optional[int] = None) -> Iterator[Tuple[int, int, np.ndarray]]:
+    """
+    Yield (row_start, row_stop, km_block) slices of the src x dst haversine matrix.
+    dst defaults to src. Only one block is alive at a time.
+    """
+    a = as_latlon_array(src)
+    b = a if dst is None else as_latlon_array(dst)
+    if len(a) == 0:
+        return
+    lat_b = np.radians(b[:, 0])
+    lon_b = np.radians(b[:, 1])
+    cos_b = np.cos(lat_b)
+    step = _block_rows(len(b), block_rows)
+    for start in range(0, len(a), step):
+        stop = min(start + step, len(a))
+        lat_a = np.radians(a[start:stop, 0])[:, None]
+        lon_a = np.radians(a[start:stop, 1])[:, None]
+        # a = sin^2(dlat/2) + cos(lat1) cos(lat2) sin^2(dlon/2), computed in place
+        h = np.subtract(lat_b, lat_a)
+        h *= 0.5
+        np.sin(h, out=h)
+        h *= h
+        t = np.subtract(lon_b, lon_a)
+        t *= 0.5
+        np.sin(t, out=t)
+        t *= t
+        t *= cos_b
+        t *= np.cos(lat_a)
+        h += t
+        np.clip(h, 0.0, 1.0, out=h)
+        np.sqrt(h, out=h)
+        np.arcsin(h, out=h)
+        h *= 2 * EARTH_RADIUS_KM
+        yield start, stop, h
+
+
+def haversine_matrix(src, dst=None, unit: str = "km", block_rows: Optional[int] = None) -> np.ndarray:
+    """
+    Dense haversine matrix between src and dst (dst defaults to src).
+    unit="km" -> float64 kilometers
+    unit="m"  -> int32 meters (truncated), ready for OR-Tools
+    """
+    if unit not in UNITS:
+        raise ValueError(f"unit must be one of {UNITS}, got {unit!r}")
+    n = len(as_latlon_array(src))
+    m = n if dst is None else len(as_latlon_array(dst))
+    if unit == "km":
+        out = np.zeros((n, m), dtype=np.float64)
+        for start, stop, block in iter_haversine_blocks(src, dst, block_rows):
+            out[start:stop] = block
+    else:
+        out = np.zeros((n, m), dtype=np.int32)
+        for start, stop, block in iter_haversine_blocks(src, dst, block_rows):
+            block *= 1000.0
+            out[start:stop] = block  # float -> int32 truncates like int()
+    return out
+
+
+
+def haversine_pairs(src, dst, unit: str = "km") -> np.ndarray:
+    """Element-wise distance between src[i] and dst[i] (same units/dtypes as haversine_matrix)."""
+    if unit not in UNITS:
+        raise ValueError(f"unit must be one of {UNITS}, got {unit!r}")
+    a = np.radians(as_latlon_array(src))
+    b = np.radians(as_latlon_array(dst))
+    h = np.sin((b[:, 0] - a[:, 0]) * 0.5) ** 2 + np.cos(a[:, 0]) * np.cos(b[:, 0]) * np.sin((b[:, 1] - a[:, 1]) * 0.5) ** 2
+    km = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+    if unit == "km":
+        return km
+    return (km * 1000.0).astype(np.int32)
+
+
+def project_equal_area(coords, center: Optional[Tuple[float, float]] = None) -> np.ndarray:
+    """
+    Lambert azimuthal equal-area projection (km) about center (default: the points'
+    mean, circular in longitude). Areas are preserved and local distances stay close to
+    true, so Euclidean clustering is not stretched at high latitudes.
+    """
+    arr = as_latlon_array(coords)
+    lat = np.radians(arr[:, 0]); lon = np.radians(arr[:, 1])
+    if center is None:
+        lat0 = float(np.mean(lat)) if len(arr) else 0.0
+        lon0 = float(np.arctan2(np.mean(np.sin(lon)), np.mean(np.cos(lon)))) if len(arr) else 0.0
+    else:
+        lat0, lon0 = np.radians(center[0]), np.radians(center[1])
+    dlon = lon - lon0
+    cos_lat = np.cos(lat)
+    denom = 1.0 + np.sin(lat0) * np.sin(lat) + np.cos(lat0) * cos_lat * np.cos(dlon)
+    kp = np.sqrt(2.0 / np.maximum(denom, 1e-12))
+    x = EARTH_RADIUS_KM * kp * cos_lat * np.sin(dlon)
+    y = EARTH_RADIUS_KM * kp * (np.cos(lat0) * np.sin(lat) - np.sin(lat0) * cos_lat * np.cos(dlon))
+    return np.column_stack([x, y])
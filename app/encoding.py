@@ -0,0 +1,101 @@
+# app/encoding.py
+import json
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.distance import haversine_pairs
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib encoder
+    orjson = None
+
+FORMATS = ("full", "compact")
+POLYLINE_PRECISION = 5
+
+
+def dumps(obj) -> bytes:
+    """JSON bytes; orjson when installed (several times faster on large plans), else the stdlib."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=str, separators=(",", ":")).encode()
+
+
+def encode_polyline(points, precision: int = POLYLINE_PRECISION) -> str:
+    """
+    Google encoded polyline of [(lat, lon), ...]: zig-zag deltas of the scaled ints,
+    emitted as 5-bit chunks. Vectorised over all values; the result is byte-identical
+    to the reference algorithm.
+    """
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if not len(pts):
+        return ""
+    ints = np.rint(pts * 10 ** precision).astype(np.int64)
+    deltas = np.diff(ints, axis=0, prepend=0).ravel()
+    v = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+    # chunk count per value (>= 1), then fill a (values, max chunks) table row-wise
+    n_chunks = np.maximum(1, (np.floor(np.log2(np.maximum(v, 1))).astype(np.int64) // 5) + 1)
+    width = int(n_chunks.max())
+    shifts = np.arange(width) * 5
+    chunks = (v[:, None] >> shifts[None, :]) & 0x1F
+    more = np.arange(width)[None, :] < (n_chunks[:, None] - 1)
+    codes = (chunks | (more * 0x20)) + 63
+    keep = np.arange(width)[None, :] < n_chunks[:, None]
+    return codes[keep].astype(np.uint8).tobytes().decode("ascii")
+
+
+def decode_polyline(text: str, precision: int = POLYLINE_PRECISION) -> List[List[float]]:
+    values, shift, acc = [], 0, 0
+    for ch in text.encode("ascii"):
+        b = ch - 63
+        acc |= (b & 0x1F) << shift
+        shift += 5
+        if b < 0x20:
+            values.append(~(acc >> 1) if acc & 1 else acc >> 1)
+            shift, acc = 0, 0
+    arr = np.cumsum(np.asarray(values, dtype=np.int64).reshape(-1, 2), axis=0) / 10 ** precision
+    return arr.tolist()
+
+
+def vehicle_stats(coords, routes: List[List[int]], demands: List[int], vehicles: List[Dict]) -> List[Dict]:
+    """
+    Per route: stops, load, capacity, utilisation and closed-route meters. Routes beyond
+    the fleet size (hybrid clusters) get vehicle_id None and capacity None.
+    """
+    pts = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    dem = np.asarray(demands, dtype=np.int64)
+    stats = []
+    for v, route in enumerate(routes):
+        stops = np.asarray([n for n in route if n != 0], dtype=np.int64)
+        path = np.concatenate([[0], stops, [0]]) if len(stops) else np.zeros(0, dtype=np.int64)
+        meters = int(haversine_pairs(pts[path[:-1]], pts[path[1:]], unit="m").sum()) if len(path) else 0
+        veh = vehicles[v] if v < len(vehicles) else None
+        cap = int(veh.get("capacity", 100)) if veh else None
+        load = int(dem[stops].sum()) if len(stops) else 0
+        stats.append({"vehicle_id": veh["id"] if veh else None, "stops": int(len(stops)), "load": load,
+                      "capacity": cap, "utilisation": round(load / cap, 3) if cap else None, "distance_m": meters})
+    return stats
+
+
+def compact(body: Dict, precision: int = POLYLINE_PRECISION) -> Dict:
+    """
+    /optimize result without coords and routes_coords: one encoded polyline per route
+    (depot first) plus routes_idx, so a 10k-stop plan is a few hundred KB instead of megabytes.
+    """
+    coords = body.get("coords") or []
+    pts = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    out = {k: v for k, v in body.items() if k not in ("coords", "routes_coords")}
+    out["format"] = "compact"
+    out["depot"] = pts[0].tolist() if len(pts) else None
+    out["polyline_precision"] = precision
+    out["routes_polyline"] = [encode_polyline(pts[np.asarray(r, dtype=np.int64)], precision) if r else ""
+                              for r in body.get("routes_idx") or []]
+    return out
+
+
+def format_job(job: Dict, fmt: Optional[str]) -> Dict:
+    """A /jobs record with its result converted to fmt ("full" leaves it untouched)."""
+    if fmt == "compact" and job.get("result") and "coords" in job["result"]:
+        return dict(job, result=compact(job["result"]))
+    return job
@@ -0,0 +1,105 @@
+# app/evaluate.py
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.distance import haversine_pairs
+from app.matrix_cache import cached_distance_matrix
+from app.models import column_array, point_array
+from app.road_network import travel_time_matrix
+
+# Up to this many nodes edge costs come from the (cached) dense matrix; beyond it only the
+# edges actually used are computed, so scoring a 10k-order plan never builds a 10k x 10k matrix.
+DENSE_EVAL_MAX = 3000
+
+
+def edge_costs(pts: np.ndarray, src: np.ndarray, dst: np.ndarray, scenario_key: Optional[str] = None,
+               metric: str = "haversine") -> np.ndarray:
+    """int64 cost of each arc src[i] -> dst[i] (meters, or seconds for metric="road"), same units as the solvers."""
+    if metric == "road":
+        return travel_time_matrix(pts, metric)[0][src, dst].astype(np.int64)
+    if len(pts) <= DENSE_EVAL_MAX:
+        return cached_distance_matrix(pts, scenario_key)[0][src, dst].astype(np.int64)
+    # haversine_matrix truncates to whole meters; do the same per edge
+    return haversine_pairs(pts[src], pts[dst], unit="m").astype(np.int64)
+
+
+def evaluate_routes(depot: Dict, vehicles: List[Dict], orders, candidates: Sequence[Sequence[Sequence[str]]],
+                    scenario_key: Optional[str] = None, metric: str = "haversine") -> Dict:
+    """
+    Score many candidate plans at once. A candidate is a list of routes, routes[v] being the
+    order ids vehicle v visits in sequence (closed at the depot, as solve_vrp routes are).
+    All arcs of all candidates are gathered into flat arrays and costed, loaded and summed
+    with a handful of numpy calls, so hundreds of what-if edits score in milliseconds.
+    Raises ValueError on unknown order ids or more routes than vehicles.
+    Returns {"candidates": [{total, per-route scores, violations}], "best", "meta"}.
+    """
+    t0 = time.perf_counter()
+    ids = column_array(orders, "id", dtype=object).tolist()
+    node_of = {str(oid): i + 1 for i, oid in enumerate(ids)}
+    pts = np.vstack([[float(depot["lat"]), float(depot["lon"])], point_array(orders)])
+    demand = np.concatenate([[0], column_array(orders, "demand", 1)]).astype(np.int64)
+    caps = np.asarray([int(v.get("capacity", 100)) for v in vehicles], dtype=np.int64)
+
+    # flatten: one entry per route (candidate, vehicle) and per stop
+    stops, stop_route, route_cand, route_veh = [], [], [], []
+    for c, routes in enumerate(candidates):
+        if len(routes) > len(vehicles):
+            raise ValueError(f"candidate {c} has {len(routes)} routes for {len(vehicles)} vehicles")
+        for v, route in enumerate(routes):
+            r = len(route_cand)
+            route_cand.append(c); route_veh.append(v)
+            try:
+                stops.extend(node_of[str(oid)] for oid in route)
+            except KeyError as e:
+                raise ValueError(f"candidate {c}, route {v}: unknown order id {e.args[0]}")
+            stop_route.extend([r] * len(route))
+    n_routes, n_cand = len(route_cand), len(candidates)
+    stops = np.asarray(stops, dtype=np.int64)
+    stop_route = np.asarray(stop_route, dtype=np.int64)
+    route_cand = np.asarray(route_cand, dtype=np.int64)
+    route_veh = np.asarray(route_veh, dtype=np.int64)
+
+    # arcs: depot -> first stop, stop -> next stop within a route, last stop -> depot
+    n_stops = np.bincount(stop_route, minlength=n_routes)
+    first = np.r_[True, stop_route[1:] != stop_route[:-1]] if len(stops) else np.zeros(0, dtype=bool)
+    last = np.r_[stop_route[1:] != stop_route[:-1], True] if len(stops) else np.zeros(0, dtype=bool)
+    prev = np.where(first, 0, np.r_[0, stops[:-1]]) if len(stops) else stops
+    src = np.concatenate([prev, stops[last]])
+    dst = np.concatenate([stops, np.zeros(int(last.sum()), dtype=np.int64)])
+    arc_route = np.concatenate([stop_route, stop_route[last]])
+    cost = edge_costs(pts, src, dst, scenario_key, metric)
+
+    route_cost = np.bincount(arc_route, weights=cost, minlength=n_routes).astype(np.int64)
+    route_load = np.bincount(stop_route, weights=demand[stops], minlength=n_routes).astype(np.int64)
+    route_cap = caps[route_veh] if n_routes else np.zeros(0, dtype=np.int64)
+    overload = np.maximum(0, route_load - route_cap)
+    total = np.bincount(route_cand, weights=route_cost, minlength=n_cand).astype(np.int64)
+    total_over = np.bincount(route_cand, weights=overload, minlength=n_cand).astype(np.int64)
+
+    # coverage: each order exactly once per candidate
+    stop_cand = route_cand[stop_route] if len(stops) else stops
+    visits = np.bincount(stop_cand * len(pts) + stops, minlength=n_cand * len(pts)).reshape(n_cand, len(pts))[:, 1:]
+    unserved = (visits == 0).sum(axis=1)
+    duplicates = np.maximum(visits - 1, 0).sum(axis=1)
+
+    unit = "s" if metric == "road" else "m"
+    out, r = [], 0
+    for c in range(n_cand):
+        per_route = []
+        while r < n_routes and route_cand[r] == c:
+            per_route.append({"vehicle_id": vehicles[route_veh[r]]["id"], "stops": int(n_stops[r]),
+                              f"cost_{unit}": int(route_cost[r]), "load": int(route_load[r]),
+                              "capacity": int(route_cap[r]), "overload": int(overload[r])})
+            r += 1
+        out.append({"candidate": c, f"total_cost_{unit}": int(total[c]), "capacity_violation": int(total_over[c]),
+                    "unserved": int(unserved[c]), "duplicates": int(duplicates[c]),
+                    "feasible": bool(total_over[c] == 0 and unserved[c] == 0 and duplicates[c] == 0),
+                    "routes": per_route})
+    feasible = [e for e in out if e["feasible"]]
+    best = min(feasible, key=lambda e: e[f"total_cost_{unit}"])["candidate"] if feasible else None
+    return {"candidates": out, "best": best,
+            "meta": {"metric": metric, "unit": unit, "candidates": n_cand, "routes": n_routes, "arcs": int(len(src)),
+                     "dense_matrix": metric == "road" or len(pts) <= DENSE_EVAL_MAX,
+                     "evaluate_ms": round((time.perf_counter() - t0) * 1000, 3)}}
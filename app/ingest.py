@@ -0,0 +1,141 @@
+# app/ingest.py
+import csv
+import io
+import json
+import math
+import time
+import zlib
+from typing import Dict, List, Optional
+
+from app.models import INT_FIELD_MAX, ColumnTable
+
+# Rows parsed before they are flushed into the store; bounds memory per request.
+CHUNK_ROWS = 5000
+# Row errors kept verbatim in the response (the rest are only counted).
+MAX_ERRORS = 100
+# A line longer than this is rejected instead of being buffered further.
+MAX_LINE_BYTES = 1 << 20
+FORMATS = ("ndjson", "csv")
+
+
+def parse_order(rec: Dict) -> Dict:
+    """Validate/coerce one order record (same rules as OrderIn); raises ValueError."""
+    rid = rec.get("id")
+    if rid is None or str(rid).strip() == "":
+        raise ValueError("missing id")
+    try:
+        lat = float(rec["lat"]); lon = float(rec["lon"])
+    except KeyError as e:
+        raise ValueError(f"missing {e.args[0]}")
+    except (TypeError, ValueError):
+        raise ValueError("lat/lon must be numbers")
+    if not (math.isfinite(lat) and math.isfinite(lon)) or abs(lat) > 90 or abs(lon) > 180:
+        raise ValueError("lat/lon out of range")
+    demand = rec.get("demand")
+    try:
+        demand = 1 if demand in (None, "") else int(demand)
+    except (TypeError, ValueError):
+        raise ValueError("demand must be an integer")
+    if demand < 0:
+        raise ValueError("demand must be >= 0")
+    if demand > INT_FIELD_MAX:
+        raise ValueError(f"demand must be <= {INT_FIELD_MAX}")
+    priority = rec.get("priority") or "normal"
+    return {"id": str(rid).strip(), "lat": lat, "lon": lon, "demand": demand, "priority": str(priority)}
+
+
+class StreamIngest:
+    """
+    Incremental NDJSON / CSV (optionally gzip) parser writing straight into a ColumnTable.
+    Bytes are fed as they arrive; complete lines are parsed, validated and upserted every
+    CHUNK_ROWS rows, so memory stays at one chunk plus one partial line whatever the body size.
+    Bad rows are recorded and skipped; they never abort the batch.
+    """
+
+    def __init__(self, table: ColumnTable, fmt: str = "ndjson", gzip: Optional[bool] = None,
+                 chunk_rows: int = CHUNK_ROWS, max_errors: int = MAX_ERRORS):
+        if fmt not in FORMATS:
+            raise ValueError(f"format must be one of {FORMATS}")
+        self.table = table
+        self.fmt = fmt
+        self.gzip = gzip  # None: sniff the gzip magic on the first bytes
+        self.chunk_rows = chunk_rows
+        self.max_errors = max_errors
+        self._inflate = None
+        self._buf = b""
+        self._header: Optional[List[str]] = None
+        self._pending: List[Dict] = []
+        self.line_no = 0
+        self.stats = {"rows": 0, "added": 0, "updated": 0, "errors": 0, "bytes": 0}
+        self.errors: List[Dict] = []
+        self._t0 = time.perf_counter()
+
+    def feed(self, data: bytes):
+        if not data:
+            return
+        self.stats["bytes"] += len(data)
+        if self.gzip is None:
+            self.gzip = data[:2] == b"\x1f\x8b"
+        if self.gzip:
+            if self._inflate is None:
+                self._inflate = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            data = self._inflate.decompress(data)
+        self._buf += data
+        *lines, self._buf = self._buf.split(b"\n")
+        for line in lines:
+            self._line(line)
+        if len(self._buf) > MAX_LINE_BYTES:
+            self._error(self.line_no + 1, f"line longer than {MAX_LINE_BYTES} bytes")
+            self._buf = b""
+
+    def close(self) -> Dict:
+        """Flush the last line and chunk; returns the ingest report."""
+        if self._inflate is not None:
+            self._buf += self._inflate.flush()
+        if self._buf:
+            self._line(self._buf)
+            self._buf = b""
+        self._flush()
+        secs = time.perf_counter() - self._t0
+        return dict(self.stats, format=self.fmt, gzip=bool(self.gzip), count=len(self.table),
+                    seconds=round(secs, 3), rows_per_s=round(self.stats["rows"] / secs) if secs else None,
+                    mb_per_s=round(self.stats["bytes"] / secs / 1e6, 2) if secs else None,
+                    error_samples=self.errors)
+
+    def _error(self, line_no: int, msg: str):
+        self.stats["errors"] += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line_no, "error": msg})
+
+    def _line(self, raw: bytes):
+        self.line_no += 1
+        line = raw.strip()
+        if not line:
+            return
+        try:
+            text = line.decode("utf-8-sig" if self.line_no == 1 else "utf-8")
+            if self.fmt == "ndjson":
+                rec = json.loads(text)
+                if not isinstance(rec, dict):
+                    raise ValueError("row is not a JSON object")
+            else:
+                cells = next(csv.reader(io.StringIO(text)))
+                if self._header is None:
+                    self._header = [c.strip() for c in cells]
+                    return
+                rec = dict(zip(self._header, cells))
+            self._pending.append(parse_order(rec))
+        except (ValueError, UnicodeDecodeError) as e:
+            self._error(self.line_no, str(e))
+            return
+        self.stats["rows"] += 1
+        if len(self._pending) >= self.chunk_rows:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        added, updated = self.table.upsert(self._pending)
+        self.stats["added"] += added
+        self.stats["updated"] += updated
+        self._pending = []
@@ -1,21 +1,402 @@
 # app/jobs.py
+import multiprocessing
+import os
+import queue
+import socket
 import threading
+from collections import deque
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+from app.db_init import SessionLocal, init_db, Job as JobRow
+
+FINAL_STATES = ("done", "failed", "cancelled")
+# Intermediate solutions kept per streaming job for late subscribers.
+EVENTS_KEPT = 50
+# Live jobs' heartbeat_at is renewed this often; a pending/running row not renewed for
+# JOB_LEASE_S belongs to a dead API process and is failed by recover().
+HEARTBEAT_S = float(os.environ.get("QF_JOB_HEARTBEAT_S", "5"))
+JOB_LEASE_S = float(os.environ.get("QF_JOB_LEASE_S", str(6 * HEARTBEAT_S)))
+
+class QueueFull(Exception):
+    pass
+
+def _init_worker(inner_workers: int):
+    # solvers that fan out again (decomposed, hybrid, portfolio) get this worker's share of the CPUs,
+    # not all of them, so a full queue runs about cpu_count processes instead of cpu_count squared
+    os.environ["QF_INNER_WORKERS"] = str(inner_workers)
 
 class JobStore:
-    def __init__(self):
+    """
+    Job status/results. Live jobs are kept in memory; every transition is written
+    through to the `jobs` table, so finished results survive restarts. Rows carry the
+    owning instance and a heartbeat, so several API processes can share the table:
+    each one only ever fails jobs whose owner has stopped renewing them.
+    """
+    def __init__(self, persist: bool = True):
         self._jobs = {}
         self._lock = threading.Lock()
+        self._persist = persist
+        self._db_ready = False
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
 
-    def create_pending(self, job_id):
+    def _session(self):
+        if not self._db_ready:
+            init_db()
+            self._db_ready = True
+        return SessionLocal()
+
+    def _write(self, job_id, rec):
+        if not self._persist:
+            return
+        with self._session() as db:
+            row = db.get(JobRow, job_id) or JobRow(job_id=job_id)
+            if row.status in FINAL_STATES and row.status != rec["status"]:
+                return  # cancelled from another process, or failed by recover(): that stays the outcome
+            for k, v in rec.items():
+                setattr(row, k, v)
+            db.add(row)
+            db.commit()
+
+    def _update(self, job_id, **fields):
         with self._lock:
-            self._jobs[job_id] = {"status":"pending", "result":None}
+            rec = self._jobs.get(job_id)
+            if rec is None:
+                return None
+            if rec["status"] == "cancelled" and fields.get("status") != "cancelled":
+                return None  # a cancelled job never comes back to life
+            rec.update(fields)
+            rec = dict(rec)
+            if rec["status"] in FINAL_STATES and self._persist:
+                self._jobs.pop(job_id)  # the DB row is authoritative from here on
+        self._write(job_id, rec)
+        return rec
 
-    def save_result(self, job_id, result):
+    def create_pending(self, job_id, params=None):
+        rec = {"status": "pending", "result": None, "error": None, "params": params,
+               "created_at": time.time(), "started_at": None, "finished_at": None,
+               "owner": self.owner, "heartbeat_at": time.time()}
         with self._lock:
-            self._jobs[job_id] = {"status":"done", "result": result}
+            self._jobs[job_id] = rec
+        self._write(job_id, rec)
+
+    def mark_running(self, job_id):
+        return self._update(job_id, status="running", started_at=time.time())
+
+    def save_result(self, job_id, result):
+        return self._update(job_id, status="done", result=result, finished_at=time.time())
+
+    def save_error(self, job_id, error: str):
+        return self._update(job_id, status="failed", error=error, finished_at=time.time())
+
+    def mark_cancelled(self, job_id):
+        return self._update(job_id, status="cancelled", finished_at=time.time())
+
+    def _public(self, rec):
+        return {k: v for k, v in rec.items() if k not in ("owner", "heartbeat_at")}
 
     def get(self, job_id):
         with self._lock:
-            return self._jobs.get(job_id, {"status":"not_found", "result": None})
+            rec = self._jobs.get(job_id)
+            if rec is not None:
+                return self._public(rec)
+        if self._persist:
+            with self._session() as db:
+                row = db.get(JobRow, job_id)
+                if row is not None:
+                    return {"status": row.status, "result": row.result, "error": row.error, "params": row.params,
+                            "created_at": row.created_at, "started_at": row.started_at, "finished_at": row.finished_at}
+        return {"status": "not_found", "result": None}
+
+    def is_local(self, job_id) -> bool:
+        with self._lock:
+            return job_id in self._jobs
+
+    def cancelled(self, job_id) -> bool:
+        """Whether the job was cancelled, here or (through the DB) by another API process."""
+        with self._lock:
+            rec = self._jobs.get(job_id)
+            if rec is not None and rec["status"] == "cancelled":
+                return True
+        if not self._persist:
+            return False
+        with self._session() as db:
+            row = db.get(JobRow, job_id)
+            return row is not None and row.status == "cancelled"
+
+    def request_cancel(self, job_id) -> bool:
+        """Cancel a job owned by another process: its owner notices on its next heartbeat."""
+        if not self._persist:
+            return False
+        with self._session() as db:
+            n = (db.query(JobRow).filter(JobRow.job_id == job_id, JobRow.status.in_(("pending", "running")))
+                 .update({"status": "cancelled", "finished_at": time.time()}, synchronize_session=False))
+            db.commit()
+            return n > 0
+
+    def heartbeat(self) -> List[str]:
+        """Renew this instance's live jobs; returns the ones another process cancelled meanwhile."""
+        with self._lock:
+            live = [job_id for job_id, rec in self._jobs.items() if rec["status"] not in FINAL_STATES]
+        if not self._persist or not live:
+            return []
+        with self._session() as db:
+            db.query(JobRow).filter(JobRow.job_id.in_(live), JobRow.owner == self.owner) \
+                .update({"heartbeat_at": time.time()}, synchronize_session=False)
+            db.commit()
+            return [r.job_id for r in db.query(JobRow.job_id).filter(JobRow.job_id.in_(live),
+                                                                     JobRow.status == "cancelled")]
+
+    def recover(self):
+        """Fail pending/running jobs whose owner stopped heartbeating (crashed or restarted process)."""
+        if not self._persist:
+            return 0
+        with self._session() as db:
+            stale = time.time() - JOB_LEASE_S
+            rows = db.query(JobRow).filter(JobRow.status.in_(("pending", "running")),
+                                           (JobRow.owner == None) | (JobRow.owner != self.owner),  # noqa: E711
+                                           (JobRow.heartbeat_at == None) | (JobRow.heartbeat_at < stale)).all()  # noqa: E711
+            for row in rows:
+                row.status = "failed"; row.error = "interrupted: its API process stopped"; row.finished_at = time.time()
+            db.commit()
+            return len(rows)
 
 Job = JobStore()
+
+
+class JobChannel:
+    """
+    Picklable link between a solve in a worker process and the API process: the worker
+    publishes intermediate solutions and polls the stop flag (both are manager proxies).
+    """
+    def __init__(self, events, stop):
+        self.events = events
+        self.stop = stop
+
+    def publish(self, event: Dict):
+        self.events.put(event)
+
+    def stopped(self) -> bool:
+        return self.stop.is_set()
+
+
+class JobQueue:
+    """
+    Bounded solve queue. Dispatcher threads (one per worker) hand jobs to a process
+    pool of the same size, so at most `max_workers` solves run at once and at most
+    `max_pending` jobs (queued + running) are accepted before submit() raises QueueFull.
+    Pending jobs can be cancelled outright. Cancelling a running streaming job asks its
+    search to stop now; other running jobs keep their worker until the (time-limited) solve
+    returns. Either way a cancelled job's result is dropped: on_done is not called and
+    nothing is stored. Jobs submitted with the same `key` while one is still active share that job.
+    With several API processes on one DB, each queue owns the jobs it accepted: start()
+    runs a heartbeat that renews them, applies cancels made through other processes and
+    fails the jobs of processes that died. Events, stop() and coalescing are per process.
+    """
+    def __init__(self, store: JobStore, max_workers: Optional[int] = None, max_pending: Optional[int] = None):
+        self.store = store
+        self.max_workers = max_workers or int(os.environ.get("QF_JOB_WORKERS", os.cpu_count() or 2))
+        self.max_pending = max_pending or int(os.environ.get("QF_JOB_MAX_PENDING", 4 * self.max_workers))
+        self._active: Dict[str, Dict] = {}
+        self._by_key: Dict[str, str] = {}
+        self._coalesced = 0
+        self._lock = threading.Lock()
+        self._dispatch = None
+        self._procs = None
+        self._manager = None
+        self._heartbeat = None
+        self._closed = threading.Event()
+
+    def start(self):
+        """Recover jobs of dead processes now and keep doing it (plus renewing ours) in the background."""
+        self.store.recover()
+        if self._heartbeat is None:
+            self._heartbeat = threading.Thread(target=self._beat, name="job-heartbeat", daemon=True)
+            self._heartbeat.start()
+
+    def _beat(self):
+        while not self._closed.wait(HEARTBEAT_S):
+            try:
+                for job_id in self.store.heartbeat():
+                    self._cancel_local(job_id)
+                self.store.recover()
+            except Exception:
+                pass  # a DB hiccup must not end the heartbeat; the next beat retries
+
+    def _pools(self):
+        # created lazily so importing the API module does not fork workers
+        if self._dispatch is None:
+            self._dispatch = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job-dispatch")
+        if self._procs is None:
+            share = max(1, (os.cpu_count() or 1) // self.max_workers)
+            self._procs = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker, initargs=(share,))
+        return self._dispatch, self._procs
+
+    def submit(self, fn, *args, params=None, time_budget: Optional[float] = None, on_done=None,
+               key: Optional[str] = None, stream: bool = False, prepare=None, **kwargs) -> str:
+        """
+        on_done(result) runs in this process, before the result is stored.
+        key: coalescing key; if a job with it is still pending/running its id is returned instead.
+        stream: fn gets channel=JobChannel; what it publishes is readable through events(),
+          and stop() asks it to finish early with what it has.
+        prepare(kwargs) runs in this process (dispatch thread) just before fn goes to a worker and may
+          add keyword arguments, e.g. inputs built from caches that live in the API process.
+        """
+        with self._lock:
+            if key is not None and key in self._by_key:
+                self._coalesced += 1
+                return self._by_key[key]
+            if len(self._active) >= self.max_pending:
+                raise QueueFull(f"{len(self._active)} jobs pending (limit {self.max_pending})")
+            job_id = uuid.uuid4().hex
+            self.store.create_pending(job_id, params)
+            dispatch, _ = self._pools()
+            entry = {"budget": time_budget, "key": key}
+            if stream:
+                if self._manager is None:
+                    self._manager = multiprocessing.Manager()
+                entry["channel"] = kwargs["channel"] = JobChannel(self._manager.Queue(), self._manager.Event())
+                entry["events"] = deque(maxlen=EVENTS_KEPT)
+                entry["seq"] = 0
+            self._active[job_id] = entry
+            if key is not None:
+                self._by_key[key] = job_id
+            entry["future"] = dispatch.submit(self._run, job_id, fn, args, kwargs, on_done, prepare)
+        return job_id
+
+    def complete(self, result, params=None) -> str:
+        """Record an already available result (e.g. a cache hit) as a finished job."""
+        job_id = uuid.uuid4().hex
+        self.store.create_pending(job_id, params)
+        self.store.save_result(job_id, result)
+        return job_id
+
+    def _forget_locked(self, job_id):
+        entry = self._active.pop(job_id, None)
+        if entry is not None and entry["key"] is not None and self._by_key.get(entry["key"]) == job_id:
+            del self._by_key[entry["key"]]
+
+    def _run(self, job_id, fn, args, kwargs, on_done=None, prepare=None):
+        try:
+            if self.store.mark_running(job_id) is None:
+                return
+            try:
+                if prepare is not None:
+                    prepare(kwargs)
+                with self._lock:
+                    _, procs = self._pools()
+                fut = procs.submit(fn, *args, **kwargs)
+                channel = kwargs.get("channel")
+                if channel is not None:
+                    self._pump(job_id, channel, fut)
+                result = fut.result()
+                if self.store.cancelled(job_id):
+                    return  # cancelled meanwhile: the result must not reach caches or warm starts
+                if on_done is not None:
+                    on_done(result)
+            except BrokenProcessPool:
+                with self._lock:
+                    self._procs = None  # a worker died; start a fresh pool for the next job
+                self.store.save_error(job_id, "worker process died")
+            except Exception as e:
+                self.store.save_error(job_id, f"{type(e).__name__}: {e}")
+            else:
+                self.store.save_result(job_id, result)
+        finally:
+            with self._lock:
+                self._forget_locked(job_id)
+
+    def _pump(self, job_id, channel: JobChannel, fut):
+        # move published solutions from the manager queue into the job's event buffer
+        while True:
+            try:
+                event = channel.events.get(timeout=0.2)
+            except queue.Empty:
+                if fut.done():
+                    return
+                continue
+            with self._lock:
+                entry = self._active.get(job_id)
+                if entry is not None:
+                    entry["seq"] += 1
+                    entry["events"].append(dict(event, seq=entry["seq"]))
+
+    def events(self, job_id, after: int = 0) -> Tuple[List[Dict], bool]:
+        """Buffered intermediate solutions with seq > after, and whether the job is still active."""
+        with self._lock:
+            entry = self._active.get(job_id)
+            if entry is None:
+                return [], False
+            return [e for e in entry.get("events", ()) if e["seq"] > after], True
+
+    def stop(self, job_id) -> bool:
+        """Ask a running streaming job to finish now and keep its best solution."""
+        with self._lock:
+            entry = self._active.get(job_id)
+            channel = entry.get("channel") if entry else None
+        if channel is None:
+            return False
+        channel.stop.set()
+        return True
+
+    def _cancel_local(self, job_id) -> bool:
+        with self._lock:
+            entry = self._active.get(job_id)
+            if entry is None:
+                return False
+            if entry["future"].cancel():
+                self._forget_locked(job_id)
+            else:
+                if entry["key"] is not None:
+                    self._by_key.pop(entry["key"], None)  # new identical requests must not join a cancelled job
+                if entry.get("channel") is not None:
+                    entry["channel"].stop.set()  # free the worker now instead of at the time limit
+        self.store.mark_cancelled(job_id)
+        return True
+
+    def cancel(self, job_id) -> bool:
+        # a job of another API process is cancelled in the DB; its owner stops it on the next heartbeat
+        return self._cancel_local(job_id) or self.store.request_cancel(job_id)
+
+    def status(self, job_id) -> Dict:
+        rec = self.store.get(job_id)
+        status = rec["status"]
+        if status == "done":
+            progress = 1.0
+        elif status == "running":
+            # OR-Tools runs until its time limit, so elapsed/budget is a fair estimate
+            with self._lock:
+                budget = (self._active.get(job_id) or {}).get("budget")
+            elapsed = time.time() - (rec.get("started_at") or time.time())
+            progress = round(min(0.99, elapsed / budget), 3) if budget else None
+        else:
+            progress = 0.0
+        return dict(rec, job_id=job_id, progress=progress)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"workers": self.max_workers, "max_pending": self.max_pending, "active": len(self._active),
+                    "coalesced": self._coalesced}
+
+    def is_local(self, job_id) -> bool:
+        with self._lock:
+            return job_id in self._active
+
+    def shutdown(self):
+        self._closed.set()
+        with self._lock:
+            for entry in self._active.values():
+                entry["future"].cancel()
+            dispatch, procs, manager = self._dispatch, self._procs, self._manager
+            self._dispatch = self._procs = self._manager = None
+        if procs is not None:
+            procs.shutdown(wait=False, cancel_futures=True)
+        if dispatch is not None:
+            dispatch.shutdown(wait=False, cancel_futures=True)
+        if manager is not None:
+            manager.shutdown()
+
+QUEUE = JobQueue(Job)
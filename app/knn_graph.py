@@ -0,0 +1,134 @@
+# app/knn_graph.py
+import math
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from sklearn.neighbors import KDTree
+
+from app.distance import EARTH_RADIUS_KM, as_latlon_array, haversine_matrix, haversine_pairs, project_equal_area
+
+# Candidate arcs kept per node.
+DEFAULT_K = 16
+
+
+class KnnGraph:
+    """
+    Sparse candidate-arc set: each point's k nearest neighbours, found with a KD-tree
+    on equal-area projected coordinates and stored with exact haversine lengths (km).
+    Build time is O(n log n) and memory O(n * k). Any other arc is computed exactly
+    on demand (see `arc`), so callers never need the dense matrix.
+    """
+
+    def __init__(self, coords, k: int = DEFAULT_K):
+        self.pts = as_latlon_array(coords)
+        n = len(self.pts)
+        self.k = max(0, min(int(k), n - 1))
+        if self.k == 0:
+            self.neighbors = np.zeros((n, 0), dtype=np.int32)
+            self.dist_km = np.zeros((n, 0))
+        else:
+            xy = project_equal_area(self.pts)
+            _, idx = KDTree(xy).query(xy, k=self.k + 1)
+            # drop each point itself (duplicates may put it anywhere in the row)
+            keep = idx != np.arange(n)[:, None]
+            keep[keep.sum(axis=1) > self.k, -1] = False
+            self.neighbors = idx[keep].reshape(n, self.k).astype(np.int32)
+            src = np.repeat(np.arange(n), self.k)
+            d = haversine_pairs(self.pts[src], self.pts[self.neighbors.ravel()], unit="km").reshape(n, self.k)
+            # projected order is only approximately great-circle order: re-sort on exact length
+            order = np.argsort(d, axis=1, kind="stable")
+            self.neighbors = np.take_along_axis(self.neighbors, order, axis=1)
+            self.dist_km = np.take_along_axis(d, order, axis=1)
+        self._lat = np.radians(self.pts[:, 0]).tolist()
+        self._lon = np.radians(self.pts[:, 1]).tolist()
+        self._coslat = np.cos(np.radians(self.pts[:, 0])).tolist()
+        self.arcs_computed = 0
+
+    def __len__(self):
+        return len(self.pts)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.neighbors.nbytes + self.dist_km.nbytes)
+
+    def arc(self, i: int, j: int) -> float:
+        """
+        Exact haversine km between points i and j, computed on demand. A scalar
+        great-circle evaluation costs about as much as a dict lookup, so nothing is memoised.
+        """
+        if i == j:
+            return 0.0
+        self.arcs_computed += 1
+        h = math.sin((self._lat[j] - self._lat[i]) * 0.5) ** 2 + \
+            self._coslat[i] * self._coslat[j] * math.sin((self._lon[j] - self._lon[i]) * 0.5) ** 2
+        return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, h)))
+
+    def to_csr(self):
+        """Candidate arcs as a scipy.sparse CSR matrix (km)."""
+        from scipy.sparse import csr_matrix
+        n = len(self.pts)
+        indptr = np.arange(0, n * self.k + 1, self.k)
+        return csr_matrix((self.dist_km.ravel(), self.neighbors.ravel(), indptr), shape=(n, n))
+
+    def stats(self) -> Dict:
+        return {"nodes": len(self.pts), "k": self.k, "arcs": int(self.neighbors.size),
+                "bytes": self.nbytes, "arcs_computed": self.arcs_computed}
+
+
+class LazyDistance:
+    """
+    Read-only, matrix-like view of haversine km over a KnnGraph's points: supports
+    d[i, j], d[rows, cols] (element-wise) and d[i] (a full row), nothing is stored
+    densely. With dummy=(to_first, to_others) an extra last node is appended whose
+    distance is to_first to node 0 and to_others to every other node.
+    """
+
+    def __init__(self, graph: KnnGraph, dummy: Optional[Tuple[float, float]] = None):
+        self.graph = graph
+        self.n = len(graph)
+        self.dummy = dummy
+
+    def __len__(self):
+        return self.n + (1 if self.dummy else 0)
+
+    def with_dummy(self, to_first: float, to_others: float) -> "LazyDistance":
+        return LazyDistance(self.graph, (to_first, to_others))
+
+    def _dummy_cost(self, other):
+        to_first, to_others = self.dummy
+        if isinstance(other, np.ndarray):
+            return np.where(other == self.n, 0.0, np.where(other == 0, to_first, to_others))
+        return 0.0 if other == self.n else (to_first if other == 0 else to_others)
+
+    def pair(self, i, j) -> float:
+        """Scalar d(i, j); what tour operators use for the few arcs their batched scans leave."""
+        if self.dummy and (i == self.n or j == self.n):
+            return self._dummy_cost(j if i == self.n else i)
+        return self.graph.arc(int(i), int(j))
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            i = int(key)
+            if self.dummy and i == self.n:
+                return self._dummy_cost(np.arange(self.n + 1))
+            row = haversine_matrix(self.graph.pts[[i]], self.graph.pts, unit="km")[0]
+            if self.dummy:
+                row = np.append(row, self.dummy[0] if i == 0 else self.dummy[1])
+            return row
+        i, j = key
+        if not (isinstance(i, np.ndarray) or isinstance(j, np.ndarray)):
+            return self.pair(i, j)
+        i, j = np.broadcast_arrays(np.asarray(i), np.asarray(j))
+        out = np.empty(i.shape)
+        real = (i < self.n) & (j < self.n)
+        out[real] = haversine_pairs(self.graph.pts[i[real]], self.graph.pts[j[real]], unit="km")
+        if self.dummy and not real.all():
+            from_dummy = i == self.n
+            out[from_dummy] = self._dummy_cost(j[from_dummy])
+            to_dummy = (j == self.n) & ~from_dummy
+            out[to_dummy] = self._dummy_cost(i[to_dummy])
+        return out
+
+    def max_bound(self) -> float:
+        """Upper bound on any real distance (twice the largest distance from the first point)."""
+        return 2.0 * float(haversine_matrix(self.graph.pts[:1], self.graph.pts, unit="km").max())
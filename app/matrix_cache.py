@@ -0,0 +1,155 @@
+# app/matrix_cache.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+
+from app.distance import as_latlon_array, haversine_matrix
+
+# Total bytes of cached matrices kept across all scenarios (LRU evicted beyond this).
+DEFAULT_MAX_BYTES = int(float(os.environ.get("QF_MATRIX_CACHE_MB", "256")) * 1024 * 1024)
+
+
+class _Entry:
+    __slots__ = ("index", "matrix")
+
+    def __init__(self, index: Dict[tuple, int], matrix: np.ndarray):
+        self.index = index      # (lat, lon) -> row in matrix
+        self.matrix = matrix    # int32 meters, rows/cols in the order of the last request
+
+
+def _index_of(pts: np.ndarray) -> Dict[tuple, int]:
+    return {p: i for i, p in enumerate(map(tuple, pts.tolist()))}
+
+
+def _dedupe(pts: np.ndarray):
+    """(distinct points in first-seen order, row of each input point among them); None when all distinct."""
+    if len(pts) < 2:
+        return pts, None
+    _, first, inverse = np.unique(pts, axis=0, return_index=True, return_inverse=True)
+    if len(first) == len(pts):
+        return pts, None
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return pts[first[order]], rank[inverse.ravel()]
+
+
+class MatrixCache:
+    """
+    Incremental int32 (meters) distance-matrix cache, one entry per scenario key.
+    Points are identified by their (lat, lon); repeated points share one cached row and
+    are expanded back to the requested layout on return. When a request adds k points only the
+    k new rows/columns are computed; removed points are sliced out without any
+    haversine work. Entries are LRU-evicted once the byte budget is exceeded.
+    Returned matrices are shared with the cache and must be treated as read-only.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = int(max_bytes)
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "partial_hits": 0, "misses": 0, "evictions": 0,
+                       "cells_computed": 0, "cells_reused": 0}
+
+    def get(self, coords, key: str = "default"):
+        """Return (matrix, info) for coords; info describes how this lookup was served."""
+        pts = as_latlon_array(coords)
+        requested = len(pts)
+        pts, expand = _dedupe(pts)  # the entry holds distinct points only, so repeats still hit
+        n = len(pts)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry.matrix.nbytes
+
+        if entry is None:
+            matrix = haversine_matrix(pts, unit="m")
+            index = _index_of(pts)
+            info = {"result": "miss", "computed_rows": n, "reused_rows": 0}
+            computed, reused = n * n, 0
+        else:
+            lookup = [entry.index.get(p, -1) for p in map(tuple, pts.tolist())]
+            old_rows = np.asarray(lookup, dtype=np.int64)
+            found = old_rows >= 0
+            if found.all() and len(entry.index) == n and np.array_equal(old_rows, np.arange(n)):
+                matrix, index = entry.matrix, entry.index
+                info = {"result": "hit", "computed_rows": 0, "reused_rows": n}
+                computed, reused = 0, n * n
+            else:
+                keep_pos = np.flatnonzero(found)
+                new_pos = np.flatnonzero(~found)
+                matrix = np.empty((n, n), dtype=np.int32)
+                matrix[np.ix_(keep_pos, keep_pos)] = entry.matrix[np.ix_(old_rows[keep_pos], old_rows[keep_pos])]
+                if len(new_pos):
+                    rows = haversine_matrix(pts[new_pos], pts, unit="m")
+                    matrix[new_pos, :] = rows
+                    matrix[:, new_pos] = rows.T
+                index = _index_of(pts)
+                info = {"result": "partial" if len(keep_pos) else "miss",
+                        "computed_rows": int(len(new_pos)), "reused_rows": int(len(keep_pos))}
+                computed = len(new_pos) * (2 * n - len(new_pos))
+                reused = len(keep_pos) * len(keep_pos)
+
+        with self._lock:
+            s = self._stats
+            s[{"hit": "hits", "partial": "partial_hits", "miss": "misses"}[info["result"]]] += 1
+            s["cells_computed"] += int(computed)
+            s["cells_reused"] += int(reused)
+            if matrix.nbytes <= self.max_bytes:
+                stale = self._entries.pop(key, None)  # a concurrent get for the same key
+                if stale is not None:
+                    self._bytes -= stale.matrix.nbytes
+                self._entries[key] = _Entry(index, matrix)
+                self._bytes += matrix.nbytes
+                self._evict_locked()
+        if expand is not None:
+            matrix = matrix[np.ix_(expand, expand)]
+            info["duplicates"] = requested - n
+        return matrix, info
+
+    def _evict_locked(self):
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, old = self._entries.popitem(last=False)
+            self._bytes -= old.matrix.nbytes
+            self._stats["evictions"] += 1
+
+    def discard(self, key: str):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry.matrix.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), bytes=self._bytes, max_bytes=self.max_bytes)
+
+
+MATRIX_CACHE = MatrixCache()
+
+
+def cached_distance_matrix(coords, key: Optional[str] = "default"):
+    """int32 meters matrix for coords through the shared cache (key=None bypasses it)."""
+    if key is None:
+        return haversine_matrix(coords, unit="m"), {"result": "bypass"}
+    return MATRIX_CACHE.get(coords, key)
+
+
+def prebuilt_matrix(coords, key: str = "default"):
+    """
+    (matrix, info) through this process's cache, with the cache stats and build seconds in info,
+    ready to hand to solve_vrp(matrix=...) in a job worker. Solves run in worker processes, so the
+    API process builds their matrices: one cache and one byte budget, whichever worker solves.
+    """
+    t = time.perf_counter()
+    matrix, info = MATRIX_CACHE.get(coords, key)
+    return matrix, dict(info, **MATRIX_CACHE.stats(), build_s=round(time.perf_counter() - t, 4))
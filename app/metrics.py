@@ -0,0 +1,161 @@
+# app/metrics.py
+import cProfile
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Sequence, Tuple
+
+# Seconds buckets shared by request and stage histograms.
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+SIZE_BUCKETS = (10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+# Opt-in: solves slower than this many seconds leave a cProfile dump in PROFILE_DIR.
+PROFILE_SLOW_S = float(os.environ["QF_PROFILE_SLOW_S"]) if os.environ.get("QF_PROFILE_SLOW_S") else None
+PROFILE_DIR = os.environ.get("QF_PROFILE_DIR", "profiles")
+
+
+class Timings:
+    """Per-stage wall-clock durations of one solve (stages may repeat; durations add up)."""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.size: Dict[str, int] = {}
+        self._t0 = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t)
+
+    def add(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def as_dict(self) -> Dict:
+        return {"stages": {k: round(v, 4) for k, v in self.stages.items()}, "size": dict(self.size),
+                "total_s": round(time.perf_counter() - self._t0, 4)}
+
+
+def _labels(names: Sequence[str], values: Tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            for lv, v in sorted(self._values.items()):
+                yield f"{self.name}{_labels(self.labels, lv)} {v:g}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = TIME_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, tuple(labels), tuple(buckets)
+        self._values: Dict[Tuple, list] = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            row = self._values.setdefault(label_values, [0] * len(self.buckets) + [0.0, 0])
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            for lv, row in sorted(self._values.items()):
+                for b, n in zip(self.buckets, row):
+                    yield f"{self.name}_bucket{_labels(self.labels + ('le',), lv + (f'{b:g}',))} {n}"
+                yield f"{self.name}_bucket{_labels(self.labels + ('le',), lv + ('+Inf',))} {row[-1]}"
+                yield f"{self.name}_sum{_labels(self.labels, lv)} {row[-2]:g}"
+                yield f"{self.name}_count{_labels(self.labels, lv)} {row[-1]}"
+
+
+class Registry:
+    """Tiny Prometheus text-format registry (counters, histograms, gauges read at scrape time)."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, *args, **kwargs) -> Counter:
+        m = Counter(*args, **kwargs); self.metrics.append(m); return m
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        m = Histogram(*args, **kwargs); self.metrics.append(m); return m
+
+    def render(self, gauges: Optional[Dict[str, float]] = None) -> str:
+        lines = []
+        for m in self.metrics:
+            lines.extend(m.render())
+        for name, value in (gauges or {}).items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+HTTP_REQUESTS = REGISTRY.counter("qf_http_requests_total", "HTTP requests", ("method", "path", "status"))
+HTTP_SECONDS = REGISTRY.histogram("qf_http_request_duration_seconds", "HTTP request latency", ("method", "path"))
+SOLVES = REGISTRY.counter("qf_solves_total", "Finished solves", ("solver", "outcome"))
+SOLVE_STAGE_SECONDS = REGISTRY.histogram("qf_solve_stage_seconds", "Time per solve stage", ("solver", "stage"))
+SOLVE_ORDERS = REGISTRY.histogram("qf_solve_orders", "Orders per solve", ("solver",), buckets=SIZE_BUCKETS)
+
+
+def record_solve(solver: str, meta: Dict):
+    """Feed one finished solve's meta.timings into the histograms (runs in the API process)."""
+    timings = meta.get("timings") or {}
+    SOLVES.inc(solver, "no_solution" if meta.get("msg") else "ok")
+    for stage, secs in (timings.get("stages") or {}).items():
+        SOLVE_STAGE_SECONDS.observe(secs, solver, stage)
+    if "total_s" in timings:
+        SOLVE_STAGE_SECONDS.observe(timings["total_s"], solver, "total")
+    if "orders" in (timings.get("size") or {}):
+        SOLVE_ORDERS.observe(timings["size"]["orders"], solver)
+
+
+def flat_gauges(prefix: str, stats: Dict) -> Dict[str, float]:
+    """{"hits": 3, ...} -> {"<prefix>_hits": 3, ...} for Registry.render."""
+    return {f"{prefix}_{k}": v for k, v in stats.items()}
+
+
+@contextmanager
+def profile_if_slow(label: str, threshold: Optional[float] = PROFILE_SLOW_S, out: Optional[Dict] = None):
+    """
+    Run the block under cProfile when a threshold is configured and keep the dump
+    (PROFILE_DIR/<label>-<time>.prof) only if the block took longer. out["profile"] gets the path.
+    """
+    if threshold is None:
+        yield
+        return
+    prof = cProfile.Profile()
+    t = time.perf_counter()
+    prof.enable()
+    try:
+        yield
+    finally:
+        prof.disable()
+        if time.perf_counter() - t >= threshold:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"{label}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof")
+            prof.dump_stats(path)
+            if out is not None:
+                out["profile"] = path
@@ -1,32 +1,262 @@
 # app/models.py
-from typing import List, Dict
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 
-# In-memory stores (MVP)
-DEPOT = None  # dict: {"lat":..., "lon":...}
-VEHICLES: List[Dict] = []  # each: {"id": str, "start_lat":..., "start_lon":..., "capacity": int}
-ORDERS: List[Dict] = []    # each: {"id": str, "lat":..., "lon":..., "demand": int, "priority": str}
+import numpy as np
 
-def set_depot(lat: float, lon: float):
-    global DEPOT
-    DEPOT = {"lat": float(lat), "lon": float(lon)}
+# Column types per record kind; the two coordinate fields are stored together as an (n, 2) block.
+ORDER_FIELDS = {"id": object, "lat": np.float64, "lon": np.float64, "demand": np.int32, "priority": object}
+ORDER_DEFAULTS = {"demand": 1, "priority": "normal"}
+VEHICLE_FIELDS = {"id": object, "start_lat": np.float64, "start_lon": np.float64, "capacity": np.int32}
+VEHICLE_DEFAULTS = {"capacity": 100}
+# Largest demand/capacity the int32 columns hold; the API rejects anything above it.
+INT_FIELD_MAX = int(np.iinfo(np.int32).max)
 
-def get_depot():
-    return DEPOT
 
-def save_vehicles(vehicles: List[Dict]):
-    global VEHICLES
-    VEHICLES = vehicles
+class TableView:
+    """
+    Frozen rows of a ColumnTable. Reads like a list of dicts (which is what the solvers
+    index into for ids), but the columns are arrays: `points` is the (n, 2) coordinate
+    block and `column(name)` any other field. Pickles as a handful of arrays.
+    """
 
-def get_vehicles():
-    return VEHICLES
+    def __init__(self, point: Tuple[str, str], points: np.ndarray, columns: Dict[str, np.ndarray]):
+        self.point = point
+        self.points = points
+        self.columns = columns
 
-def save_orders(orders: List[Dict]):
-    global ORDERS
-    ORDERS = orders
+    def __len__(self):
+        return len(self.points)
 
-def get_orders():
-    return ORDERS
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        lat, lon = self.points[i].tolist()
+        row = {self.point[0]: lat, self.point[1]: lon}
+        for name, col in self.columns.items():
+            row[name] = col[i] if col.dtype.kind == "O" else col[i].item()
+        return row
 
-def clear_all():
-    global DEPOT, VEHICLES, ORDERS
-    DEPOT = None; VEHICLES = []; ORDERS = []
+    def __iter__(self):
+        names = list(self.columns)
+        cols = [self.columns[name].tolist() for name in names]
+        for (lat, lon), *values in zip(self.points.tolist(), *cols):
+            row = {self.point[0]: lat, self.point[1]: lon}
+            row.update(zip(names, values))
+            yield row
+
+    def column(self, name: str) -> np.ndarray:
+        if name in self.point:
+            return self.points[:, self.point.index(name)]
+        return self.columns[name]
+
+    def take(self, idxs: Sequence[int]) -> "TableView":
+        idxs = np.asarray(idxs, dtype=np.int64)
+        return TableView(self.point, self.points[idxs], {k: v[idxs] for k, v in self.columns.items()})
+
+
+class ColumnTable:
+    """
+    Append / patch / delete-by-id record store kept column-wise in growable NumPy arrays
+    with an id -> row index. Appends are amortised O(1) per row, patches O(1), deletes
+    one O(n) compaction per call. points()/column() are read-only views of the live
+    arrays; snapshot() copies the used rows for a solve that runs while the table changes.
+    """
+
+    def __init__(self, fields: Dict[str, type], defaults: Dict, point: Tuple[str, str], capacity: int = 64):
+        self.fields = fields
+        self.defaults = defaults
+        self.point = point
+        self.version = 0
+        self._lock = threading.RLock()
+        self._reset(capacity)
+
+    def _reset(self, capacity: int):
+        self._n = 0
+        self._points = np.empty((capacity, 2), dtype=np.float64)
+        self._cols = {f: np.empty(capacity, dtype=t) for f, t in self.fields.items() if f not in self.point}
+        self._row: Dict[str, int] = {}
+        self._records: Optional[List[Dict]] = None
+        self.version += 1
+
+    def __len__(self):
+        return self._n
+
+    def __contains__(self, rid) -> bool:
+        return str(rid) in self._row
+
+    def _grow(self, need: int):
+        cap = len(self._points)
+        if need <= cap:
+            return
+        cap = max(need, 2 * cap)
+        points = np.empty((cap, 2), dtype=np.float64)
+        points[:self._n] = self._points[:self._n]
+        self._points = points
+        for f, col in self._cols.items():
+            new = np.empty(cap, dtype=col.dtype)
+            new[:self._n] = col[:self._n]
+            self._cols[f] = new
+
+    def _set(self, row: int, fields: Dict):
+        for f, v in fields.items():
+            if f in self.point:
+                self._points[row, self.point.index(f)] = v
+            else:
+                self._cols[f][row] = v
+
+    def upsert(self, records: Iterable[Dict]) -> Tuple[int, int]:
+        """
+        Insert new ids and patch existing ones (only the given, non-None fields change).
+        New records need both coordinate fields. Returns (added, updated).
+        """
+        merged: Dict[str, Dict] = {}
+        for r in records:
+            if r.get("id") is None:
+                raise ValueError("every record needs an id")
+            merged.setdefault(str(r["id"]), {}).update({k: v for k, v in r.items() if v is not None and k != "id"})
+        for rid, fields in merged.items():
+            unknown = set(fields) - set(self.fields)
+            if unknown:
+                raise ValueError(f"record {rid!r} has unknown fields {sorted(unknown)}")
+            for f, v in fields.items():
+                # checked up front: numpy raises OverflowError halfway through a batch otherwise
+                if np.dtype(self.fields[f]).kind == "i" and isinstance(v, (int, np.integer)):
+                    info = np.iinfo(self.fields[f])
+                    if not info.min <= v <= info.max:
+                        raise ValueError(f"record {rid!r}: {f}={v} is outside [{info.min}, {info.max}]")
+        with self._lock:
+            new = [(rid, fields) for rid, fields in merged.items() if rid not in self._row]
+            for rid, fields in new:
+                missing = [f for f in self.point if f not in fields]
+                if missing:
+                    raise ValueError(f"new record {rid!r} is missing {', '.join(missing)}")
+            for rid, fields in merged.items():
+                if rid in self._row:
+                    self._set(self._row[rid], fields)
+            if new:
+                start = self._n
+                self._grow(start + len(new))
+                end = start + len(new)
+                self._points[start:end] = [[fields[self.point[0]], fields[self.point[1]]] for _, fields in new]
+                for f, col in self._cols.items():
+                    if f == "id":
+                        col[start:end] = [rid for rid, _ in new]
+                    else:
+                        col[start:end] = [fields.get(f, self.defaults.get(f)) for _, fields in new]
+                for i, (rid, _) in enumerate(new):
+                    self._row[rid] = start + i
+                self._n = end
+            self._records = None
+            self.version += 1
+        return len(new), len(merged) - len(new)
+
+    def replace(self, records: Iterable[Dict]) -> int:
+        records = list(records)
+        with self._lock:
+            self._reset(max(64, len(records)))
+            self.upsert(records)
+            return self._n
+
+    def patch(self, rid: str, fields: Dict):
+        """Update one existing record; KeyError if the id is unknown."""
+        with self._lock:
+            if str(rid) not in self._row:
+                raise KeyError(rid)
+            self.upsert([dict(fields, id=str(rid))])
+
+    def delete(self, ids: Iterable[str]) -> List[str]:
+        """Remove records by id (rows keep their relative order); returns the ids that existed."""
+        with self._lock:
+            rows = {self._row[str(i)]: str(i) for i in ids if str(i) in self._row}
+            if not rows:
+                return []
+            keep = np.ones(self._n, dtype=bool)
+            keep[list(rows)] = False
+            m = int(keep.sum())
+            self._points[:m] = self._points[:self._n][keep]
+            for col in self._cols.values():
+                col[:m] = col[:self._n][keep]
+            self._n = m
+            self._row = {rid: i for i, rid in enumerate(self._cols["id"][:m].tolist())}
+            self._records = None
+            self.version += 1
+            return list(rows.values())
+
+    def get(self, rid: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._row.get(str(rid))
+            return None if row is None else TableView(self.point, self._points, self._cols)[row]
+
+    def points(self) -> np.ndarray:
+        """Read-only (n, 2) view of the coordinate block (no copy)."""
+        v = self._points[:self._n]
+        v.flags.writeable = False
+        return v
+
+    def column(self, name: str) -> np.ndarray:
+        """Read-only view of one column (no copy)."""
+        if name in self.point:
+            return self.points()[:, self.point.index(name)]
+        v = self._cols[name][:self._n]
+        v.flags.writeable = False
+        return v
+
+    def snapshot(self) -> TableView:
+        with self._lock:
+            return TableView(self.point, self._points[:self._n].copy(),
+                             {f: col[:self._n].copy() for f, col in self._cols.items()})
+
+    def records(self) -> List[Dict]:
+        """All rows as dicts; built once per version."""
+        with self._lock:
+            if self._records is None:
+                self._records = list(self.snapshot())
+            return self._records
+
+
+def point_array(rows, point: Tuple[str, str] = ("lat", "lon")) -> np.ndarray:
+    """(n, 2) coordinates of rows: the column block of a TableView, or extracted from dicts."""
+    if isinstance(rows, TableView):
+        return rows.points
+    return np.array([(float(r[point[0]]), float(r[point[1]])) for r in rows], dtype=np.float64).reshape(-1, 2)
+
+
+def column_array(rows, name: str, default=None, dtype=np.int64) -> np.ndarray:
+    if isinstance(rows, TableView):
+        return rows.column(name).astype(dtype, copy=False)
+    return np.array([r.get(name, default) for r in rows], dtype=dtype)
+
+
+def take_rows(rows, idxs: Sequence[int]):
+    """Subset of rows in idxs order, staying columnar for a TableView."""
+    if isinstance(rows, TableView):
+        return rows.take(idxs)
+    return [rows[i] for i in idxs]
+
+
+# Single-scenario helpers (legacy callers); the state lives in app.scenarios.SCENARIOS.
+def _store():
+    from app.scenarios import SCENARIOS  # scenarios imports this module
+    return SCENARIOS
+
+def set_depot(lat: float, lon: float, scenario_id: str = "default"):
+    _store().set_depot(scenario_id, lat, lon)
+
+def get_depot(scenario_id: str = "default"):
+    return _store().get(scenario_id).depot
+
+def save_vehicles(vehicles: List[Dict], scenario_id: str = "default"):
+    _store().replace(scenario_id, "vehicles", vehicles)
+
+def get_vehicles(scenario_id: str = "default"):
+    return _store().get(scenario_id).vehicles.records()
+
+def save_orders(orders: List[Dict], scenario_id: str = "default"):
+    _store().replace(scenario_id, "orders", orders)
+
+def get_orders(scenario_id: str = "default") -> TableView:
+    return _store().get(scenario_id).orders.snapshot()
+
+def clear_all(scenario_id: str = "default"):
+    _store().clear(scenario_id)
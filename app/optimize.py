@@ -0,0 +1,111 @@
+# app/optimize.py
+import os
+import time
+from typing import List, Dict, Optional
+import numpy as np
+from app.vrp_solver import solve_vrp
+from app.quantum_poc import hybrid_optimize_cluster
+from app.decomposed import solve_decomposed
+from app.models import column_array, point_array
+from app.portfolio import DEFAULT_WORKERS as PORTFOLIO_WORKERS, solve_portfolio
+from app.metrics import profile_if_slow
+from app.encoding import vehicle_stats
+
+SOLVERS = ("ortools", "hybrid", "decomposed", "portfolio")
+
+def build_response(res: Dict) -> Dict:
+    # Build human-friendly lat/lon routes as well
+    coords = res.get("coords", [])
+    routes_idx = res.get("routes", [])
+    routes_coords = []
+    for route in routes_idx:
+        routes_coords.append([[coords[n][0], coords[n][1]] for n in route])
+    body = {"coords": coords, "routes_idx": routes_idx, "routes_coords": routes_coords, "distance_m": res.get("distance"), "meta": res.get("meta", {})}
+    if "duration_s" in res:
+        body["duration_s"] = res["duration_s"]
+    return body
+
+def run_optimize(solver: str, depot: Dict, vehicles: List[Dict], orders: List[Dict], cluster_k: Optional[int] = None,
+                 time_limit_seconds: int = 15, warm_start: Optional[Dict] = None,
+                 stall_seconds: Optional[float] = None, search_options: Optional[Dict] = None,
+                 repair: bool = True, tour_method: str = "classical", sa_params: Optional[Dict] = None,
+                 scenario_key: Optional[str] = "default", channel=None, matrix=None) -> Dict:
+    """
+    Runs one solve and returns the /optimize response body.
+    Top-level and picklable so it can run inside a job-queue worker process.
+    warm_start: {"routes": [[order_id, ...], ...], "cold": {...}|None} from WarmStartStore
+    search_options: extra solve_vrp keywords (first_solution, metaheuristic, solution_limit, neighbors, metric)
+    tour_method/sa_params: hybrid per-cluster tour ("classical" or "qubo") and annealer settings
+    scenario_key: distance-matrix cache key for the OR-Tools solve
+    channel: jobs.JobChannel; OR-Tools publishes improving solutions to it and stops when asked
+    matrix: prebuilt OR-Tools distance matrix from the API process (matrix_cache.prebuilt_matrix)
+    With QF_PROFILE_SLOW_S set, a solve slower than that leaves a cProfile dump; meta.profile has its path.
+    meta.timings: per-stage seconds and problem sizes ({"stages", "size", "total_s"}).
+    """
+    prof = {}
+    with profile_if_slow(solver, out=prof):
+        res = _solve(solver, depot, vehicles, orders, cluster_k, time_limit_seconds, warm_start, stall_seconds,
+                     search_options, repair, tour_method, sa_params, scenario_key, channel, matrix)
+        t = time.perf_counter()
+        body = build_response(res)
+        body["vehicle_stats"] = vehicle_stats(body["coords"], body["routes_idx"],
+                                              [0] + column_array(orders, "demand", 1).tolist(), vehicles)
+    timings = body["meta"].setdefault("timings", {"stages": {}, "size": {"orders": len(orders)}})
+    timings["stages"]["response"] = round(time.perf_counter() - t, 4)
+    body["meta"].update(prof)
+    return body
+
+def _warm_vs_cold(meta: Dict, ws: Dict, cold: Optional[Dict]) -> Dict:
+    # Both runs search for the same fixed time limit, so total solve time says nothing; compare how
+    # fast each got there instead. Warm times include building the seed. speedup is the cold run's
+    # time to its final cost over the warm run's time to reach that cost (None if it never did,
+    # e.g. orders were added since).
+    build = ws.get("build_s", 0.0)
+    first = meta.get("time_to_first_s")
+    reach = meta.get("time_to_target_s")
+    out = {"cold": cold,
+           "time_to_first_s": round(first + build, 3) if first is not None else None,
+           "time_to_cold_cost_s": round(reach + build, 3) if reach is not None else None}
+    out["speedup"] = (round(cold["time_to_best_s"] / out["time_to_cold_cost_s"], 2)
+                      if cold and cold.get("time_to_best_s") and out["time_to_cold_cost_s"] else None)
+    return out
+
+def _inner_workers() -> Optional[int]:
+    # set in job-queue workers (jobs._init_worker); None elsewhere, so solvers use the whole machine
+    share = os.environ.get("QF_INNER_WORKERS")
+    return int(share) if share else None
+
+def _solve(solver, depot, vehicles, orders, cluster_k, time_limit_seconds, warm_start, stall_seconds,
+           search_options, repair, tour_method, sa_params, scenario_key, channel, matrix=None) -> Dict:
+    if solver == "ortools":
+        live = {}
+        if channel is not None:
+            coords = np.vstack([[depot["lat"], depot["lon"]], point_array(orders)]).tolist()
+            live = {"on_improve": lambda ev: channel.publish(
+                        {"elapsed_s": ev["elapsed_s"], "distance_m": ev["distance"], "routes_idx": ev["routes"],
+                         "routes_coords": [[coords[n] for n in r] for r in ev["routes"]]}),
+                    "should_stop": channel.stopped}
+        cold = (warm_start or {}).get("cold")
+        res = solve_vrp(vehicles, orders, depot, time_limit_seconds=time_limit_seconds,
+                        scenario_key=scenario_key, initial_routes=(warm_start or {}).get("routes"),
+                        stall_seconds=stall_seconds, matrix=matrix, target_cost=(cold or {}).get("cost"),
+                        **live, **(search_options or {}))
+        ws = res.get("meta", {}).get("warm_start")
+        if ws is not None:
+            ws.update(_warm_vs_cold(res["meta"], ws, cold))
+    elif solver == "portfolio":
+        share = _inner_workers()
+        res = solve_portfolio(vehicles, orders, depot, time_limit_seconds=time_limit_seconds, cluster_k=cluster_k,
+                              search_options=search_options,
+                              max_workers=min(share, PORTFOLIO_WORKERS) if share else None)
+    elif solver == "decomposed":
+        res = solve_decomposed(vehicles, orders, depot, time_limit_seconds=time_limit_seconds, cluster_k=cluster_k,
+                               repair=repair, max_workers=_inner_workers(), search_options=search_options)
+    else:
+        # hybrid expects orders as list of tuples
+        orders_tuples = [tuple(p) for p in point_array(orders).tolist()]
+        res = hybrid_optimize_cluster(k=cluster_k or 3, depot=(depot["lat"], depot["lon"]), orders=orders_tuples,
+                                      max_workers=_inner_workers(), method=tour_method, sa_params=sa_params,
+                                      demands=column_array(orders, "demand", 1).tolist(),
+                                      capacity=max(int(v.get("capacity", 100)) for v in vehicles))
+    return res
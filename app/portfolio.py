@@ -0,0 +1,185 @@
+# app/portfolio.py
+import multiprocessing as mp
+import os
+import time
+from multiprocessing.connection import wait
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.decomposed import ORDERS_PER_CLUSTER, solve_decomposed
+from app.distance import haversine_pairs
+from app.metrics import Timings
+from app.models import column_array, point_array
+from app.quantum_poc import hybrid_optimize_cluster
+from app.vrp_solver import solve_vrp
+
+# Contenders in priority order; with fewer cores than entries only the first ones run.
+PORTFOLIO = (
+    {"name": "ortools:PATH_CHEAPEST_ARC+GUIDED_LOCAL_SEARCH", "solver": "ortools",
+     "options": {"first_solution": "PATH_CHEAPEST_ARC", "metaheuristic": "GUIDED_LOCAL_SEARCH"}},
+    {"name": "hybrid", "solver": "hybrid", "options": {}},
+    {"name": "ortools:SAVINGS+GUIDED_LOCAL_SEARCH", "solver": "ortools",
+     "options": {"first_solution": "SAVINGS", "metaheuristic": "GUIDED_LOCAL_SEARCH"}},
+    {"name": "decomposed", "solver": "decomposed", "options": {}, "min_orders": 2 * ORDERS_PER_CLUSTER},
+    {"name": "ortools:PARALLEL_CHEAPEST_INSERTION+GUIDED_LOCAL_SEARCH", "solver": "ortools",
+     "options": {"first_solution": "PARALLEL_CHEAPEST_INSERTION", "metaheuristic": "GUIDED_LOCAL_SEARCH"}},
+    {"name": "ortools:PATH_CHEAPEST_ARC+TABU_SEARCH", "solver": "ortools",
+     "options": {"first_solution": "PATH_CHEAPEST_ARC", "metaheuristic": "TABU_SEARCH"}},
+    {"name": "ortools:CHRISTOFIDES+GUIDED_LOCAL_SEARCH", "solver": "ortools",
+     "options": {"first_solution": "CHRISTOFIDES", "metaheuristic": "GUIDED_LOCAL_SEARCH"}},
+    {"name": "ortools:SAVINGS+SIMULATED_ANNEALING", "solver": "ortools",
+     "options": {"first_solution": "SAVINGS", "metaheuristic": "SIMULATED_ANNEALING"}},
+    {"name": "ortools:LOCAL_CHEAPEST_INSERTION+GUIDED_LOCAL_SEARCH", "solver": "ortools",
+     "options": {"first_solution": "LOCAL_CHEAPEST_INSERTION", "metaheuristic": "GUIDED_LOCAL_SEARCH"}},
+    {"name": "ortools:PATH_MOST_CONSTRAINED_ARC+GENERIC_TABU_SEARCH", "solver": "ortools",
+     "options": {"first_solution": "PATH_MOST_CONSTRAINED_ARC", "metaheuristic": "GENERIC_TABU_SEARCH"}},
+)
+DEFAULT_WORKERS = int(os.environ.get("QF_PORTFOLIO_WORKERS", os.cpu_count() or 1))
+# Extra wall clock allowed past the time limit (process start-up, model building) before a contender is dropped.
+GRACE_S = 10.0
+
+
+def _run_contender(args):
+    spec, vehicles, orders, depot, time_limit, cluster_k, extra = args
+    t0 = time.perf_counter()
+    if spec["solver"] == "ortools":
+        res = solve_vrp(vehicles, orders, depot, time_limit_seconds=time_limit, scenario_key=None,
+                        **dict(extra, **spec["options"]))
+    elif spec["solver"] == "decomposed":
+        res = solve_decomposed(vehicles, orders, depot, time_limit_seconds=time_limit, cluster_k=cluster_k,
+                               max_workers=1, search_options=extra)
+    else:
+        res = hybrid_optimize_cluster(k=cluster_k or len(vehicles), depot=(depot["lat"], depot["lon"]),
+                                      orders=[tuple(p) for p in point_array(orders).tolist()], max_workers=1,
+                                      demands=column_array(orders, "demand", 1).tolist(),
+                                      capacity=max(int(v.get("capacity", 100)) for v in vehicles))
+    return res, time.perf_counter() - t0
+
+
+def _contender_main(job, conn):
+    # child process: one contender, reported as ("ok", (res, secs)) or ("error", message)
+    try:
+        out = ("ok", _run_contender(job))
+    except Exception as e:
+        out = ("error", f"{type(e).__name__}: {e}")
+    conn.send(out)
+    conn.close()
+
+
+def route_cost_m(pts: np.ndarray, routes: List[List[int]]) -> int:
+    """Closed-route length in meters (depot -> stops -> depot), the yardstick for every contender."""
+    total = 0.0
+    for r in routes:
+        stops = [n for n in r if n != 0]
+        if stops:
+            path = np.asarray([0] + stops + [0])
+            total += float(haversine_pairs(pts[path[:-1]], pts[path[1:]], unit="m").sum())
+    return int(total)
+
+
+def fit_to_fleet(routes: List[List[int]], demands: List[int], caps: List[int]) -> Optional[List[List[int]]]:
+    """
+    Give each non-empty route a vehicle (heaviest route -> largest vehicle) so that
+    routes[v] belongs to vehicles[v]; None if there are more routes than vehicles or a load does not fit.
+    """
+    routes = [[n for n in r if n != 0] for r in routes]
+    routes = [r for r in routes if r]
+    if len(routes) > len(caps):
+        return None
+    loads = [sum(demands[n] for n in r) for r in routes]
+    by_load = sorted(range(len(routes)), key=lambda i: -loads[i])
+    by_cap = sorted(range(len(caps)), key=lambda v: -caps[v])
+    fitted: List[List[int]] = [[0] for _ in caps]
+    for i, v in zip(by_load, by_cap):
+        if loads[i] > caps[v]:
+            return None
+        fitted[v] = [0] + routes[i]
+    return fitted
+
+
+def solve_portfolio(vehicles: List[Dict], orders, depot: Dict, time_limit_seconds: int = 15,
+                    cluster_k: Optional[int] = None, search_options: Optional[Dict] = None,
+                    max_workers: Optional[int] = None, contenders=PORTFOLIO):
+    """
+    Race several solver configurations in separate processes, all under the same
+    wall-clock budget, and return the best feasible result (same shape as solve_vrp).
+    Every contender is scored by route_cost_m on the same coordinates, so open
+    (hybrid) and closed (OR-Tools) routes compare fairly. meta.portfolio lists each
+    contender's cost, time and status. Contenders still running when the budget
+    (plus GRACE_S) is spent are killed, not left to finish in the background.
+    max_workers defaults to QF_PORTFOLIO_WORKERS.
+    """
+    if not depot or not len(orders) or not vehicles:
+        return {"coords": [], "routes": [], "distance": 0, "meta": {"msg":"need depot/vehicles/orders"}}
+    t0 = time.perf_counter()
+    timings = Timings()
+    timings.size.update(orders=len(orders), vehicles=len(vehicles))
+    workers = max(1, max_workers or DEFAULT_WORKERS)
+    specs = [s for s in contenders if len(orders) >= s.get("min_orders", 0)][:workers]
+    # strategy choice belongs to the portfolio; keep the other search options (neighbors, solution_limit...)
+    extra = {k: v for k, v in (search_options or {}).items() if k not in ("first_solution", "metaheuristic")}
+    jobs = [(s, vehicles, orders, depot, time_limit_seconds, cluster_k, extra) for s in specs]
+
+    # plain processes rather than a pool: one that overruns the budget can be killed
+    running, outcomes = {}, {}
+    for job in jobs:
+        recv, send = mp.Pipe(duplex=False)
+        proc = mp.Process(target=_contender_main, args=(job, send))
+        proc.start()
+        send.close()
+        running[recv] = (proc, job[0]["name"])
+    deadline = t0 + time_limit_seconds + GRACE_S
+    while running and time.perf_counter() < deadline:
+        for conn in wait(list(running), timeout=deadline - time.perf_counter()):
+            proc, name = running.pop(conn)
+            try:
+                outcomes[name] = conn.recv()
+            except EOFError:
+                outcomes[name] = None  # died without a word (killed, out of memory)
+            proc.join()
+    for proc, _ in running.values():
+        proc.kill()
+        proc.join()
+    timings.add("race", time.perf_counter() - t0)
+    t_score = time.perf_counter()
+
+    pts = np.vstack([[float(depot["lat"]), float(depot["lon"])], point_array(orders)])
+    demands = [0] + column_array(orders, "demand", 1).tolist()
+    caps = [int(v.get("capacity", 100)) for v in vehicles]
+    report, best = [], None
+    for spec in specs:
+        entry = {"name": spec["name"], "solver": spec["solver"]}
+        if spec["name"] not in outcomes:
+            entry["status"] = "timeout"
+        elif outcomes[spec["name"]] is None:
+            entry["status"] = "error: contender process died"
+        elif outcomes[spec["name"]][0] == "error":
+            entry["status"] = f"error: {outcomes[spec['name']][1]}"
+        else:
+            res, secs = outcomes[spec["name"]][1]
+            entry["time_s"] = round(secs, 3)
+            routes = fit_to_fleet(res.get("routes") or [], demands, caps)
+            served = sum(len(r) - 1 for r in routes) if routes else 0
+            if routes is None or served != len(orders):
+                entry["status"] = res.get("meta", {}).get("msg") or "infeasible for this fleet"
+            else:
+                entry["status"] = "ok"
+                entry["cost_m"] = route_cost_m(pts, routes)
+                if best is None or entry["cost_m"] < best[0]["cost_m"]:
+                    best = (entry, dict(res, routes=routes))
+        report.append(entry)
+
+    meta = {"workers": len(jobs), "budget_s": time_limit_seconds,
+            "contenders": sorted(report, key=lambda e: e.get("cost_m", float("inf"))),
+            "total_time_s": round(time.perf_counter() - t0, 3)}
+    timings.add("score", time.perf_counter() - t_score)
+    timings.size["contenders"] = len(jobs)
+    if best is None:
+        return {"coords": pts.tolist(), "routes": [], "distance": None,
+                "meta": {"solver": "portfolio", "msg": "no_solution", "portfolio": meta, "timings": timings.as_dict()}}
+    entry, res = best
+    meta["winner"] = entry["name"]
+    meta["winner_meta"] = res.get("meta", {})
+    return {"coords": res["coords"], "routes": res["routes"], "distance": entry["cost_m"],
+            "meta": {"solver": "portfolio", "portfolio": meta, "timings": timings.as_dict()}}
@@ -1,6 +1,13 @@
 import numpy as np
 from math import radians, cos, sin, asin, sqrt
-from sklearn.cluster import KMeans
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from app.distance import haversine_matrix, project_equal_area
+
+# Above this many points clustering switches to MiniBatchKMeans.
+MINIBATCH_THRESHOLD = 5000
+# Passes of capacity-constrained assignment + centroid update.
+BALANCE_ITERS = 5
 
 def haversine(lat1, lon1, lat2, lon2):
     # returns kilometers
@@ -12,21 +19,81 @@ def haversine(lat1, lon1, lat2, lon2):
     return 6371 * c
 
 def distance_matrix(coords):
-    n = len(coords)
-    mat = np.zeros((n,n))
-    for i in range(n):
-        for j in range(n):
-            if i==j: continue
-            mat[i,j] = haversine(coords[i][0], coords[i][1], coords[j][0], coords[j][1])
-    return mat
+    # kilometers, float64 (vectorized, see app.distance)
+    return haversine_matrix(coords, unit="km")
+
+def _kmeans(X: np.ndarray, k: int):
+    if len(X) > MINIBATCH_THRESHOLD:
+        km = MiniBatchKMeans(n_clusters=k, random_state=0, batch_size=4096, n_init=3).fit(X)
+    else:
+        km = KMeans(n_clusters=k, random_state=0).fit(X)
+    return km.labels_, km.cluster_centers_
+
+def capacitated_assign(X: np.ndarray, centers: np.ndarray, demands: np.ndarray, caps: np.ndarray) -> np.ndarray:
+    """
+    Greedy capacity-respecting assignment: points that lose most by not getting their
+    nearest center (largest regret) choose first, each taking the nearest center that
+    still has room. Points that fit nowhere go to their nearest center.
+    """
+    D = (X ** 2).sum(axis=1)[:, None] - 2.0 * X @ centers.T + (centers ** 2).sum(axis=1)[None, :]
+    nearest = np.argmin(D, axis=1)
+    if centers.shape[0] > 1:
+        two = np.partition(D, 1, axis=1)[:, :2]
+        regret = two[:, 1] - two[:, 0]
+    else:
+        regret = np.zeros(len(X))
+    remaining = caps.astype(np.int64).tolist()
+    labels = nearest.copy()
+    dem = demands.tolist()
+    first = nearest.tolist()
+    for i in np.argsort(-regret, kind="stable").tolist():
+        d = dem[i]
+        c = first[i]
+        if remaining[c] >= d:
+            remaining[c] -= d
+            continue
+        # nearest is full: walk this point's full preference list (rare, so sorted lazily)
+        for c in np.argsort(D[i]).tolist():
+            if remaining[c] >= d:
+                labels[i] = c; remaining[c] -= d
+                break
+    return labels
+
+def cluster_labels(coords, k: int, demands: Optional[Sequence[int]] = None,
+                   capacity: Union[int, Sequence[int], None] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Labels and (projected, km) centers for k clusters of (lat, lon) coords.
+    Coordinates are projected equal-area first. With demands and capacity (one value
+    or one per cluster) the k-means result is refined by alternating capacitated
+    assignment and center updates, so no cluster's demand exceeds its capacity when
+    the total allows it.
+    """
+    X = project_equal_area(coords)
+    labels, centers = _kmeans(X, k)
+    if demands is None or capacity is None:
+        return labels, centers
+    dem = np.asarray(demands, dtype=np.int64)
+    caps = np.full(k, int(capacity)) if np.isscalar(capacity) else np.asarray(capacity, dtype=np.int64)[:k]
+    for _ in range(BALANCE_ITERS):
+        new = capacitated_assign(X, centers, dem, caps)
+        counts = np.bincount(new, minlength=k)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, new, X)
+        centers = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centers)
+        if np.array_equal(new, labels):
+            break
+        labels = new
+    return labels, centers
 
-def cluster_coords(coords, k):
-    if k <= 0 or k >= len(coords):
+def cluster_coords(coords, k, demands: Optional[Sequence[int]] = None,
+                   capacity: Union[int, Sequence[int], None] = None) -> Dict[int, List[int]]:
+    if k <= 1:
         return {0: list(range(len(coords)))}
-    X = np.array(coords)
-    kmeans = KMeans(n_clusters=k, random_state=0).fit(X)
-    labels = kmeans.labels_
+    if k >= len(coords):
+        # a cluster per point; with capacities this is the only split that never overloads one
+        return {i: [i] for i in range(len(coords))}
+    labels, _ = cluster_labels(coords, k, demands, capacity)
     clusters = {}
-    for i,l in enumerate(labels):
+    for i,l in enumerate(labels.tolist()):
         clusters.setdefault(int(l), []).append(i)
     return clusters
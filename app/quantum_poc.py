@@ -1,56 +1,105 @@
 # app/quantum_poc.py
-from app.preprocessor import cluster_coords, distance_matrix
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from app.preprocessor import cluster_coords
+from app.distance import haversine_matrix
+from app.tsp import solve_tour, tour_length
+from app.qubo import QUBO_MAX_NODES, qubo_tour
+from app.knn_graph import KnnGraph, LazyDistance
+from app.metrics import Timings
 import numpy as np
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
+
+# Below this many orders the clusters are solved in-process; pool start-up would dominate.
+PARALLEL_MIN_ORDERS = 1000
+# Clusters larger than this are toured over a k-NN arc graph instead of a dense matrix.
+DENSE_MAX_NODES = 4000
 
 def _nn_tsp_order(coords: List[Tuple[float,float]]):
-    n = len(coords)
-    if n <= 1:
-        return list(range(n))
-    dist = distance_matrix(coords)
-    visited = {0}
-    order = [0]
-    cur = 0
-    while len(visited) < n:
-        nxt = min([ (dist[cur,j], j) for j in range(n) if j not in visited ])[1]
-        visited.add(nxt); order.append(int(nxt)); cur = nxt
-    return order
+    # plain nearest neighbour from node 0 (no improvement), kept for callers of the old helper
+    tour, _ = solve_tour(haversine_matrix(coords, unit="km"), closed=False, improve=False)
+    return [int(i) for i in tour]
 
-def hybrid_optimize_cluster(k: int, depot: Tuple[float,float], orders: List[Tuple[float,float]]):
+def _cluster_tour(local_coords: List[Tuple[float,float]], method: str = "classical", sa_params: Optional[Dict] = None):
+    """
+    Open tour from the depot (local node 0) through the cluster; costs in km.
+    method="qubo" also anneals the cluster's TSP QUBO (up to QUBO_MAX_NODES orders) and
+    keeps whichever of the annealed and classical tours is shorter.
+    """
+    if len(local_coords) > DENSE_MAX_NODES:
+        graph = KnnGraph(local_coords)
+        tour, info = solve_tour(LazyDistance(graph), closed=False, nbrs=graph.neighbors)
+        info["arc_graph"] = graph.stats()
+        return [int(i) for i in tour], info
+    dist = haversine_matrix(local_coords, unit="km")
+    tour, info = solve_tour(dist, closed=False)
+    tour = [int(i) for i in tour]
+    if method == "qubo":
+        if len(local_coords) - 1 > QUBO_MAX_NODES:
+            info["qubo"] = {"skipped": f"more than {QUBO_MAX_NODES} orders"}
+        else:
+            q_tour, q_info = qubo_tour(dist, **(sa_params or {}))
+            q_info["used"] = bool(q_tour) and q_info["energy"] < info["cost_after"]
+            if q_info["used"]:
+                tour = q_tour; info["cost_after"] = tour_length(dist, np.asarray(q_tour), closed=False)
+            info["qubo"] = q_info
+    return tour, info
+
+def hybrid_optimize_cluster(k: int, depot: Tuple[float,float], orders: List[Tuple[float,float]],
+                            max_workers: Optional[int] = None, method: str = "classical",
+                            sa_params: Optional[Dict] = None, demands: Optional[List[int]] = None,
+                            capacity: Optional[int] = None):
     """
     orders: list of (lat,lon)
     returns same shape as VRP solver: coords, routes, distance (meters)
+    Each cluster gets a nearest-neighbour tour improved by 2-opt/Or-opt (app.tsp);
+    large instances solve the clusters in parallel processes.
+    method="qubo" adds the simulated-annealing QUBO path (app.qubo); sa_params go to the sampler.
+    demands/capacity: per-order demand and vehicle capacity; clusters are then capacity
+    balanced and k is raised if k vehicles' worth of capacity cannot carry the total demand.
     """
     if not orders:
         return {"coords": [depot], "routes": [], "distance": 0, "meta": {"msg":"no_orders"}}
+    timings = Timings()
+    timings.size["orders"] = len(orders)
     coords = [depot] + list(orders)
-    clusters = cluster_coords(orders, k=k if k>0 else 1)
+    k = k if k>0 else 1
+    with timings.stage("cluster"):
+        if demands is not None and capacity:
+            k = max(k, math.ceil(sum(demands) / capacity))
+            clusters = cluster_coords(orders, k=k, demands=demands, capacity=capacity)
+        else:
+            clusters = cluster_coords(orders, k=k)
+        clusters = [idxs for idxs in clusters.values() if idxs]
+        jobs = [[depot] + [orders[i] for i in idxs] for idxs in clusters]
+    timings.size.update(clusters=len(jobs), max_cluster=max((len(c) for c in clusters), default=0))
+    max_workers = max_workers or os.cpu_count() or 1
+    with timings.stage("tour"):
+        if len(jobs) > 1 and max_workers > 1 and len(orders) >= PARALLEL_MIN_ORDERS:
+            with ProcessPoolExecutor(max_workers=min(max_workers, len(jobs))) as pool:
+                tours = list(pool.map(_cluster_tour, jobs, [method] * len(jobs), [sa_params] * len(jobs)))
+        else:
+            tours = [_cluster_tour(local, method, sa_params) for local in jobs]
+
+    t_assemble = time.perf_counter()
     routes = []
-    total_m = 0
-    for _, idxs in clusters.items():
-        if not idxs:
-            routes.append([0]); continue
-        local_coords = [depot] + [orders[i] for i in idxs]
-        perm = _nn_tsp_order(local_coords)
+    total_km = before_km = 0.0
+    per_cluster = []
+    for idxs, (perm, info) in zip(clusters, tours):
         # map to global indices
-        global_route = []
-        for li in perm:
-            if li == 0:
-                global_route.append(0)
-            else:
-                global_route.append(1 + idxs[li-1])
-        # length
-        poly = [coords[i] for i in global_route]
-        # pairwise haversine
-        for i in range(len(poly)-1):
-            a=poly[i]; b=poly[i+1]
-            # simple haversine (km) -> m
-            from math import radians, sin, cos, asin, sqrt
-            R=6371
-            lon1, lat1, lon2, lat2 = map(radians,[a[1],a[0],b[1],b[0]])
-            dlat=lat2-lat1; dlon=lon2-lon1
-            aa = sin(dlat/2)**2 + cos(lat1)*cos(lat2)*sin(dlon/2)**2
-            km = 2*R*asin(sqrt(aa))
-            total_m += km*1000
-        routes.append(global_route)
-    return {"coords": coords, "routes": routes, "distance": int(total_m), "meta": {"solver":"hybrid"}}
+        routes.append([0 if li == 0 else 1 + idxs[li-1] for li in perm])
+        total_km += info["cost_after"]; before_km += info["cost_before"]
+        per_cluster.append({"orders": len(idxs), "demand": sum(demands[i] for i in idxs) if demands else None,
+                            "cost_before_m": int(info["cost_before"]*1000),
+                            "cost_after_m": int(info["cost_after"]*1000),
+                            "two_opt_moves": info["two_opt_moves"], "or_opt_moves": info["or_opt_moves"]})
+        for key in ("qubo", "arc_graph"):
+            if key in info:
+                per_cluster[-1][key] = info[key]
+    meta = {"solver": "hybrid", "method": method, "k": k, "tour_cost_before_m": int(before_km*1000), "tour_cost_after_m": int(total_km*1000),
+            "clusters": per_cluster}
+    timings.add("assemble", time.perf_counter() - t_assemble)
+    meta["timings"] = timings.as_dict()
+    return {"coords": coords, "routes": routes, "distance": int(total_km*1000), "meta": meta}
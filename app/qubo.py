@@ -0,0 +1,140 @@
+# app/qubo.py
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+
+import dimod
+import numpy as np
+
+# Largest cluster (orders, depot excluded) mapped to a QUBO; it needs n^2 binary variables.
+QUBO_MAX_NODES = 10
+# One-hot penalty weight relative to the longest distance; has to exceed 1 for feasible minima.
+PENALTY_FACTOR = 1.5
+SCHEDULES = ("geometric", "linear")
+
+
+def tsp_qubo(dist: np.ndarray, penalty: Optional[float] = None) -> Tuple[dimod.BinaryQuadraticModel, int]:
+    """
+    Open-path TSP from node 0 as a BQM. Variable (c, t) means order node c (1..m) is
+    visited at step t (0..m-1); node 0 is fixed in front. One-hot penalties with weight
+    `penalty` (default PENALTY_FACTOR * max distance) enforce one node per step and one step per node.
+    Returns (bqm, m). A feasible assignment has energy == path length.
+    """
+    d = np.asarray(dist, dtype=np.float64)
+    m = len(d) - 1
+    A = float(penalty) if penalty else PENALTY_FACTOR * float(d.max() or 1.0)
+    lin: Dict = {}
+    quad: Dict = {}
+
+    def add(u, v, w):
+        key = (u, v) if u < v else (v, u)
+        quad[key] = quad.get(key, 0.0) + w
+
+    for c in range(1, m + 1):
+        for t in range(m):
+            # -2A per one-hot (x^2 == x) from both constraint families, plus the depot leg
+            lin[(c, t)] = -2.0 * A + (d[0, c] if t == 0 else 0.0)
+    for c in range(1, m + 1):
+        for t in range(m):
+            for t2 in range(t + 1, m):
+                add((c, t), (c, t2), 2.0 * A)      # node c used twice
+            for c2 in range(c + 1, m + 1):
+                add((c, t), (c2, t), 2.0 * A)      # step t used twice
+    for t in range(m - 1):
+        for c in range(1, m + 1):
+            for c2 in range(1, m + 1):
+                if c != c2:
+                    add((c, t), (c2, t + 1), d[c, c2])
+    return dimod.BinaryQuadraticModel(lin, quad, 2.0 * A * m, dimod.BINARY), m
+
+
+def decode_tour(sample: Dict, m: int) -> Tuple[List[int], bool]:
+    """Tour [0, ...] from a sample; feasible only if it is a permutation matrix."""
+    x = np.zeros((m, m), dtype=np.int8)
+    for (c, t), v in sample.items():
+        x[c - 1, t] = v
+    feasible = bool((x.sum(axis=0) == 1).all() and (x.sum(axis=1) == 1).all())
+    if not feasible:
+        return [], False
+    return [0] + [int(np.argmax(x[:, t])) + 1 for t in range(m)], True
+
+
+class VectorizedAnnealingSampler(dimod.Sampler):
+    """
+    In-process simulated annealing over binary variables. All replicas (num_reads) are
+    annealed together: each Metropolis step updates one variable in every replica with
+    array operations, and local fields are kept incrementally, so a sweep is O(n * reads * n)
+    flops with no Python per-replica work. Any dimod sampler (e.g. a hardware backend)
+    can stand in for it.
+    """
+    parameters = {"num_reads": [], "num_sweeps": [], "beta_range": [], "schedule": [], "seed": []}
+    properties = {"schedules": SCHEDULES}
+
+    def sample(self, bqm, num_reads: int = 64, num_sweeps: int = 300, beta_range: Optional[Tuple[float, float]] = None,
+               schedule: str = "geometric", seed: Optional[int] = None, **kwargs):
+        if schedule not in SCHEDULES:
+            raise ValueError(f"schedule must be one of {SCHEDULES}")
+        binary = bqm.change_vartype(dimod.BINARY, inplace=False)
+        order = list(binary.variables)
+        n = len(order)
+        rng = np.random.default_rng(seed)
+        if n == 0:
+            return dimod.SampleSet.from_samples_bqm((np.zeros((num_reads, 0), dtype=np.int8), order), bqm)
+        lin, (ri, ci, qv), _ = binary.to_numpy_vectors(order)
+        J = np.zeros((n, n))
+        np.add.at(J, (ri, ci), qv)
+        J = J + J.T  # symmetric couplings, zero diagonal
+        h = np.asarray(lin, dtype=np.float64)
+
+        if beta_range is None:
+            # hot enough to flip the stiffest variable half the time, cold enough to freeze the weakest
+            field = np.abs(h) + np.abs(J).sum(axis=1)
+            nonzero = np.abs(np.concatenate([h, J[J != 0]]))
+            nonzero = nonzero[nonzero > 0]
+            beta_range = (math.log(2) / max(field.max(), 1e-12),
+                          math.log(100) / max(nonzero.min() if len(nonzero) else 1.0, 1e-12))
+        b0, b1 = beta_range
+        if schedule == "geometric":
+            betas = np.geomspace(b0, b1, num_sweeps)
+        else:
+            betas = np.linspace(b0, b1, num_sweeps)
+
+        x = rng.integers(0, 2, size=(num_reads, n)).astype(np.float64)
+        local = x @ J  # local[r, i] = sum_j J[i, j] x[r, j]
+        for beta in betas:
+            noise = np.log(rng.random((n, num_reads)))  # accept iff -beta*dE > log(u)
+            for i in range(n):
+                delta = (1.0 - 2.0 * x[:, i]) * (h[i] + local[:, i])
+                flip = -beta * delta > noise[i]
+                if flip.any():
+                    step = np.where(flip, 1.0 - 2.0 * x[:, i], 0.0)
+                    x[:, i] += step
+                    local += np.outer(step, J[i])
+        samples = x.astype(np.int8)
+        ss = dimod.SampleSet.from_samples_bqm((samples, order), binary,
+                                              info={"beta_range": (b0, b1), "num_sweeps": num_sweeps})
+        return ss.change_vartype(bqm.vartype, inplace=True)
+
+
+def qubo_tour(dist: np.ndarray, sampler: Optional[dimod.Sampler] = None, penalty: Optional[float] = None,
+              **sample_params) -> Tuple[List[int], Dict]:
+    """
+    Solve the open-path TSP of dist (node 0 = depot) through the QUBO. Returns
+    ([0, ...] or [] if no read was feasible, {"energy", "feasible", "feasible_reads", "wall_time_s", "variables"}).
+    """
+    t0 = time.perf_counter()
+    bqm, m = tsp_qubo(dist, penalty)
+    sampler = sampler or VectorizedAnnealingSampler()
+    ss = sampler.sample(bqm, **sample_params)
+    tour, feasible_reads = [], 0
+    best_energy = None
+    for rec in ss.data(["sample", "energy"], sorted_by="energy"):
+        t, ok = decode_tour(rec.sample, m)
+        if ok:
+            feasible_reads += 1
+            if not tour:
+                tour, best_energy = t, float(rec.energy)
+    info = {"energy": best_energy if tour else float(ss.first.energy), "feasible": bool(tour),
+            "feasible_reads": feasible_reads, "reads": len(ss), "variables": len(bqm.variables),
+            "wall_time_s": round(time.perf_counter() - t0, 4)}
+    return tour, info
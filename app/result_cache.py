@@ -0,0 +1,136 @@
+# app/result_cache.py
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+from sqlalchemy import delete, select
+
+from app.db_init import engine, init_db, upsert_insert, SolutionCacheRow
+from app.models import column_array, point_array
+
+# In-memory tier budget (serialised result bytes) and entry lifetime.
+DEFAULT_MAX_BYTES = int(float(os.environ.get("QF_RESULT_CACHE_MB", "64")) * 1024 * 1024)
+DEFAULT_TTL_S = float(os.environ.get("QF_RESULT_CACHE_TTL", "3600"))
+# Second tier in the shared DB so other workers (and restarts) can reuse results.
+DISK_TIER = os.environ.get("QF_RESULT_CACHE_DISK", "1") not in ("0", "false", "")
+
+
+def scenario_hash(depot: Dict, vehicles, orders, solver: str, params: Dict) -> str:
+    """
+    Stable sha256 of everything a solve depends on. Coordinates and demands are hashed
+    as raw float64/int64 bytes, ids as text; row order counts because routes are
+    returned as node indices.
+    """
+    h = hashlib.sha256()
+    h.update(np.asarray([depot["lat"], depot["lon"]], dtype=np.float64).tobytes())
+    for rows, point, num in ((vehicles, ("start_lat", "start_lon"), ("capacity", 100)),
+                             (orders, ("lat", "lon"), ("demand", 1))):
+        h.update(b"|%d|" % len(rows))
+        h.update(np.ascontiguousarray(point_array(rows, point), dtype=np.float64).tobytes())
+        h.update(column_array(rows, *num).tobytes())
+        h.update("\x1f".join(map(str, column_array(rows, "id", dtype=object).tolist())).encode())
+    h.update(solver.encode())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Finished /optimize results by scenario_hash. Memory tier is LRU within a byte
+    budget; both tiers drop entries older than ttl_s. get() returns a copy whose
+    meta.cache says where it came from.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, ttl_s: float = DEFAULT_TTL_S, disk: bool = DISK_TIER):
+        self.max_bytes = int(max_bytes)
+        self.ttl_s = float(ttl_s)
+        self.disk = disk
+        self._mem: "OrderedDict[str, tuple[float, int, Dict]]" = OrderedDict()  # key -> (created, bytes, result)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._db_ready = False
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    def _ready(self):
+        if not self._db_ready:
+            init_db()
+            self._db_ready = True
+
+    def _mem_put_locked(self, key: str, created: float, size: int, result: Dict):
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        if size > self.max_bytes:
+            return
+        self._mem[key] = (created, size, result)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, s, _) = self._mem.popitem(last=False)
+            self._bytes -= s
+            self._stats["evictions"] += 1
+
+    @staticmethod
+    def _tagged(result: Dict, key: str, tier: str, created: float) -> Dict:
+        cache = {"hit": True, "tier": tier, "key": key, "age_s": round(time.time() - created, 1)}
+        return dict(result, meta=dict(result.get("meta") or {}, cache=cache))
+
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl_s:
+                    self._mem.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return self._tagged(entry[2], key, "memory", entry[0])
+                self._mem.pop(key)
+                self._bytes -= entry[1]
+                self._stats["expired"] += 1
+        if self.disk:
+            self._ready()
+            with engine.connect() as conn:
+                row = conn.execute(select(SolutionCacheRow.result, SolutionCacheRow.created_at)
+                                   .where(SolutionCacheRow.key == key)).first()
+            if row is not None and now - row.created_at <= self.ttl_s:
+                with self._lock:
+                    self._mem_put_locked(key, row.created_at, len(json.dumps(row.result)), row.result)
+                    self._stats["disk_hits"] += 1
+                return self._tagged(row.result, key, "disk", row.created_at)
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, key: str, result: Dict):
+        now = time.time()
+        blob = json.dumps(result, default=str)
+        with self._lock:
+            self._mem_put_locked(key, now, len(blob), result)
+        if self.disk:
+            self._ready()
+            with engine.begin() as conn:
+                conn.execute(delete(SolutionCacheRow).where(SolutionCacheRow.created_at < now - self.ttl_s))
+                stmt = upsert_insert(SolutionCacheRow).values(key=key, result=result, created_at=now)
+                conn.execute(stmt.on_conflict_do_update(index_elements=["key"],
+                                                        set_={"result": stmt.excluded.result, "created_at": now}))
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+            self._bytes = 0
+        if self.disk:
+            self._ready()
+            with engine.begin() as conn:
+                conn.execute(delete(SolutionCacheRow))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats, entries=len(self._mem), bytes=self._bytes, max_bytes=self.max_bytes,
+                        ttl_s=self.ttl_s, disk=self.disk)
+
+
+RESULTS = ResultCache()
@@ -0,0 +1,404 @@
+# app/road_network.py
+import csv
+import fcntl
+import hashlib
+import os
+import threading
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, dijkstra
+from scipy.spatial import cKDTree
+
+from app.distance import as_latlon_array, haversine_pairs, project_equal_area
+
+# Road graph used for metric="road" (.osm XML, .osm.pbf with the optional `osmium` package, or an edge CSV).
+ROAD_GRAPH = os.environ.get("QF_ROAD_GRAPH")
+# Compiled graphs, snapped points and matrix tiles, one sub-directory per graph file.
+CACHE_DIR = os.environ.get("QF_ROAD_CACHE_DIR", "road_cache")
+# Matrix tiles are TILE x TILE blocks of the per-graph node registry.
+TILE = 512
+# float64 cells per csgraph.dijkstra call (sources x graph nodes), ~256 MB.
+DIJKSTRA_CELLS = 1 << 25
+METRICS = ("haversine", "road")
+
+# Free-flow speeds when a way has no usable maxspeed.
+HIGHWAY_SPEED_KPH = {
+    "motorway": 100, "motorway_link": 60, "trunk": 80, "trunk_link": 50, "primary": 60, "primary_link": 40,
+    "secondary": 50, "secondary_link": 35, "tertiary": 40, "tertiary_link": 30, "unclassified": 30,
+    "residential": 25, "living_street": 10, "service": 15, "road": 30,
+}
+DEFAULT_SPEED_KPH = 30.0
+# From an order's exact position to its snapped graph node (driveways, parking, last metres).
+CONNECTOR_SPEED_KPH = 15.0
+
+
+class RoadGraph:
+    """
+    Directed road graph with travel-time (seconds) edge weights, reduced to its largest
+    strongly connected component so every snapped node can reach every other one.
+    """
+
+    def __init__(self, lat: np.ndarray, lon: np.ndarray, src: np.ndarray, dst: np.ndarray, secs: np.ndarray,
+                 fingerprint: str):
+        n = len(lat)
+        g = csr_matrix((secs, (src, dst)), shape=(n, n))  # edges are unique (_dedupe), so nothing is summed
+        _, label = connected_components(g, directed=True, connection="strong")
+        keep = np.flatnonzero(label == np.bincount(label).argmax())
+        g = g[keep][:, keep].tocsr()
+        self.lat, self.lon = lat[keep], lon[keep]
+        self.graph = g
+        self.graph_t = g.T.tocsr()
+        self.fingerprint = fingerprint
+        self.center = (float(self.lat.mean()), float(self.lon.mean()))
+        self._tree = cKDTree(project_equal_area(np.column_stack([self.lat, self.lon]), self.center))
+
+    def __len__(self):
+        return len(self.lat)
+
+    def snap(self, coords) -> Tuple[np.ndarray, np.ndarray]:
+        """Nearest graph node per point and the connector time (s) to reach it."""
+        xy = project_equal_area(as_latlon_array(coords), self.center)
+        d_km, node = self._tree.query(xy)
+        return node.astype(np.int64), d_km / CONNECTOR_SPEED_KPH * 3600.0
+
+    def save(self, path: str):
+        coo = self.graph.tocoo()
+        _atomic_save(path, lambda f: np.savez(f, lat=self.lat, lon=self.lon, src=coo.row, dst=coo.col, secs=coo.data))
+
+    @classmethod
+    def load(cls, path: str, cache_dir: str = CACHE_DIR) -> "RoadGraph":
+        """Load a graph file, going through the compiled copy in cache_dir when it is current."""
+        fp = _fingerprint(path)
+        compiled = os.path.join(cache_dir, fp, "graph.npz")
+        if os.path.exists(compiled):
+            z = np.load(compiled)
+            return cls(z["lat"], z["lon"], z["src"], z["dst"], z["secs"], fp)
+        lower = path.lower()
+        if lower.endswith(".csv"):
+            parts = _read_csv(path)
+        elif lower.endswith(".pbf"):
+            parts = _read_pbf(path)
+        else:
+            parts = _read_osm_xml(path)
+        graph = cls(*_dedupe(*parts), fp)
+        os.makedirs(os.path.dirname(compiled), exist_ok=True)
+        graph.save(compiled)
+        return graph
+
+
+def _fingerprint(path: str) -> str:
+    st = os.stat(path)
+    key = f"{os.path.abspath(path)}|{st.st_size}|{int(st.st_mtime)}"
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def _atomic_save(path: str, write):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def _dedupe(lat, lon, src, dst, secs):
+    # keep the fastest of parallel edges and drop self loops
+    secs = np.maximum(np.asarray(secs, dtype=np.float64), 0.1)
+    src = np.asarray(src, dtype=np.int64); dst = np.asarray(dst, dtype=np.int64)
+    ok = src != dst
+    src, dst, secs = src[ok], dst[ok], secs[ok]
+    order = np.lexsort((secs, dst, src))
+    src, dst, secs = src[order], dst[order], secs[order]
+    first = np.ones(len(src), dtype=bool)
+    first[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+    return np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64), src[first], dst[first], secs[first]
+
+
+def _speed_kph(tags: Dict[str, str]) -> float:
+    raw = (tags.get("maxspeed") or "").split(";")[0].strip().lower()
+    try:
+        if raw.endswith("mph"):
+            return float(raw[:-3]) * 1.609
+        return float(raw)
+    except ValueError:
+        return float(HIGHWAY_SPEED_KPH.get(tags.get("highway"), DEFAULT_SPEED_KPH))
+
+
+def _ways_to_edges(node_pos: Dict[int, Tuple[float, float]], ways: Iterator[Tuple[List[int], Dict[str, str]]]):
+    """
+    Drivable ways -> junction-to-junction edges. Only way ends and nodes shared by
+    several ways become graph nodes; the shape points in between only add length.
+    """
+    ways = [(refs, tags) for refs, tags in ways if tags.get("highway") in HIGHWAY_SPEED_KPH
+            and tags.get("access") not in ("no", "private") and len(refs) > 1]
+    uses: Dict[int, int] = {}
+    for refs, _ in ways:
+        for r in refs:
+            uses[r] = uses.get(r, 0) + 1
+        uses[refs[0]] += 1; uses[refs[-1]] += 1
+    ids: Dict[int, int] = {}
+    src, dst, secs = [], [], []
+    for refs, tags in ways:
+        refs = [r for r in refs if r in node_pos]
+        if len(refs) < 2:
+            continue
+        pts = np.array([node_pos[r] for r in refs])
+        seg_m = haversine_pairs(pts[:-1], pts[1:], unit="m").astype(np.float64)
+        mps = _speed_kph(tags) / 3.6
+        oneway = tags.get("oneway", "no")
+        implied = tags.get("junction") == "roundabout" or tags.get("highway") == "motorway"
+        forward = oneway != "-1"
+        backward = oneway == "-1" or (oneway in ("no", "false", "0") and not implied)
+        start, acc = 0, 0.0
+        for i in range(1, len(refs)):
+            acc += seg_m[i - 1]
+            if i == len(refs) - 1 or uses[refs[i]] > 1:
+                a = ids.setdefault(refs[start], len(ids)); b = ids.setdefault(refs[i], len(ids))
+                if forward:
+                    src.append(a); dst.append(b); secs.append(acc / mps)
+                if backward:
+                    src.append(b); dst.append(a); secs.append(acc / mps)
+                start, acc = i, 0.0
+    pos = np.array([node_pos[r] for r in ids]) if ids else np.zeros((0, 2))
+    return pos[:, 0], pos[:, 1], src, dst, secs
+
+
+def _read_osm_xml(path: str):
+    node_pos: Dict[int, Tuple[float, float]] = {}
+
+    def ways():
+        refs: List[int] = []; tags: Dict[str, str] = {}
+        for _, el in ET.iterparse(path, events=("end",)):
+            if el.tag == "node":
+                node_pos[int(el.get("id"))] = (float(el.get("lat")), float(el.get("lon")))
+            elif el.tag == "nd":
+                refs.append(int(el.get("ref")))
+            elif el.tag == "tag":
+                tags[el.get("k")] = el.get("v")
+                continue  # a node's tags are not needed either
+            elif el.tag == "way":
+                yield refs, tags
+            if el.tag in ("node", "way", "relation"):
+                refs, tags = [], {}
+            el.clear()
+    # .osm files list nodes before ways, so node_pos is complete when ways are read
+    return _ways_to_edges(node_pos, ways())
+
+
+def _read_pbf(path: str):
+    try:
+        import osmium
+    except ImportError:
+        raise ValueError("reading .pbf needs the optional 'osmium' package; convert to .osm or CSV otherwise")
+    node_pos: Dict[int, Tuple[float, float]] = {}
+    way_list: List[Tuple[List[int], Dict[str, str]]] = []
+
+    class Handler(osmium.SimpleHandler):
+        def node(self, n):
+            node_pos[n.id] = (n.location.lat, n.location.lon)
+
+        def way(self, w):
+            if "highway" in w.tags:
+                way_list.append(([r.ref for r in w.nodes], dict(w.tags)))
+    Handler().apply_file(path)
+    return _ways_to_edges(node_pos, iter(way_list))
+
+
+def _read_csv(path: str):
+    """
+    Edge list with header u,v,u_lat,u_lon,v_lat,v_lon and optional length_m (default:
+    straight line), speed_kph (default DEFAULT_SPEED_KPH), oneway (0/1, default 0).
+    """
+    ids: Dict[str, int] = {}
+    pos: List[Tuple[float, float]] = []
+    src, dst, secs = [], [], []
+
+    def node(key, lat, lon):
+        if key not in ids:
+            ids[key] = len(pos); pos.append((float(lat), float(lon)))
+        return ids[key]
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            a = node(row["u"], row["u_lat"], row["u_lon"]); b = node(row["v"], row["v_lat"], row["v_lon"])
+            length = float(row.get("length_m") or haversine_pairs([pos[a]], [pos[b]], unit="m")[0])
+            t = length / (float(row.get("speed_kph") or DEFAULT_SPEED_KPH) / 3.6)
+            src.append(a); dst.append(b); secs.append(t)
+            if str(row.get("oneway") or "0").strip().lower() not in ("1", "true", "yes"):
+                src.append(b); dst.append(a); secs.append(t)
+    arr = np.array(pos) if pos else np.zeros((0, 2))
+    return arr[:, 0], arr[:, 1], src, dst, secs
+
+
+class RoadMatrixProvider:
+    """
+    Many-to-many travel-time matrices over a RoadGraph with a persistent tile cache.
+    Every snapped node gets a slot in an append-only registry; node-to-node times are
+    stored as TILE x TILE blocks of that registry on disk, so repeated and overlapping
+    requests (also from other processes) only run Dijkstra for blocks never seen before.
+    Missing blocks are filled by forward searches from their row nodes or backward
+    searches (transposed graph) to their column nodes, whichever needs fewer runs.
+    """
+
+    def __init__(self, graph: RoadGraph, cache_dir: str = CACHE_DIR):
+        self.graph = graph
+        self.dir = os.path.join(cache_dir, graph.fingerprint)
+        os.makedirs(os.path.join(self.dir, "tiles"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._registry = np.zeros(0, dtype=np.int64)   # registry slot -> graph node
+        self._slot: Dict[int, int] = {}                # graph node -> registry slot
+        self._snaps: Dict[Tuple[int, int], Tuple[int, float]] = {}
+        self._snaps_saved = 0
+        self.stats = {"requests": 0, "tiles_hit": 0, "tiles_computed": 0, "dijkstra_sources": 0, "snap_hits": 0}
+        self._load_snaps()
+
+    @contextmanager
+    def _file_lock(self):
+        with open(os.path.join(self.dir, "lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load_snaps(self):
+        path = os.path.join(self.dir, "snaps.npz")
+        if os.path.exists(path):
+            z = np.load(path)
+            for (la, lo), n, s in zip(z["keys"].tolist(), z["node"].tolist(), z["secs"].tolist()):
+                self._snaps[(la, lo)] = (n, s)
+        self._snaps_saved = len(self._snaps)
+
+    def _save_snaps(self):
+        if len(self._snaps) == self._snaps_saved:
+            return
+        keys = np.array(list(self._snaps.keys()), dtype=np.int64).reshape(-1, 2)
+        node, secs = zip(*self._snaps.values())
+        _atomic_save(os.path.join(self.dir, "snaps.npz"),
+                     lambda f: np.savez(f, keys=keys, node=np.array(node), secs=np.array(secs)))
+        self._snaps_saved = len(self._snaps)
+
+    def snap(self, coords) -> Tuple[np.ndarray, np.ndarray]:
+        pts = as_latlon_array(coords)
+        keys = [tuple(k) for k in np.round(pts * 1e6).astype(np.int64).tolist()]
+        todo = [i for i, k in enumerate(keys) if k not in self._snaps]
+        self.stats["snap_hits"] += len(keys) - len(todo)
+        if todo:
+            nodes, secs = self.graph.snap(pts[todo])
+            for i, n, s in zip(todo, nodes.tolist(), secs.tolist()):
+                self._snaps[keys[i]] = (n, s)
+        node, secs = zip(*(self._snaps[k] for k in keys)) if keys else ((), ())
+        return np.asarray(node, dtype=np.int64), np.asarray(secs, dtype=np.float64)
+
+    def _register(self, nodes: np.ndarray) -> np.ndarray:
+        """Registry slots for nodes, appending unseen ones (shared with other processes via the lock file)."""
+        path = os.path.join(self.dir, "registry.npy")
+        with self._file_lock():
+            if os.path.exists(path):
+                on_disk = np.load(path)
+                if len(on_disk) > len(self._registry):
+                    self._registry = on_disk
+                    self._slot = {n: i for i, n in enumerate(on_disk.tolist())}
+            new = [n for n in dict.fromkeys(nodes.tolist()) if n not in self._slot]
+            if new:
+                for n in new:
+                    self._slot[n] = len(self._slot)
+                self._registry = np.concatenate([self._registry, np.asarray(new, dtype=np.int64)])
+                _atomic_save(path, lambda f: np.save(f, self._registry))
+            self._save_snaps()
+        return np.asarray([self._slot[n] for n in nodes.tolist()], dtype=np.int64)
+
+    def _block(self, b: int) -> np.ndarray:
+        return self._registry[b * TILE:(b + 1) * TILE]
+
+    def _tile_path(self, i: int, j: int) -> str:
+        return os.path.join(self.dir, "tiles", f"t_{i}_{j}.npy")
+
+    def _read_tile(self, i: int, j: int) -> Optional[np.ndarray]:
+        path = self._tile_path(i, j)
+        if not os.path.exists(path):
+            return None
+        tile = np.load(path)
+        # the registry's last block may have grown since the tile was written
+        return tile if tile.shape == (len(self._block(i)), len(self._block(j))) else None
+
+    def _search(self, sources: np.ndarray, backward: bool) -> Iterator[Tuple[slice, np.ndarray]]:
+        g = self.graph.graph_t if backward else self.graph.graph
+        step = max(1, DIJKSTRA_CELLS // max(1, len(self.graph)))
+        for s in range(0, len(sources), step):
+            self.stats["dijkstra_sources"] += len(sources[s:s + step])
+            yield slice(s, s + step), dijkstra(g, directed=True, indices=sources[s:s + step])
+
+    def _fill(self, missing: Dict[Tuple[int, int], None]):
+        rows = sorted({i for i, _ in missing}); cols = sorted({j for _, j in missing})
+        backward = len(cols) < len(rows)
+        for b in (cols if backward else rows):
+            other = [i for i, j in missing if j == b] if backward else [j for i, j in missing if i == b]
+            nodes = self._block(b)
+            buf = {o: np.empty((len(nodes), len(self._block(o))), dtype=np.float32) for o in other}
+            for sl, dist in self._search(nodes, backward):
+                for o in other:
+                    buf[o][sl] = dist[:, self._block(o)]
+            for o, part in buf.items():
+                i, j = (o, b) if backward else (b, o)
+                tile = part.T if backward else part
+                _atomic_save(self._tile_path(i, j), lambda f: np.save(f, np.ascontiguousarray(tile)))
+                self.stats["tiles_computed"] += 1
+
+    def matrix(self, coords) -> Tuple[np.ndarray, Dict]:
+        """int32 travel seconds between all points (asymmetric), plus cache info."""
+        with self._lock:
+            self.stats["requests"] += 1
+            node, conn_s = self.snap(coords)
+            slots = self._register(node)
+            uniq, inverse = np.unique(slots, return_inverse=True)
+            blocks = np.unique(uniq // TILE)
+            tiles, missing = {}, {}
+            for i in blocks.tolist():
+                for j in blocks.tolist():
+                    t = self._read_tile(i, j)
+                    if t is None:
+                        missing[(i, j)] = None
+                    else:
+                        tiles[(i, j)] = t
+            self.stats["tiles_hit"] += len(tiles)
+            if missing:
+                self._fill(missing)
+                tiles.update({k: self._read_tile(*k) for k in missing})
+
+            node_m = np.empty((len(uniq), len(uniq)), dtype=np.float32)
+            blk, off = uniq // TILE, uniq % TILE
+            for i in blocks.tolist():
+                ri = np.flatnonzero(blk == i)
+                for j in blocks.tolist():
+                    cj = np.flatnonzero(blk == j)
+                    node_m[np.ix_(ri, cj)] = tiles[(i, j)][np.ix_(off[ri], off[cj])]
+        conn = conn_s.astype(np.float32)
+        secs = node_m[np.ix_(inverse, inverse)] + conn[:, None] + conn[None, :]
+        np.fill_diagonal(secs, 0.0)
+        info = {"metric": "road", "points": len(node), "snapped_nodes": len(uniq), "tiles": len(blocks) ** 2,
+                "tiles_computed": len(missing), "max_snap_s": round(float(conn_s.max()), 1) if len(conn_s) else 0.0}
+        return np.minimum(np.rint(secs), np.iinfo(np.int32).max // 4).astype(np.int32), info
+
+
+_PROVIDERS: Dict[str, RoadMatrixProvider] = {}
+_PROVIDERS_LOCK = threading.Lock()
+
+
+def road_provider(path: Optional[str] = None) -> RoadMatrixProvider:
+    """The per-process provider for path (default QF_ROAD_GRAPH); ValueError if none is configured."""
+    path = path or ROAD_GRAPH
+    if not path:
+        raise ValueError("metric='road' needs a road graph: set QF_ROAD_GRAPH to an .osm/.osm.pbf/.csv file")
+    with _PROVIDERS_LOCK:
+        if path not in _PROVIDERS:
+            _PROVIDERS[path] = RoadMatrixProvider(RoadGraph.load(path))
+        return _PROVIDERS[path]
+
+
+def travel_time_matrix(coords, metric: str = "road") -> Tuple[np.ndarray, Dict]:
+    """(int32 matrix, info) for coords; only 'road' is handled here (haversine goes through matrix_cache)."""
+    if metric != "road":
+        raise ValueError(f"metric must be one of {METRICS}")
+    return road_provider().matrix(coords)
@@ -0,0 +1,240 @@
+# app/scenarios.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import delete, func, select, update
+
+from app.db_init import engine, init_db, upsert_insert, Scenario, ScenarioOrder, ScenarioVehicle
+from app.models import ColumnTable, ORDER_DEFAULTS, ORDER_FIELDS, VEHICLE_DEFAULTS, VEHICLE_FIELDS
+
+DEFAULT_SCENARIO = "default"
+# Scenarios kept loaded per process (LRU); the DB stays the source of truth.
+CACHE_SIZE = int(os.environ.get("QF_SCENARIO_CACHE", "64"))
+
+KINDS = {"orders": (ScenarioOrder, ORDER_FIELDS, ORDER_DEFAULTS, ("lat", "lon")),
+         "vehicles": (ScenarioVehicle, VEHICLE_FIELDS, VEHICLE_DEFAULTS, ("start_lat", "start_lon"))}
+
+
+class ScenarioState:
+    """One scenario as loaded in this process. Treat as read-only outside ScenarioStore."""
+    __slots__ = ("scenario_id", "version", "depot", "orders", "vehicles", "lock")
+
+    def __init__(self, scenario_id: str):
+        self.scenario_id = scenario_id
+        self.version = 0  # 0: not in the DB yet
+        self.depot: Optional[Dict] = None
+        self.orders = _table("orders")
+        self.vehicles = _table("vehicles")
+        self.lock = threading.RLock()
+
+    def table(self, kind: str) -> ColumnTable:
+        return self.orders if kind == "orders" else self.vehicles
+
+
+def _table(kind: str) -> ColumnTable:
+    _, fields, defaults, point = KINDS[kind]
+    return ColumnTable(fields, defaults, point)
+
+
+class _ScenarioWriter:
+    """upsert()/len() facade so chunked writers (e.g. StreamIngest) can target one scenario."""
+
+    def __init__(self, store: "ScenarioStore", scenario_id: str, kind: str):
+        self.store, self.scenario_id, self.kind = store, scenario_id, kind
+
+    def upsert(self, records):
+        return self.store.upsert(self.scenario_id, self.kind, records)
+
+    def __len__(self):
+        return len(self.store.get(self.scenario_id).table(self.kind))
+
+
+class ScenarioStore:
+    """
+    Named scenarios (depot, vehicles, orders) persisted in the shared DB, so several API
+    worker processes see the same state. Reads go through an in-process LRU of loaded
+    ColumnTables; a read costs one primary-key lookup of the scenario's version and only
+    reloads the rows when another process has written since. Each write is one transaction:
+    version bump plus the changed rows as a single executemany.
+    """
+
+    def __init__(self, cache_size: int = CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, ScenarioState]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db_ready = False
+        self.stats = {"hits": 0, "loads": 0, "write_reloads": 0}
+
+    def _ready(self):
+        if not self._db_ready:
+            init_db()
+            self._db_ready = True
+
+    def _db_version(self, conn, sid: str) -> Optional[int]:
+        return conn.execute(select(Scenario.version).where(Scenario.scenario_id == sid)).scalar()
+
+    def _load(self, conn, sid: str) -> ScenarioState:
+        state = ScenarioState(sid)
+        row = conn.execute(select(Scenario).where(Scenario.scenario_id == sid)).first()
+        if row is None:
+            return state
+        state.version = row.version
+        if row.depot_lat is not None:
+            state.depot = {"lat": row.depot_lat, "lon": row.depot_lon}
+        for kind, (model, fields, _, _) in KINDS.items():
+            cols = [getattr(model, f) for f in fields]
+            rows = conn.execute(select(*cols).where(model.scenario_id == sid).order_by(model.position, model.id))
+            state.table(kind).replace(dict(zip(fields, r)) for r in rows)
+        return state
+
+    def get(self, sid: str = DEFAULT_SCENARIO) -> ScenarioState:
+        """The current state of a scenario (an empty, unsaved one if it does not exist)."""
+        self._ready()
+        with engine.connect() as conn:
+            version = self._db_version(conn, sid) or 0
+            with self._lock:
+                state = self._cache.get(sid)
+                if state is not None and state.version == version:
+                    self._cache.move_to_end(sid)
+                    self.stats["hits"] += 1
+                    return state
+            state = self._load(conn, sid)
+        with self._lock:
+            self.stats["loads"] += 1
+            self._cache[sid] = state
+            self._cache.move_to_end(sid)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return state
+
+    def _drop(self, sid: str):
+        with self._lock:
+            self._cache.pop(sid, None)
+
+    def _mutate(self, sid: str, change: Callable):
+        """
+        change(state) applies the edit to the scenario's state and returns (result, write);
+        write(conn) persists it in the same transaction. The version bump is the first
+        statement (one upsert of the scenario row), so the transaction holds the DB write lock
+        (SQLite) or the scenario's row lock (PostgreSQL) from there on: writers from other
+        workers queue behind it, and a cached copy they made stale is reloaded under
+        the lock before the edit is applied. Validation errors from change propagate.
+        """
+        self._ready()
+        with engine.begin() as conn:
+            now = time.time()
+            stmt = upsert_insert(Scenario).values(scenario_id=sid, version=1, updated_at=now)
+            conn.execute(stmt.on_conflict_do_update(index_elements=["scenario_id"],
+                                                    set_={"version": Scenario.version + 1, "updated_at": now}))
+            version = self._db_version(conn, sid)
+            with self._lock:
+                state = self._cache.get(sid)
+            if state is None or state.version != version - 1:
+                state = self._load(conn, sid)
+                self.stats["write_reloads"] += 1
+            with state.lock:
+                try:
+                    result, write = change(state)
+                    write(conn)
+                except (ValueError, KeyError):
+                    raise  # rejected before the state was touched
+                except Exception:
+                    self._drop(sid)
+                    raise
+                state.version = version
+        with self._lock:
+            self._cache[sid] = state
+            self._cache.move_to_end(sid)
+        return result
+
+    def _write_rows(self, conn, sid: str, kind: str, table: ColumnTable, ids):
+        model, fields, _, _ = KINDS[kind]
+        rows = [dict(table.get(rid), scenario_id=sid) for rid in ids]
+        if not rows:
+            return
+        # new rows go after every existing one; ON CONFLICT DO UPDATE leaves position alone,
+        # so row order (= node order) survives patches
+        start = conn.execute(select(func.max(model.position)).where(model.scenario_id == sid)).scalar()
+        start = 0 if start is None else start + 1
+        for n, row in enumerate(rows):
+            row["position"] = start + n
+        stmt = upsert_insert(model)
+        stmt = stmt.on_conflict_do_update(index_elements=["scenario_id", "id"],
+                                          set_={f: stmt.excluded[f] for f in fields if f != "id"})
+        conn.execute(stmt, rows)
+
+    def set_depot(self, sid: str, lat: float, lon: float):
+        def change(state):
+            state.depot = {"lat": float(lat), "lon": float(lon)}
+            return state.depot, lambda conn: conn.execute(
+                update(Scenario).where(Scenario.scenario_id == sid).values(depot_lat=float(lat), depot_lon=float(lon)))
+        return self._mutate(sid, change)
+
+    def replace(self, sid: str, kind: str, records: List[Dict]) -> int:
+        model = KINDS[kind][0]
+        fresh = _table(kind)
+        fresh.replace(records)  # validate before touching the cached state
+
+        def change(state):
+            table = state.table(kind)
+            table.replace(fresh.records())
+
+            def write(conn):
+                conn.execute(delete(model).where(model.scenario_id == sid))
+                self._write_rows(conn, sid, kind, table, table.column("id").tolist())
+            return len(table), write
+        return self._mutate(sid, change)
+
+    def upsert(self, sid: str, kind: str, records: List[Dict]):
+        """New ids are added, known ids get only the fields given; returns (added, updated)."""
+        records = list(records)
+
+        def change(state):
+            table = state.table(kind)
+            counts = table.upsert(records)
+            ids = list(dict.fromkeys(str(r["id"]) for r in records))  # first-seen order = insert order = node order
+            return counts, lambda conn: self._write_rows(conn, sid, kind, table, ids)
+        return self._mutate(sid, change)
+
+    def patch(self, sid: str, kind: str, rid: str, fields: Dict) -> Dict:
+        def change(state):
+            table = state.table(kind)
+            table.patch(rid, fields)
+            return table.get(rid), lambda conn: self._write_rows(conn, sid, kind, table, [str(rid)])
+        return self._mutate(sid, change)
+
+    def delete(self, sid: str, kind: str, ids: List[str]) -> List[str]:
+        model = KINDS[kind][0]
+
+        def change(state):
+            removed = state.table(kind).delete(ids)
+
+            def write(conn):
+                if removed:
+                    conn.execute(delete(model).where(model.scenario_id == sid, model.id.in_(removed)))
+            return removed, write
+        return self._mutate(sid, change)
+
+    def clear(self, sid: str):
+        self._ready()
+        with engine.begin() as conn:
+            for model, *_ in KINDS.values():
+                conn.execute(delete(model).where(model.scenario_id == sid))
+            conn.execute(delete(Scenario).where(Scenario.scenario_id == sid))
+        self._drop(sid)
+
+    def writer(self, sid: str, kind: str = "orders") -> _ScenarioWriter:
+        return _ScenarioWriter(self, sid, kind)
+
+    def list(self) -> List[Dict]:
+        self._ready()
+        with engine.connect() as conn:
+            rows = conn.execute(select(Scenario.scenario_id, Scenario.version, Scenario.updated_at)
+                                .order_by(Scenario.scenario_id)).all()
+        return [{"scenario_id": r.scenario_id, "version": r.version, "updated_at": r.updated_at} for r in rows]
+
+
+SCENARIOS = ScenarioStore()
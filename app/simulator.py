@@ -1,20 +1,81 @@
-from app.solver import solve_vrp
-from app.models import init_db, save_orders, save_vehicles
-
-def run_scenario():
-    init_db()
-    orders = [
-        {"id": "o1", "lat": 12.98, "lon": 77.58, "demand": 1},
-        {"id": "o2", "lat": 12.96, "lon": 77.60, "demand": 1},
-        {"id": "o3", "lat": 12.99, "lon": 77.57, "demand": 1},
-    ]
-    vehicles = [
-        {"id": "v1", "start_lat": 12.97, "start_lon": 77.59, "capacity": 3}
-    ]
-    save_orders([type('O', (), o)() for o in orders])
-    save_vehicles([type('V', (), v)() for v in vehicles])
-    res = solve_vrp()
-    print('Simulation result:', res)
+# app/simulator.py
+import math
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+DISTRIBUTIONS = ("uniform", "clustered", "city")
+# Vehicle types drawn for heterogeneous fleets: (capacity, share of the fleet).
+FLEET_MIX = ((50, 0.3), (100, 0.5), (200, 0.2))
+# Fleet capacity over total demand, so every generated instance is feasible with some slack.
+CAPACITY_SLACK = 1.25
+KM_PER_DEG_LAT = 111.32
+
+
+def _offsets_km(rng: np.random.Generator, n: int, distribution: str, radius_km: float) -> np.ndarray:
+    """(n, 2) east/north offsets from the depot in km."""
+    if distribution == "uniform":
+        return rng.uniform(-radius_km, radius_km, size=(n, 2))
+    if distribution == "clustered":
+        # a handful of gaussian blobs of different sizes scattered over the area
+        n_blobs = max(2, min(20, int(math.sqrt(n) / 3)))
+        centers = rng.uniform(-0.8 * radius_km, 0.8 * radius_km, size=(n_blobs, 2))
+        spread = rng.uniform(0.03, 0.12, size=n_blobs) * radius_km
+        blob = rng.choice(n_blobs, size=n, p=rng.dirichlet(np.ones(n_blobs)))
+        return centers[blob] + rng.normal(size=(n, 2)) * spread[blob, None]
+    if distribution == "city":
+        # dense core with exponentially thinning outskirts, plus a few satellite towns
+        n_sub = int(0.2 * n)
+        angle = rng.uniform(0, 2 * math.pi, size=n - n_sub)
+        r = np.minimum(rng.exponential(0.25 * radius_km, size=n - n_sub), radius_km)
+        core = np.column_stack([r * np.cos(angle), r * np.sin(angle)])
+        towns = rng.uniform(-radius_km, radius_km, size=(4, 2))
+        sub = towns[rng.integers(0, 4, size=n_sub)] + rng.normal(size=(n_sub, 2)) * 0.04 * radius_km
+        out = np.vstack([core, sub])
+        return out[rng.permutation(n)]
+    raise ValueError(f"distribution must be one of {DISTRIBUTIONS}")
+
+
+def generate_instance(n_orders: int, distribution: str = "uniform", seed: int = 0,
+                      n_vehicles: Optional[int] = None, depot: Tuple[float, float] = (12.9716, 77.5946),
+                      radius_km: Optional[float] = None, max_demand: int = 5) -> Dict:
+    """
+    Seeded synthetic CVRP instance: {"depot", "vehicles", "orders", "spec"} in the API's record shapes.
+    Same arguments -> same instance on any machine (numpy PCG64). Demands are 1..max_demand;
+    the fleet mixes FLEET_MIX capacities and is sized to CAPACITY_SLACK x total demand unless
+    n_vehicles is given. radius_km defaults to a size-dependent service area (denser for more orders).
+    """
+    rng = np.random.default_rng(seed)
+    radius_km = radius_km or min(60.0, 5.0 + 0.25 * math.sqrt(n_orders))
+    off = _offsets_km(rng, n_orders, distribution, radius_km)
+    lat = depot[0] + off[:, 1] / KM_PER_DEG_LAT
+    lon = depot[1] + off[:, 0] / (KM_PER_DEG_LAT * math.cos(math.radians(depot[0])))
+    demand = rng.integers(1, max_demand + 1, size=n_orders)
+    orders = [{"id": f"o{i}", "lat": float(a), "lon": float(b), "demand": int(d), "priority": "normal"}
+              for i, (a, b, d) in enumerate(zip(lat.round(6), lon.round(6), demand))]
+
+    caps, shares = zip(*FLEET_MIX)
+    if n_vehicles is None:
+        mean_cap = sum(c * s for c, s in FLEET_MIX)
+        n_vehicles = max(1, math.ceil(CAPACITY_SLACK * int(demand.sum()) / mean_cap))
+    capacity = rng.choice(caps, size=n_vehicles, p=shares)
+    while int(capacity.sum()) < demand.sum():  # a small fleet can draw too many small vans
+        capacity[np.argmin(capacity)] = max(caps)
+    vehicles = [{"id": f"v{i}", "start_lat": depot[0], "start_lon": depot[1], "capacity": int(c)}
+                for i, c in enumerate(capacity)]
+    spec = {"n_orders": n_orders, "distribution": distribution, "seed": seed, "n_vehicles": n_vehicles,
+            "radius_km": round(radius_km, 3), "total_demand": int(demand.sum()), "total_capacity": int(capacity.sum())}
+    return {"depot": {"lat": depot[0], "lon": depot[1]}, "vehicles": vehicles, "orders": orders, "spec": spec}
+
+
+def run_scenario(n_orders: int = 30, distribution: str = "clustered", solver: str = "ortools", seed: int = 0):
+    # small end-to-end demo; for timings across solvers and sizes use app.benchmark
+    from app.optimize import run_optimize
+    inst = generate_instance(n_orders, distribution, seed=seed)
+    res = run_optimize(solver, inst["depot"], inst["vehicles"], inst["orders"], time_limit_seconds=3, scenario_key=None)
+    print('Simulation result:', {"distance_m": res["distance_m"], "routes": res["routes_idx"],
+                                 "timings": res["meta"].get("timings")})
+    return res
 
 if __name__ == '__main__':
     run_scenario()
@@ -1,5 +1,5 @@
 from ortools.constraint_solver import pywrapcp, routing_enums_pb2
-from app.preprocessor import distance_matrix
+from app.distance import haversine_matrix
 from app.models import get_orders, get_vehicles
 
 def solve_vrp():
@@ -16,24 +16,16 @@ def solve_vrp():
     vehicle_capacities = [v.get('capacity',100) for v in vehicles] if vehicles else [100,100]
     num_vehicles = len(vehicle_capacities)
 
-    dist_mat = (distance_matrix(coords) * 1000).astype(int).tolist()  # meters int
+    dist_mat = haversine_matrix(coords, unit="m").tolist()  # meters int
 
     manager = pywrapcp.RoutingIndexManager(len(dist_mat), num_vehicles, 0)
     routing = pywrapcp.RoutingModel(manager)
 
-    def distance_callback(from_index, to_index):
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return dist_mat[from_node][to_node]
-
-    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+    transit_callback_index = routing.RegisterTransitMatrix(dist_mat)
     routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
 
     # Capacity constraints
-    def demand_callback(from_index):
-        from_node = manager.IndexToNode(from_index)
-        return demands[from_node]
-    demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
+    demand_callback_index = routing.RegisterUnaryTransitVector(demands)
     routing.AddDimensionWithVehicleCapacity(demand_callback_index, 0, vehicle_capacities, True, 'Capacity')
 
     search_parameters = pywrapcp.DefaultRoutingSearchParameters()
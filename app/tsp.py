@@ -0,0 +1,289 @@
+# app/tsp.py
+import numpy as np
+from typing import Dict, Optional, Tuple
+
+# Neighbour-list size for 2-opt / Or-opt candidate moves.
+NEIGHBOURS = 10
+EPS = 1e-9
+
+
+def neighbour_lists(dist: np.ndarray, k: int = NEIGHBOURS) -> np.ndarray:
+    """(n, k) indices of each node's k nearest other nodes, nearest first."""
+    n = len(dist)
+    k = max(0, min(k, n - 1))
+    if k == 0:
+        return np.zeros((n, 0), dtype=np.int64)
+    d = dist.astype(np.float64, copy=True)
+    np.fill_diagonal(d, np.inf)
+    part = np.argpartition(d, k - 1, axis=1)[:, :k]
+    order = np.argsort(np.take_along_axis(d, part, axis=1), axis=1)
+    return np.take_along_axis(part, order, axis=1)
+
+
+def nearest_neighbour_tour(dist: np.ndarray, start: int = 0, nbrs: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Greedy tour from start; one masked argmin over a distance row per step. With nbrs
+    (sorted candidate lists) the nearest unvisited candidate is taken when there is one,
+    and a full row is only needed once all of a node's candidates are visited.
+    """
+    n = len(dist)
+    tour = np.empty(n, dtype=np.int64)
+    if n == 0:
+        return tour
+    visited = np.zeros(n, dtype=bool)
+    cur = start
+    for step in range(n):
+        tour[step] = cur
+        visited[cur] = True
+        if step == n - 1:
+            break
+        if nbrs is not None:
+            cand = nbrs[cur][~visited[nbrs[cur]]]
+            if len(cand):
+                cur = int(cand[0]); continue
+        row = np.where(visited, np.inf, dist[cur])
+        cur = int(np.argmin(row))
+    return tour
+
+
+def tour_length(dist: np.ndarray, tour: np.ndarray, closed: bool = True) -> float:
+    if len(tour) < 2:
+        return 0.0
+    length = float(dist[tour[:-1], tour[1:]].sum())
+    if closed:
+        length += float(dist[tour[-1], tour[0]])
+    return length
+
+
+def _candidates(dist, nbrs: np.ndarray, nbr_d: Optional[np.ndarray]):
+    if nbr_d is None:
+        nbr_d = dist[np.arange(len(nbrs))[:, None], nbrs]
+    return [list(zip(c, d)) for c, d in zip(nbrs.tolist(), nbr_d.tolist())]
+
+
+def _pair(dist):
+    # scalar d(i, j) as a Python float: ndarray.item, or LazyDistance.pair (no array indexing per arc)
+    return dist.pair if hasattr(dist, "pair") else dist.item
+
+
+def _succ_lengths(dist, tour: np.ndarray) -> np.ndarray:
+    """succ[i] = d(tour[i], tour[i + 1]) around the closed tour, in one batched lookup."""
+    return np.asarray(dist[tour, np.roll(tour, -1)], dtype=np.float64)
+
+
+def two_opt(dist: np.ndarray, tour: np.ndarray, nbrs: np.ndarray, max_passes: int = 50,
+            nbr_d: Optional[np.ndarray] = None) -> Tuple[np.ndarray, int]:
+    """
+    Neighbour-list 2-opt on a closed tour (symmetric dist). For edge (a, b) only the
+    neighbours c of a with d(a, c) < d(a, b) are tried, so a pass is O(n * k) checks.
+    nbr_d holds d(a, nbrs[a]) when the caller already has it.
+    Each pass first scores every (edge, candidate) pair on the current tour in one batched
+    lookup; only edges with an improving move are then walked (and re-checked) in Python.
+    Tour edge lengths are kept in `succ` and updated per move, so the walk looks up one new
+    arc per candidate.
+    """
+    n = len(tour)
+    if n < 4:
+        return tour, 0
+    if nbr_d is None:
+        nbr_d = dist[np.arange(len(nbrs))[:, None], nbrs]
+    cands = _candidates(dist, nbrs, nbr_d)
+    pair = _pair(dist)
+    tour = tour.copy()
+    pos = np.empty(n, dtype=np.int64)
+    pos[tour] = np.arange(n)
+    succ = _succ_lengths(dist, tour)
+    moves = 0
+    for _ in range(max_passes):
+        c = nbrs[tour]
+        j = pos[c]
+        e = tour[(j + 1) % n]
+        b = np.roll(tour, -1)[:, None]
+        d_ac = nbr_d[tour]
+        # only pairs with d(a, c) < d(a, b) can improve: look up d(b, e) for those alone
+        ok = (d_ac < succ[:, None]) & (c != b) & (e != tour[:, None])
+        rows, cols = np.nonzero(ok)
+        delta = d_ac[rows, cols] + dist[b[rows, 0], e[rows, cols]] - succ[rows] - succ[j[rows, cols]]
+        todo = np.unique(rows[delta < -EPS]).tolist()
+        if not todo:
+            break
+        for i in todo:
+            a = tour[i]; b = tour[(i + 1) % n]
+            d_ab = succ[i]
+            for c, d_ac in cands[a]:
+                if d_ac >= d_ab:
+                    break
+                j = pos[c]; e = tour[(j + 1) % n]
+                if c == b or e == a:
+                    continue
+                d_be = pair(b, e)
+                delta = d_ac + d_be - d_ab - succ[j]
+                if delta < -EPS:
+                    # reverse b..c (positions i+1..j, wrapping around if needed)
+                    lo, hi = (i + 1) % n, j
+                    idx = np.arange(lo, hi + 1) if lo <= hi else np.r_[lo:n, 0:hi + 1]
+                    tour[idx] = tour[idx][::-1].copy()
+                    pos[tour[idx]] = idx
+                    succ[idx[:-1]] = succ[idx[:-1]][::-1].copy()
+                    succ[idx[-1]] = d_be
+                    succ[i] = d_ac
+                    moves += 1
+                    a = tour[i]; b = tour[(i + 1) % n]; d_ab = succ[i]
+    return tour, moves
+
+
+def or_opt(dist: np.ndarray, tour: np.ndarray, nbrs: np.ndarray, max_passes: int = 10,
+           seg_lens=(1, 2, 3), nbr_d: Optional[np.ndarray] = None) -> Tuple[np.ndarray, int]:
+    """
+    Or-opt on a closed tour: move a segment of 1..3 consecutive nodes (optionally reversed)
+    between a neighbour c of its first node and c's successor. Neighbours are only tried
+    while d(c, first) is below the removal gain. The node at position 0 never moves.
+    As in two_opt, a batched scan per segment length picks the segments worth walking,
+    and tour edge lengths are kept up to date in `succ`.
+    """
+    n = len(tour)
+    if nbr_d is None:
+        nbr_d = dist[np.arange(len(nbrs))[:, None], nbrs]
+    cands = _candidates(dist, nbrs, nbr_d)
+    pair = _pair(dist)
+    tour = tour.copy()
+    pos = np.empty(n, dtype=np.int64)
+    pos[tour] = np.arange(n)
+    succ = _succ_lengths(dist, tour)
+    moves = 0
+    for _ in range(max_passes):
+        improved = False
+        for L in seg_lens:
+            if n < L + 3:
+                continue
+            # batched: every segment start i in 1..n-L against all of its first node's candidates
+            i = np.arange(1, n - L + 1)
+            s0, s1 = tour[i], tour[i + L - 1]
+            p, nx = tour[i - 1], tour[(i + L) % n]
+            gain = succ[i - 1] + succ[i + L - 1] - dist[p, nx]
+            c = nbrs[s0]
+            k = pos[c]
+            cn = tour[(k + 1) % n]
+            d_cs0 = nbr_d[s0]
+            inside = (k >= i[:, None]) & (k < i[:, None] + L)
+            ok = (d_cs0 < gain[:, None]) & ~inside & (c != p[:, None]) & (gain[:, None] > EPS)
+            rows, cols = np.nonzero(ok)
+            c, cn = c[rows, cols], cn[rows, cols]
+            cost = np.minimum(d_cs0[rows, cols] + dist[s1[rows], cn],
+                              dist[c, s1[rows]] + dist[s0[rows], cn]) - succ[k[rows, cols]]
+            todo = s0[np.unique(rows[cost < gain[rows] - EPS])].tolist()
+            for node in todo:
+                # earlier moves shift positions: find the segment by its first node and re-check it
+                i = int(pos[node])
+                if i == 0 or i + L > n:
+                    continue
+                s0 = tour[i]; s1 = tour[i + L - 1]
+                p = tour[i - 1]; nx = tour[(i + L) % n]
+                d_pnx = pair(p, nx)
+                gain = succ[i - 1] + succ[i + L - 1] - d_pnx
+                best = None
+                if gain > EPS:
+                    for c, d_cs0 in cands[s0]:
+                        if d_cs0 >= gain:
+                            break
+                        k = pos[c]
+                        if i <= k < i + L or c == p:
+                            continue
+                        cn = tour[(k + 1) % n]
+                        base = succ[k]
+                        d_s1cn = pair(s1, cn); d_cs1 = pair(c, s1)
+                        fwd = d_cs0 + d_s1cn - base
+                        rev = d_cs1 + pair(s0, cn) - base
+                        cost, rev_it = (fwd, False) if fwd <= rev else (rev, True)
+                        if cost < gain - EPS and (best is None or cost < best[0]):
+                            best = (cost, c, rev_it, d_cs0, d_s1cn, d_cs1)
+                if best is None:
+                    continue
+                _, c, rev_it, d_cs0, d_s1cn, d_cs1 = best
+                seg, seg_in = tour[i:i + L], succ[i:i + L - 1]
+                rest = np.concatenate([tour[:i], tour[i + L:]])
+                rest_succ = np.concatenate([succ[:i], succ[i + L:]])
+                rest_succ[i - 1] = d_pnx
+                k = int(np.flatnonzero(rest == c)[0])
+                cn = rest[(k + 1) % len(rest)]
+                if rev_it:
+                    seg, seg_in = seg[::-1], seg_in[::-1]
+                    into, out = d_cs1, pair(s0, cn)
+                else:
+                    into, out = d_cs0, d_s1cn
+                tour = np.concatenate([rest[:k + 1], seg, rest[k + 1:]])
+                succ = np.concatenate([rest_succ[:k], [into], seg_in, [out], rest_succ[k + 1:]])
+                pos[tour] = np.arange(n)
+                moves += 1; improved = True
+        if not improved:
+            break
+    return tour, moves
+
+
+def solve_tour(dist, closed: bool = True, improve: bool = True,
+               neighbours: int = NEIGHBOURS, max_rounds: int = 5,
+               nbrs: Optional[np.ndarray] = None) -> Tuple[np.ndarray, Dict]:
+    """
+    Tour over all nodes starting at node 0: nearest neighbour, then alternating 2-opt and
+    Or-opt until neither improves. With closed=False the cost is the open path from 0
+    (no return leg): a dummy node tied to 0 at cost 0 and to every other node at a constant
+    cost turns it into a symmetric closed tour the move operators handle unchanged.
+    dist may also be a knn_graph.LazyDistance with its KnnGraph's `nbrs`, so nothing
+    O(n^2) is ever stored (sparse mode).
+    Returns (tour, {"cost_before", "cost_after", "two_opt_moves", "or_opt_moves"}).
+    """
+    n = len(dist)
+    if n <= 1:
+        return np.arange(n), {"cost_before": 0.0, "cost_after": 0.0, "two_opt_moves": 0, "or_opt_moves": 0}
+    sparse = not isinstance(dist, np.ndarray)
+    if sparse:
+        if nbrs is None:
+            raise ValueError("sparse distances need candidate neighbour lists")
+        # the graph's own candidate lists come with their lengths: no need to recompute them
+        graph = getattr(dist, "graph", None)
+        nbr_d = graph.dist_km if graph is not None and nbrs is graph.neighbors else None
+        if not closed:
+            big = 4.0 * dist.max_bound() + 1.0
+            d = dist.with_dummy(0.0, big)
+            nbrs = np.vstack([nbrs, np.zeros((1, nbrs.shape[1]), dtype=nbrs.dtype)])
+            if nbr_d is not None:
+                nbr_d = np.vstack([nbr_d, np.zeros((1, nbr_d.shape[1]))])  # dummy -> node 0 costs 0
+        else:
+            d = dist
+        tour = nearest_neighbour_tour(dist, 0, nbrs[:n])
+    else:
+        nbr_d = None
+        d = np.asarray(dist, dtype=np.float64)
+        if not closed:
+            big = 4.0 * float(d.max()) + 1.0
+            aug = np.empty((n + 1, n + 1))
+            aug[:n, :n] = d
+            aug[n, :] = big; aug[:, n] = big
+            aug[n, 0] = aug[0, n] = 0.0; aug[n, n] = 0.0
+            d = aug
+        tour = nearest_neighbour_tour(d[:n, :n], 0)
+    if not closed:
+        tour = np.append(tour, n)
+    before = tour_length(d, tour)
+    moves_2 = moves_or = 0
+    if improve and len(tour) >= 4:
+        if not sparse:
+            nbrs = neighbour_lists(d, neighbours)
+        if nbr_d is None:
+            nbr_d = d[np.arange(len(nbrs))[:, None], nbrs]
+        for _ in range(max_rounds):
+            tour, m2 = two_opt(d, tour, nbrs, nbr_d=nbr_d)
+            tour = np.roll(tour, -int(np.flatnonzero(tour == 0)[0]))
+            tour, mo = or_opt(d, tour, nbrs, nbr_d=nbr_d)
+            moves_2 += m2; moves_or += mo
+            if not mo:
+                break
+    tour = np.roll(tour, -int(np.flatnonzero(tour == 0)[0]))
+    after = tour_length(d, tour)
+    if not closed:
+        # drop the dummy; the tour must read 0 -> ... -> dummy, flip it if it was built backwards
+        if tour[1] == n:
+            tour = np.r_[tour[:1], tour[1:][::-1]]
+        tour = tour[tour != n]
+        before -= big; after -= big
+    return tour, {"cost_before": before, "cost_after": after, "two_opt_moves": moves_2, "or_opt_moves": moves_or}
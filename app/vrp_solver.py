@@ -1,32 +1,82 @@
 # app/vrp_solver.py
 import math
+import time
+import numpy as np
 from ortools.constraint_solver import pywrapcp, routing_enums_pb2
-from typing import List, Dict, Tuple
+from typing import Callable, List, Dict, Tuple, Optional
+from app.distance import haversine_matrix, haversine_pairs
+from app.matrix_cache import MATRIX_CACHE, cached_distance_matrix
+from app.metrics import Timings
+from app.models import column_array, point_array
+from app.road_network import travel_time_matrix
+from app.warm_start import build_seed
 
 def haversine_km(a: Tuple[float,float], b: Tuple[float,float]) -> float:
-    from math import radians, sin, cos, asin, sqrt
+    # single pair; score whole plans with app.evaluate.evaluate_routes
     lat1, lon1 = a; lat2, lon2 = b
-    dlat = radians(lat2 - lat1); dlon = radians(lon2 - lon1)
-    la1 = radians(lat1); la2 = radians(lat2)
-    a_ = sin(dlat/2)**2 + cos(la1)*cos(la2)*sin(dlon/2)**2
-    return 6371 * 2 * asin(math.sqrt(a_))
+    dlat = math.radians(lat2 - lat1); dlon = math.radians(lon2 - lon1)
+    la1 = math.radians(lat1); la2 = math.radians(lat2)
+    a_ = math.sin(dlat/2)**2 + math.cos(la1)*math.cos(la2)*math.sin(dlon/2)**2
+    return 6371 * 2 * math.asin(math.sqrt(a_))
 
-def build_distance_matrix(coords: List[Tuple[float,float]]) -> List[List[int]]:
-    n = len(coords)
-    mat = [[0]*n for _ in range(n)]
-    for i in range(n):
-        for j in range(n):
-            if i == j:
-                mat[i][j] = 0
-            else:
-                mat[i][j] = int(haversine_km(coords[i], coords[j]) * 1000)  # meters
-    return mat
+def build_distance_matrix(coords: List[Tuple[float,float]]) -> np.ndarray:
+    # int32 meters, computed blockwise with NumPy (see app.distance)
+    return haversine_matrix(coords, unit="m")
+
+FIRST_SOLUTION_STRATEGIES = tuple(k for k in routing_enums_pb2.FirstSolutionStrategy.Value.keys() if k != "UNSET")
+METAHEURISTICS = tuple(k for k in routing_enums_pb2.LocalSearchMetaheuristic.Value.keys() if k != "UNSET")
+
+def make_search_parameters(time_limit_seconds: float = 15, first_solution: str = "PATH_CHEAPEST_ARC",
+                           metaheuristic: str = "GUIDED_LOCAL_SEARCH", solution_limit: Optional[int] = None,
+                           neighbors: Optional[int] = None, num_nodes: int = 0):
+    """
+    Routing search parameters from plain values (names as in routing_enums_pb2).
+    Raises ValueError for unknown strategy names.
+    neighbors restricts local-search operators to each node's `neighbors` nearest nodes
+    (of num_nodes), i.e. a k-NN candidate arc set evaluated natively by OR-Tools.
+    """
+    if first_solution not in FIRST_SOLUTION_STRATEGIES:
+        raise ValueError(f"unknown first_solution {first_solution!r}, expected one of {FIRST_SOLUTION_STRATEGIES}")
+    if metaheuristic not in METAHEURISTICS:
+        raise ValueError(f"unknown metaheuristic {metaheuristic!r}, expected one of {METAHEURISTICS}")
+    params = pywrapcp.DefaultRoutingSearchParameters()
+    params.first_solution_strategy = getattr(routing_enums_pb2.FirstSolutionStrategy, first_solution)
+    params.local_search_metaheuristic = getattr(routing_enums_pb2.LocalSearchMetaheuristic, metaheuristic)
+    params.time_limit.FromMilliseconds(int(time_limit_seconds * 1000))
+    if solution_limit:
+        params.solution_limit = int(solution_limit)
+    if neighbors and num_nodes > neighbors:
+        params.ls_operator_neighbors_ratio = float(neighbors) / num_nodes
+        params.ls_operator_min_neighbors = int(neighbors)
+    return params
 
-def solve_vrp(vehicles: List[Dict], orders: List[Dict], depot: Dict, time_limit_seconds: int = 15):
+def solve_vrp(vehicles: List[Dict], orders: List[Dict], depot: Dict, time_limit_seconds: int = 15,
+              scenario_key: Optional[str] = "default", initial_routes: Optional[List[List[str]]] = None,
+              stall_seconds: Optional[float] = None, first_solution: str = "PATH_CHEAPEST_ARC",
+              metaheuristic: str = "GUIDED_LOCAL_SEARCH", solution_limit: Optional[int] = None,
+              neighbors: Optional[int] = None, on_improve: Optional[Callable[[Dict], None]] = None,
+              should_stop: Optional[Callable[[], bool]] = None, improve_interval: float = 0.25,
+              metric: str = "haversine", matrix: Optional[Tuple[np.ndarray, Dict]] = None,
+              target_cost: Optional[int] = None):
     """
     vehicles: list of dict {id, start_lat, start_lon, capacity}
-    orders: list of dict {id, lat, lon, demand}
+    orders: list of dict {id, lat, lon, demand}, or a models.TableView (columns are read directly)
     depot: {lat, lon}
+    scenario_key: distance-matrix cache key (None disables the cache)
+    initial_routes: previous solution as order ids per vehicle; when given the search is
+      warm-started from it (new orders inserted, missing ones dropped) instead of PATH_CHEAPEST_ARC
+    stall_seconds: stop early once the best cost has not improved for this long
+    first_solution/metaheuristic/solution_limit/neighbors: see make_search_parameters
+    on_improve: called with {"elapsed_s", "distance", "routes"} for improving solutions during
+      the search, at most once per improve_interval seconds
+    should_stop: polled (about every 0.1 s) during the search; True ends it with the best solution so far
+    metric: "haversine" minimises straight-line meters; "road" minimises travel seconds on the
+      QF_ROAD_GRAPH network (app.road_network). Either way "distance" is straight-line meters of
+      the routes; with "road" the result also has "duration_s", the optimised travel time.
+    matrix: prebuilt (int32 meters matrix, cache info) for depot + orders (matrix_cache.prebuilt_matrix);
+      skips the lookup here, scenario_key is then unused
+    target_cost: meta.time_to_target_s is when the search first got to this cost or below
+      (None if it never did); warm starts pass the cold run's cost
     Returns:
       {"coords": [(lat,lon), ...], "routes": [[node_idx,...], ...], "distance": total_meters}
       coords[0] == depot; order nodes 1..N
@@ -34,41 +84,114 @@ def solve_vrp(vehicles: List[Dict], orders: List[Dict], depot: Dict, time_limit_
     if not depot or not orders or not vehicles:
         return {"coords": [], "routes": [], "distance": 0, "meta": {"msg":"need depot/vehicles/orders"}}
 
+    timings = Timings()
     # build coords: depot first, then orders
-    coords = [(float(depot["lat"]), float(depot["lon"]))] + [(float(o["lat"]), float(o["lon"])) for o in orders]
-    demands = [0] + [int(o.get("demand", 1)) for o in orders]
-    vehicle_caps = [int(v.get("capacity", 100)) for v in vehicles]
+    with timings.stage("extract"):
+        coords = np.vstack([[float(depot["lat"]), float(depot["lon"])], point_array(orders)]).tolist()
+        demands = [0] + column_array(orders, "demand", 1).tolist()
+        vehicle_caps = [int(v.get("capacity", 100)) for v in vehicles]
     num_vehicles = len(vehicle_caps)
+    timings.size.update(orders=len(coords) - 1, vehicles=num_vehicles)
 
-    dist_mat = build_distance_matrix(coords)
+    if matrix is not None and metric != "road":
+        dist_arr, matrix_meta = matrix
+        if dist_arr.shape != (len(coords), len(coords)):
+            raise ValueError(f"prebuilt matrix is {dist_arr.shape} for {len(coords)} nodes")
+        timings.add("matrix", matrix_meta.get("build_s", 0.0))
+    else:
+        with timings.stage("matrix"):
+            if metric == "road":
+                dist_arr, cache_info = travel_time_matrix(coords, metric)
+            else:
+                dist_arr, cache_info = cached_distance_matrix(coords, scenario_key)
+        matrix_meta = dict(cache_info, **MATRIX_CACHE.stats()) if metric != "road" else cache_info
+    search_params = make_search_parameters(time_limit_seconds, first_solution, metaheuristic, solution_limit, neighbors,
+                                           len(coords))
 
-    manager = pywrapcp.RoutingIndexManager(len(dist_mat), num_vehicles, 0)
+    t_model = time.perf_counter()
+    manager = pywrapcp.RoutingIndexManager(len(coords), num_vehicles, 0)
     routing = pywrapcp.RoutingModel(manager)
 
-    def distance_callback(from_index, to_index):
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return dist_mat[from_node][to_node]
-
-    transit_idx = routing.RegisterTransitCallback(distance_callback)
+    # matrix/vector transits are evaluated natively: no Python call per arc during the search
+    transit_idx = routing.RegisterTransitMatrix(dist_arr.tolist())
     routing.SetArcCostEvaluatorOfAllVehicles(transit_idx)
 
     # capacity constraint
-    def demand_callback(from_index):
-        from_node = manager.IndexToNode(from_index)
-        return demands[from_node]
-    demand_idx = routing.RegisterUnaryTransitCallback(demand_callback)
+    demand_idx = routing.RegisterUnaryTransitVector(demands)
     routing.AddDimensionWithVehicleCapacity(demand_idx, 0, vehicle_caps, True, "Capacity")
 
-    search_params = pywrapcp.DefaultRoutingSearchParameters()
-    search_params.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-    search_params.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
-    search_params.time_limit.FromSeconds(time_limit_seconds)
+    # track when the best solution was found; optionally stop once it stalls
+    t0 = time.perf_counter()
+    best = {"cost": None, "at": 0.0, "first": None, "target": None, "published": None, "polled": 0.0,
+            "stopped": False}
+    def current_routes():
+        routes = []
+        for v in range(num_vehicles):
+            idx = routing.Start(v); r = []
+            while not routing.IsEnd(idx):
+                r.append(manager.IndexToNode(idx)); idx = routing.NextVar(idx).Value()
+            routes.append(r)
+        return routes
+    def on_solution():
+        now = time.perf_counter() - t0
+        cost = routing.CostVar().Value()
+        if best["first"] is None:
+            best["first"] = now
+        if target_cost is not None and best["target"] is None and cost <= target_cost:
+            best["target"] = now
+        if best["cost"] is None or cost < best["cost"]:
+            best["cost"] = cost; best["at"] = now
+            if on_improve is not None:
+                # the current assignment is only readable now; keep it until the throttle lets it out
+                best["pending"] = {"elapsed_s": round(now, 3), "distance": int(cost), "routes": current_routes()}
+        elif stall_seconds is not None and now - best["at"] > stall_seconds:
+            routing.solver().FinishCurrentSearch()
+        if best.get("pending") and (best["published"] is None or now - best["published"] >= improve_interval):
+            best["published"] = now
+            on_improve(best.pop("pending"))
+        if should_stop is not None and now - best["polled"] >= 0.1:
+            best["polled"] = now
+            if should_stop():
+                best["stopped"] = True
+                routing.solver().FinishCurrentSearch()
+    routing.AddAtSolutionCallback(on_solution)
+
+    meta = {"solver": "ortools", "matrix_cache": matrix_meta,
+            "search": {"first_solution": first_solution, "metaheuristic": metaheuristic,
+                       "time_limit_s": time_limit_seconds, "solution_limit": solution_limit,
+                       "neighbors": neighbors}}
+    timings.add("model", time.perf_counter() - t_model)
+    seed = None
+    if initial_routes:
+        t_seed = time.perf_counter()
+        with timings.stage("warm_start"):
+            seed_routes, seed_info = build_seed(initial_routes, column_array(orders, "id", dtype=object), demands,
+                                                vehicle_caps, dist_arr)
+            routing.CloseModelWithParameters(search_params)
+            if not seed_info["unplaced"]:
+                seed = routing.ReadAssignmentFromRoutes(
+                    [[manager.NodeToIndex(n) for n in r] for r in seed_routes], True)
+        meta["warm_start"] = dict(seed_info, used=seed is not None, build_s=round(time.perf_counter() - t_seed, 3))
 
-    solution = routing.SolveWithParameters(search_params)
+    t0 = time.perf_counter()
+    if seed is not None:
+        solution = routing.SolveFromAssignmentWithParameters(seed, search_params)
+    else:
+        solution = routing.SolveWithParameters(search_params)
+    meta["solve_time_s"] = round(time.perf_counter() - t0, 3)
+    timings.add("search", time.perf_counter() - t0)
+    meta["time_to_best_s"] = round(best["at"], 3)
+    meta["time_to_first_s"] = round(best["first"], 3) if best["first"] is not None else None
+    if target_cost is not None:
+        meta["time_to_target_s"] = round(best["target"], 3) if best["target"] is not None else None
+    if best["stopped"]:
+        meta["stopped_early"] = True
     if not solution:
-        return {"coords": coords, "routes": [], "distance": None, "meta": {"msg":"no_solution"}}
+        meta["msg"] = "no_solution"
+        meta["timings"] = timings.as_dict()
+        return {"coords": coords, "routes": [], "distance": None, "meta": meta}
 
+    t_routes = time.perf_counter()
     routes = []
     total_m = 0
     for v in range(num_vehicles):
@@ -84,5 +207,15 @@ def solve_vrp(vehicles: List[Dict], orders: List[Dict], depot: Dict, time_limit_
         # Optionally append end depot index if you want closed route
         # route_nodes.append(0)
         routes.append(route_nodes)
+    timings.add("routes", time.perf_counter() - t_routes)
+    meta["timings"] = timings.as_dict()
+    meta["objective"] = int(total_m)  # search cost (meters, or seconds with metric="road"); see target_cost
 
-    return {"coords": coords, "routes": routes, "distance": int(total_m), "meta": {"solver":"ortools"}}
+    if metric == "road":
+        # the objective was seconds; report meters along the same closed routes
+        pts = np.asarray(coords)
+        paths = [np.asarray([0] + r[1:] + [0]) for r in routes if len(r) > 1]
+        meters = sum(float(haversine_pairs(pts[p[:-1]], pts[p[1:]], unit="m").sum()) for p in paths)
+        meta["metric"] = "road"
+        return {"coords": coords, "routes": routes, "distance": int(meters), "duration_s": int(total_m), "meta": meta}
+    return {"coords": coords, "routes": routes, "distance": int(total_m), "meta": meta}
@@ -0,0 +1,119 @@
+# app/warm_start.py
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def _route_load(route: Sequence[int], demands: Sequence[int]) -> int:
+    return int(sum(demands[n] for n in route))
+
+
+def cheapest_insertion(into: np.ndarray, out: np.ndarray, routes: List[List[int]], edges: List[np.ndarray],
+                       candidates: Iterable[int]) -> Optional[Tuple[int, int, int]]:
+    """
+    Cheapest place for one node among the candidate routes (routes run depot 0 -> route -> 0).
+    into[m] / out[m]: cost from node m to the node / from the node to m; edges[w]: the arc
+    costs along [0] + routes[w] + [0]. Returns (delta, route, position) or None.
+    """
+    best = None
+    for w in candidates:
+        path = np.asarray([0] + routes[w] + [0])
+        delta = into[path[:-1]] + out[path[1:]] - edges[w]
+        pos = int(np.argmin(delta))
+        if best is None or delta[pos] < best[0]:
+            best = (int(delta[pos]), w, pos)
+    return best
+
+
+def build_seed(prev_routes: List[List[str]], order_ids: Sequence[str], demands: Sequence[int],
+               capacities: Sequence[int], dist) -> Tuple[List[List[int]], Dict]:
+    """
+    Turn the previous solution (order ids per vehicle) into node routes for the current
+    scenario: orders that disappeared are dropped, routes are trimmed back under capacity,
+    and orders that are new (or were trimmed) are placed by cheapest feasible insertion.
+    dist is the current int matrix (node 0 = depot, node i = order_ids[i-1]).
+    Returns (routes, info); orders that fit nowhere are reported in info["unplaced"].
+    """
+    node_of = {oid: i + 1 for i, oid in enumerate(order_ids)}
+    num_vehicles = len(capacities)
+    routes: List[List[int]] = [[] for _ in range(num_vehicles)]
+    seen = set()
+    kept = dropped = 0
+    pending: List[int] = []
+    for v, prev in enumerate(prev_routes):
+        for oid in prev:
+            node = node_of.get(oid)
+            if node is None or node in seen:
+                dropped += 1
+                continue
+            seen.add(node)
+            if v < num_vehicles:
+                routes[v].append(node)
+                kept += 1
+            else:
+                pending.append(node)  # the fleet shrank
+    # trim routes whose demand no longer fits; trimmed orders are re-inserted below
+    for v, route in enumerate(routes):
+        while route and _route_load(route, demands) > capacities[v]:
+            pending.append(route.pop())
+            kept -= 1
+    pending.extend(n for n in range(1, len(order_ids) + 1) if n not in seen)
+
+    d = np.asarray(dist)
+
+    def arcs(route):
+        path = np.asarray([0] + route + [0])
+        return d[path[:-1], path[1:]].astype(np.int64)
+    loads = [_route_load(r, demands) for r in routes]
+    edges = [arcs(r) for r in routes]
+    inserted = 0
+    unplaced = []
+    for node in pending:
+        best = cheapest_insertion(d[:, node].astype(np.int64), d[node].astype(np.int64), routes, edges,
+                                  (v for v in range(num_vehicles) if loads[v] + demands[node] <= capacities[v]))
+        if best is None:
+            unplaced.append(node)
+            continue
+        _, v, pos = best
+        routes[v].insert(pos, node)
+        loads[v] += demands[node]
+        edges[v] = arcs(routes[v])
+        inserted += 1
+    info = {"kept": kept, "dropped": dropped, "inserted": inserted, "unplaced": len(unplaced)}
+    return routes, info
+
+
+class WarmStartStore:
+    """
+    Last OR-Tools solution per scenario (order ids per vehicle) plus how the last cold solve
+    went: {"cost", "time_to_first_s", "time_to_best_s"}, what warm runs are compared against.
+    """
+    def __init__(self):
+        self._items: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            item = self._items.get(key)
+            return dict(item) if item else None
+
+    def save(self, key: str, orders: List[Dict], result: Dict):
+        routes_idx = result.get("routes_idx") or []
+        if not routes_idx:
+            return
+        routes = [[orders[n - 1]["id"] for n in route if n != 0] for route in routes_idx]
+        meta = result.get("meta", {})
+        with self._lock:
+            item = self._items.setdefault(key, {"cold": None})
+            item["routes"] = routes
+            if "warm_start" not in meta and meta.get("objective") is not None:
+                item["cold"] = {"cost": meta["objective"], "time_to_first_s": meta.get("time_to_first_s"),
+                                "time_to_best_s": meta.get("time_to_best_s")}
+
+    def discard(self, key: str):
+        with self._lock:
+            self._items.pop(key, None)
+
+
+WARM_STARTS = WarmStartStore()
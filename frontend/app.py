@@ -3,8 +3,47 @@ import streamlit as st
 import requests, time, json, io
 from streamlit_folium import st_folium
 import folium
+from folium.plugins import FastMarkerCluster
 
 API = "http://127.0.0.1:8000"
+PALETTE = ["red", "blue", "green", "purple", "orange", "darkred", "cadetblue"]
+# Above this many stops, routes are drawn as one GeoJSON layer and stops as clustered markers.
+LARGE_PLAN = 300
+
+def decode_polyline(text, precision=5):
+    # inverse of app.encoding.encode_polyline (results are fetched with format=compact)
+    coords, values, shift, acc = [], [], 0, 0
+    for ch in text.encode("ascii"):
+        b = ch - 63
+        acc |= (b & 0x1F) << shift
+        shift += 5
+        if b < 0x20:
+            values.append(~(acc >> 1) if acc & 1 else acc >> 1)
+            shift, acc = 0, 0
+    lat = lon = 0
+    for i in range(0, len(values), 2):
+        lat += values[i]; lon += values[i + 1]
+        coords.append([lat / 10 ** precision, lon / 10 ** precision])
+    return coords
+
+def draw_routes(fmap, routes, weight=5, markers=True):
+    n_stops = sum(max(0, len(r) - 1) for r in routes)
+    if n_stops <= LARGE_PLAN:
+        for i, route in enumerate(routes):
+            if len(route) < 2: continue
+            folium.PolyLine(route, color=PALETTE[i % len(PALETTE)], weight=weight, tooltip=f"Vehicle v{i + 1}").add_to(fmap)
+            if markers:
+                for p in route[1:]:
+                    folium.CircleMarker(p, radius=4, color=PALETTE[i % len(PALETTE)], fill=True).add_to(fmap)
+        return
+    # big plans: one GeoJSON layer (GeoJSON wants lon/lat) and client-side marker clustering
+    features = [{"type": "Feature", "properties": {"color": PALETTE[i % len(PALETTE)], "name": f"v{i + 1}"},
+                 "geometry": {"type": "LineString", "coordinates": [[p[1], p[0]] for p in route]}}
+                for i, route in enumerate(routes) if len(route) > 1]
+    folium.GeoJson({"type": "FeatureCollection", "features": features},
+                   style_function=lambda f: {"color": f["properties"]["color"], "weight": 2}).add_to(fmap)
+    if markers:
+        FastMarkerCluster([p for r in routes for p in r[1:]]).add_to(fmap)
 st.set_page_config(layout="wide", page_title="QuantumFleet UI")
 st.title("QuantumFleet — Fleet Optimization (OR-Tools & Hybrid)")
 
@@ -15,12 +54,16 @@ if "vehicles" not in st.session_state: st.session_state.vehicles = []  # list of
 # Sidebar controls
 with st.sidebar:
     st.header("Scenario Controls")
+    scenario = st.text_input("Scenario id", value="default")
+    SC = {"scenario": scenario}
     nveh = st.number_input("Number of vehicles", 1, 10, value=3)
     cap = st.number_input("Vehicle capacity", 1, 1000, value=50)
-    solver = st.selectbox("Solver", ["OR-Tools (Classical)", "Hybrid (Quantum-inspired)"])
-    cluster_k = st.number_input("Hybrid clusters (k)", 1, 10, value=nveh)
+    solver = st.selectbox("Solver", ["OR-Tools (Classical)", "Decomposed (parallel OR-Tools)", "Hybrid (Quantum-inspired)",
+                                    "Portfolio (race strategies, keep best)"])
+    cluster_k = st.number_input("Clusters (k, hybrid/decomposed)", 1, 10, value=nveh)
+    use_qubo = st.checkbox("Hybrid: anneal small clusters as QUBO", value=False)
     if st.button("Clear scenario"):
-        requests.post(f"{API}/clear")
+        requests.post(f"{API}/clear", params=SC)
         st.session_state.depot = None
         st.session_state.orders = []
         st.session_state.vehicles = []
@@ -32,19 +75,22 @@ center = st.session_state.depot or [20.5937, 78.9629]
 m = folium.Map(location=center, zoom_start=6)
 if st.session_state.depot:
     folium.Marker(st.session_state.depot, tooltip="Depot", icon=folium.Icon(color="blue")).add_to(m)
-for i,o in enumerate(st.session_state.orders, start=1):
-    folium.Marker([o["lat"], o["lon"]], tooltip=f"Order {i} d={o['demand']}", icon=folium.Icon(color="green")).add_to(m)
+if len(st.session_state.orders) > LARGE_PLAN:
+    FastMarkerCluster([[o["lat"], o["lon"]] for o in st.session_state.orders]).add_to(m)
+else:
+    for i,o in enumerate(st.session_state.orders, start=1):
+        folium.Marker([o["lat"], o["lon"]], tooltip=f"Order {i} d={o['demand']}", icon=folium.Icon(color="green")).add_to(m)
 click = st_folium(m, width=900, height=520)
 
 if click and click.get("last_clicked"):
     lat = float(click["last_clicked"]["lat"]); lon = float(click["last_clicked"]["lng"])
     if st.session_state.depot is None:
         st.session_state.depot = [lat, lon]; st.success("Depot placed")
-        requests.post(f"{API}/depot", json={"lat": lat, "lon": lon})
+        requests.post(f"{API}/depot", json={"lat": lat, "lon": lon}, params=SC)
         # create initial vehicles (all starting at depot)
         v_list = [{"id": f"v{i+1}", "start_lat": lat, "start_lon": lon, "capacity": int(cap)} for i in range(int(nveh))]
         st.session_state.vehicles = v_list
-        requests.post(f"{API}/vehicles", json=v_list)
+        requests.post(f"{API}/vehicles", json=v_list, params=SC)
     else:
         # add order with minimal form
         demand = st.number_input("Demand for this order", min_value=1, max_value=1000, value=1, key=f"d_{len(st.session_state.orders)}")
@@ -52,7 +98,7 @@ if click and click.get("last_clicked"):
         if st.button("Add order at clicked location", key=f"add_{len(st.session_state.orders)}"):
             o = {"id": f"o{len(st.session_state.orders)+1}", "lat": lat, "lon": lon, "demand": int(demand), "priority": priority}
             st.session_state.orders.append(o)
-            requests.post(f"{API}/orders", json=st.session_state.orders)  # push full orders list
+            requests.patch(f"{API}/orders", json=[o], params=SC)  # send only the new order
             st.success("Order added")
 
 st.divider()
@@ -70,56 +116,84 @@ with colB:
         else:
             v_list = [{"id": f"v{i+1}", "start_lat": st.session_state.depot[0], "start_lon": st.session_state.depot[1], "capacity": int(cap)} for i in range(int(nveh))]
             st.session_state.vehicles = v_list
-            r1 = requests.post(f"{API}/vehicles", json=v_list)
-            r2 = requests.post(f"{API}/orders", json=st.session_state.orders)
+            r1 = requests.post(f"{API}/vehicles", json=v_list, params=SC)
+            r2 = requests.post(f"{API}/orders", json=st.session_state.orders, params=SC)
             st.write("Vehicles:", r1.status_code, "Orders:", r2.status_code)
 
 with colA:
     st.subheader("Optimize")
-    chosen = "ortools" if solver.startswith("OR-Tools") else "hybrid"
+    chosen = {"OR-Tools": "ortools", "Decomposed": "decomposed", "Hybrid": "hybrid", "Portfolio": "portfolio"}[solver.split(" ")[0]]
     if st.button("🚀 Optimize now"):
         # ensure backend has depot/vehicles/orders
         if st.session_state.depot is None or len(st.session_state.orders) == 0:
             st.error("Place depot and at least one order")
         else:
-            # send vehicles+orders again to be safe
+            # vehicles follow the sidebar settings; orders are already synced one by one
             v_list = [
                 {"id": f"v{i + 1}", "start_lat": st.session_state.depot[0], "start_lon": st.session_state.depot[1],
                  "capacity": int(cap)} for i in range(int(nveh))]
 
-            requests.post(f"{API}/vehicles", json=v_list)
-            requests.post(f"{API}/orders", json=st.session_state.orders)
+            requests.post(f"{API}/vehicles", json=v_list, params=SC)
 
-            with st.spinner("Solving..."):
-                r = requests.post(f"{API}/optimize", params={"solver": chosen, "cluster_k": int(cluster_k)})
-                if r.status_code != 200:
-                    st.error(f"Optimize failed: {r.text}")
-                else:
-                    res = r.json()
-                    # Save results in session_state so they persist
-                    st.session_state["last_solution"] = res
+            r = requests.post(f"{API}/optimize", params={**SC, "solver": chosen, "cluster_k": int(cluster_k),
+                                                         "tour_method": "qubo" if use_qubo else "classical"})
+            if r.status_code == 429:
+                st.warning("Solver queue is full, try again in a moment")
+            elif r.status_code not in (200, 202):
+                st.error(f"Optimize failed: {r.text}")
+            else:
+                st.session_state["job_id"] = r.json()["job_id"]
+                st.session_state.pop("last_solution", None)
+
+    if st.session_state.get("job_id"):
+        # solve runs as a background job: follow its improving solutions over SSE
+        job_id = st.session_state["job_id"]
+        if st.button("⏹ Stop and keep best so far"):
+            requests.post(f"{API}/jobs/{job_id}/stop")
+        status = st.empty()
+        live_map = st.empty()
+        status.info("Solving...")
+        event, final, live = None, None, {}
+        with requests.get(f"{API}/jobs/{job_id}/stream", params={"format": "compact"}, stream=True) as stream:
+            for line in stream.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line[5:])
+                    if event == "solution":
+                        status.info(f"Best so far: {data['distance_m']} m after {data['elapsed_s']} s (still improving...)")
+                        # only changed routes are sent; keep decoded ones from earlier events
+                        live.update({int(i): decode_polyline(p) for i, p in data["routes_changed"].items()})
+                        routes = [live.get(i, []) for i in range(data["n_routes"])]
+                        with live_map.container():
+                            lm = folium.Map(location=st.session_state.depot, zoom_start=10)
+                            draw_routes(lm, routes, weight=4, markers=False)
+                            st_folium(lm, width=900, height=520, key=f"live_{data['seq']}")
+                    else:
+                        final = data
+        status.empty(); live_map.empty()
+        del st.session_state["job_id"]
+        if not final or final["status"] != "done":
+            st.error(f"Optimize {(final or {}).get('status', 'lost')}: {(final or {}).get('error')}")
+        else:
+            # Save results in session_state so they persist
+            st.session_state["last_solution"] = final["result"]
 
     # 👉 Render results if available
     if "last_solution" in st.session_state:
         res = st.session_state["last_solution"]
-        routes = res.get("routes_coords", [])
+        routes = [decode_polyline(p, res.get("polyline_precision", 5)) for p in res.get("routes_polyline", [])]
         dist = res.get("distance_m", 0)
 
         st.success(f"Solved. distance(m): {dist}")
+        if res.get("meta", {}).get("cache", {}).get("hit"):
+            st.caption("Scenario unchanged: reused the cached solution")
 
         # draw map with colored routes
         mm = folium.Map(location=st.session_state.depot, zoom_start=10)
         folium.Marker(st.session_state.depot, tooltip="Depot", icon=folium.Icon(color="blue")).add_to(mm)
-        palette = ["red", "blue", "green", "purple", "orange", "darkred", "cadetblue"]
-        for i, route in enumerate(routes):
-            if not route: continue
-            folium.PolyLine(route, color=palette[i % len(palette)], weight=5, tooltip=f"Vehicle v{i + 1}").add_to(mm)
-            for j, p in enumerate(route):
-                folium.CircleMarker(p, radius=4, color=palette[i % len(palette)], fill=True).add_to(mm)
+        draw_routes(mm, routes)
         st_folium(mm, width=900, height=520)
 
-        # per-vehicle table
-        summary = []
-        for i, route in enumerate(routes):
-            summary.append({"vehicle": f"v{i + 1}", "stops": max(0, len(route) - 1)})
-        st.dataframe(summary)
+        # per-vehicle table (computed by the API)
+        st.dataframe(res.get("vehicle_stats", []))
@@ -1,12 +1,52 @@
 # app/main.py
-from fastapi import FastAPI, HTTPException
-from typing import List, Dict
-from pydantic import BaseModel
-from app.models import set_depot, get_depot, save_vehicles, get_vehicles, save_orders, get_orders, clear_all
-from app.vrp_solver import solve_vrp
-from app.quantum_poc import hybrid_optimize_cluster
+import asyncio
+import time
+import zlib
+import numpy as np
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from typing import List, Dict, Optional
+from pydantic import BaseModel, Field
+from app.scenarios import SCENARIOS, DEFAULT_SCENARIO
+from app.matrix_cache import MATRIX_CACHE, prebuilt_matrix
+from app.models import INT_FIELD_MAX, point_array
+from app.optimize import run_optimize, SOLVERS
+from app.jobs import FINAL_STATES, QUEUE, QueueFull
+from app.warm_start import WARM_STARTS
+from app.vrp_solver import FIRST_SOLUTION_STRATEGIES, METAHEURISTICS
+from app.qubo import SCHEDULES
+from app.ingest import StreamIngest, FORMATS
+from app.result_cache import RESULTS, scenario_hash
+from app.road_network import METRICS, ROAD_GRAPH
+from app.evaluate import evaluate_routes
+from app.encoding import FORMATS as RESULT_FORMATS, dumps, encode_polyline, format_job
+from app.metrics import HTTP_REQUESTS, HTTP_SECONDS, REGISTRY, flat_gauges, record_solve
 
 app = FastAPI(title="QuantumFleet API")
+# large plans compress ~5-10x; SSE responses are excluded by the middleware
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=6)
+
+@app.on_event("startup")
+def _startup():
+    # fails jobs left by dead API processes (now and via the heartbeat), never live ones of other workers
+    QUEUE.start()
+
+@app.on_event("shutdown")
+def _shutdown():
+    QUEUE.shutdown()
+
+@app.middleware("http")
+async def _http_metrics(request: Request, call_next):
+    t = time.perf_counter()
+    response = await call_next(request)
+    # label by route template (/jobs/{job_id}), not the raw path, to keep the series count bounded
+    route = request.scope.get("route")
+    path = getattr(route, "path", "unmatched")
+    HTTP_SECONDS.observe(time.perf_counter() - t, request.method, path)
+    HTTP_REQUESTS.inc(request.method, path, response.status_code)
+    return response
 
 # Pydantic models for request validation
 class DepotIn(BaseModel):
@@ -17,67 +57,338 @@ class VehicleIn(BaseModel):
     id: str
     start_lat: float
     start_lon: float
-    capacity: int = 100
+    capacity: int = Field(100, le=INT_FIELD_MAX)
 
 class OrderIn(BaseModel):
     id: str
     lat: float
     lon: float
-    demand: int = 1
+    demand: int = Field(1, le=INT_FIELD_MAX)
     priority: str = "normal"
 
+# Partial records for PATCH: only the fields sent are changed
+class VehiclePatch(BaseModel):
+    id: Optional[str] = None
+    start_lat: Optional[float] = None
+    start_lon: Optional[float] = None
+    capacity: Optional[int] = Field(None, le=INT_FIELD_MAX)
+
+class OrderPatch(BaseModel):
+    id: Optional[str] = None
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    demand: Optional[int] = Field(None, le=INT_FIELD_MAX)
+    priority: Optional[str] = None
+
+class EvaluateIn(BaseModel):
+    # candidates[c][v] = order ids vehicle v visits, in order
+    candidates: List[List[List[str]]]
+    metric: str = "haversine"
+
+def _count(scenario: str, kind: str) -> int:
+    return len(SCENARIOS.get(scenario).table(kind))
+
+def _replace(scenario: str, kind: str, items) -> Dict:
+    return {"status": "ok", "scenario": scenario, "count": SCENARIOS.replace(scenario, kind, [i.dict() for i in items])}
+
+def _upsert(scenario: str, kind: str, items) -> Dict:
+    try:
+        added, updated = SCENARIOS.upsert(scenario, kind, [i.dict(exclude_unset=True) for i in items])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "ok", "scenario": scenario, "added": added, "updated": updated, "count": _count(scenario, kind)}
+
+def _patch_one(scenario: str, kind: str, rid: str, item) -> Dict:
+    try:
+        row = SCENARIOS.patch(scenario, kind, rid, item.dict(exclude_unset=True, exclude={"id"}))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"{rid} not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "ok", "scenario": scenario, "item": row}
+
+def _delete(scenario: str, kind: str, ids: List[str]) -> Dict:
+    removed = SCENARIOS.delete(scenario, kind, ids)
+    if len(ids) == 1 and not removed:
+        raise HTTPException(status_code=404, detail=f"{ids[0]} not found")
+    return {"status": "ok", "scenario": scenario, "deleted": removed, "count": _count(scenario, kind)}
+
+# Every scenario endpoint takes ?scenario=<id> (default "default"); state is shared through the DB
+
+@app.get("/scenarios")
+def api_scenarios():
+    return {"scenarios": SCENARIOS.list(), "cache": SCENARIOS.stats}
+
+@app.get("/scenarios/{scenario_id}")
+def api_scenario(scenario_id: str):
+    sc = SCENARIOS.get(scenario_id)
+    return {"scenario": scenario_id, "version": sc.version, "depot": sc.depot,
+            "vehicles": sc.vehicles.records(), "orders": len(sc.orders)}
+
 @app.post("/clear")
-def api_clear():
-    clear_all()
-    return {"status":"cleared"}
+def api_clear(scenario: str = DEFAULT_SCENARIO):
+    SCENARIOS.clear(scenario)
+    MATRIX_CACHE.discard(scenario)
+    WARM_STARTS.discard(scenario)
+    return {"status":"cleared", "scenario": scenario}
 
 @app.post("/depot")
-def api_set_depot(d: DepotIn):
-    set_depot(d.lat, d.lon)
-    return {"status":"ok", "depot": {"lat": d.lat, "lon": d.lon}}
+def api_set_depot(d: DepotIn, scenario: str = DEFAULT_SCENARIO):
+    SCENARIOS.set_depot(scenario, d.lat, d.lon)
+    return {"status":"ok", "scenario": scenario, "depot": {"lat": d.lat, "lon": d.lon}}
 
 @app.post("/vehicles")
-def api_vehicles(vehicles: List[VehicleIn]):
-    save_vehicles([v.dict() for v in vehicles])
-    return {"status":"ok", "count": len(vehicles)}
+def api_vehicles(vehicles: List[VehicleIn], scenario: str = DEFAULT_SCENARIO):
+    return _replace(scenario, "vehicles", vehicles)
+
+@app.patch("/vehicles")
+def api_upsert_vehicles(vehicles: List[VehiclePatch], scenario: str = DEFAULT_SCENARIO):
+    # new ids are appended (start_lat/start_lon required), known ids only get the fields sent
+    return _upsert(scenario, "vehicles", vehicles)
+
+@app.patch("/vehicles/{vehicle_id}")
+def api_patch_vehicle(vehicle_id: str, v: VehiclePatch, scenario: str = DEFAULT_SCENARIO):
+    return _patch_one(scenario, "vehicles", vehicle_id, v)
+
+@app.delete("/vehicles/{vehicle_id}")
+def api_delete_vehicle(vehicle_id: str, scenario: str = DEFAULT_SCENARIO):
+    return _delete(scenario, "vehicles", [vehicle_id])
+
+@app.delete("/vehicles")
+def api_delete_vehicles(ids: List[str] = Query(...), scenario: str = DEFAULT_SCENARIO):
+    return _delete(scenario, "vehicles", ids)
 
 @app.post("/orders")
-def api_orders(orders: List[OrderIn]):
-    save_orders([o.dict() for o in orders])
-    return {"status":"ok", "count": len(orders)}
-
-@app.post("/optimize")
-def api_optimize(solver: str = "ortools", cluster_k: int = 3):
-    depot = get_depot()
-    vehicles = get_vehicles()
-    orders = get_orders()
+def api_orders(orders: List[OrderIn], scenario: str = DEFAULT_SCENARIO):
+    return _replace(scenario, "orders", orders)
+
+@app.post("/orders/ingest")
+async def api_ingest_orders(request: Request, format: Optional[str] = None, replace: bool = False,
+                            scenario: str = DEFAULT_SCENARIO):
+    # streamed NDJSON/CSV body (gzip ok): rows go into the store chunk by chunk
+    ctype = request.headers.get("content-type", "")
+    fmt = format or ("csv" if "csv" in ctype else "ndjson")
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {list(FORMATS)}")
+    gz = True if request.headers.get("content-encoding", "").lower() == "gzip" else None
+    if replace:
+        await run_in_threadpool(SCENARIOS.replace, scenario, "orders", [])
+    # each chunk is one transaction: an executemany upsert plus the version bump. Parsing and the
+    # DB writes are blocking, so they run in the threadpool while the loop keeps serving others.
+    ingest = StreamIngest(SCENARIOS.writer(scenario, "orders"), fmt, gzip=gz)
+    try:
+        async for chunk in request.stream():
+            await run_in_threadpool(ingest.feed, chunk)
+        return await run_in_threadpool(ingest.close)
+    except zlib.error as e:
+        raise HTTPException(status_code=400, detail=f"bad gzip body: {e}")
+
+@app.patch("/orders")
+def api_upsert_orders(orders: List[OrderPatch], scenario: str = DEFAULT_SCENARIO):
+    # new ids are appended (lat/lon required), known ids only get the fields sent
+    return _upsert(scenario, "orders", orders)
+
+@app.patch("/orders/{order_id}")
+def api_patch_order(order_id: str, o: OrderPatch, scenario: str = DEFAULT_SCENARIO):
+    return _patch_one(scenario, "orders", order_id, o)
+
+@app.delete("/orders/{order_id}")
+def api_delete_order(order_id: str, scenario: str = DEFAULT_SCENARIO):
+    return _delete(scenario, "orders", [order_id])
+
+@app.delete("/orders")
+def api_delete_orders(ids: List[str] = Query(...), scenario: str = DEFAULT_SCENARIO):
+    return _delete(scenario, "orders", ids)
+
+@app.post("/optimize", status_code=202)
+def api_optimize(solver: str = "ortools", cluster_k: Optional[int] = None, time_limit: int = 15, repair: bool = True,
+                 incremental: bool = False, warm_time_limit: Optional[int] = None, stall_seconds: float = 1.0,
+                 first_solution: str = "PATH_CHEAPEST_ARC", metaheuristic: str = "GUIDED_LOCAL_SEARCH",
+                 solution_limit: Optional[int] = None, neighbors: Optional[int] = None,
+                 tour_method: str = "classical", sa_reads: int = 64, sa_sweeps: int = 300, sa_schedule: str = "geometric",
+                 scenario: str = DEFAULT_SCENARIO, cache: bool = True, metric: str = "haversine"):
+    t_request = time.perf_counter()
+    sc = SCENARIOS.get(scenario)
+    with sc.lock:
+        depot = sc.depot
+        vehicles = sc.vehicles.records()
+        orders = sc.orders.snapshot()  # columnar snapshot: later PATCHes don't touch a queued solve
     if not depot:
         raise HTTPException(status_code=400, detail="Depot required")
     if not vehicles:
         raise HTTPException(status_code=400, detail="At least one vehicle required")
     if not orders:
         raise HTTPException(status_code=400, detail="At least one order required")
+    if solver not in SOLVERS:
+        raise HTTPException(status_code=400, detail=f"solver must be one of {list(SOLVERS)}")
+    if first_solution not in FIRST_SOLUTION_STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"first_solution must be one of {list(FIRST_SOLUTION_STRATEGIES)}")
+    if metaheuristic not in METAHEURISTICS:
+        raise HTTPException(status_code=400, detail=f"metaheuristic must be one of {list(METAHEURISTICS)}")
+    if tour_method not in ("classical", "qubo"):
+        raise HTTPException(status_code=400, detail="tour_method must be 'classical' or 'qubo'")
+    if sa_schedule not in SCHEDULES:
+        raise HTTPException(status_code=400, detail=f"sa_schedule must be one of {list(SCHEDULES)}")
+    if time_limit <= 0:
+        raise HTTPException(status_code=400, detail="time_limit must be positive")
+    if metric not in METRICS:
+        raise HTTPException(status_code=400, detail=f"metric must be one of {list(METRICS)}")
+    if metric == "road" and solver not in ("ortools", "decomposed"):
+        raise HTTPException(status_code=400, detail="metric=road is supported by the ortools and decomposed solvers")
+    if metric == "road" and not ROAD_GRAPH:
+        raise HTTPException(status_code=400, detail="metric=road needs QF_ROAD_GRAPH (an .osm/.osm.pbf/.csv road graph)")
+    search_options = {"first_solution": first_solution, "metaheuristic": metaheuristic,
+                      "solution_limit": solution_limit, "neighbors": neighbors,
+                      "metric": metric}
+
+    # incremental: seed OR-Tools with the last solution and give it a much shorter budget
+    warm = WARM_STARTS.get(scenario) if incremental and solver == "ortools" else None
+    if warm:
+        time_limit = warm_time_limit or max(1, time_limit // 5)
+    params = dict(search_options, scenario=scenario, solver=solver, tour_method=tour_method, cluster_k=cluster_k, time_limit=time_limit, incremental=bool(warm),
+                  orders=len(orders), vehicles=len(vehicles))
+    sa_params = {"num_reads": sa_reads, "num_sweeps": sa_sweeps, "schedule": sa_schedule}
+
+    # identical scenario + settings: reuse a stored result, or join the solve already running.
+    # Warm-started solves depend on the previous solution, so they are never shared.
+    key = None if warm else scenario_hash(depot, vehicles, orders, solver, dict(
+        search_options, cluster_k=cluster_k, time_limit=time_limit, repair=repair, tour_method=tour_method,
+        sa=sa_params if tour_method == "qubo" else None))
+    if key and cache:
+        hit = RESULTS.get(key)
+        if hit is not None:
+            return {"job_id": QUEUE.complete(hit, dict(params, cached=True)), "status": "done", "cache": hit["meta"]["cache"]}
+
+    def remember(result):
+        # add the API-side stages: request handling before submit, and time spent queued/shipping the result
+        timings = result.setdefault("meta", {}).setdefault("timings", {"stages": {}, "size": {}})
+        worker_s = timings.get("total_s", 0.0) + timings["stages"].get("response", 0.0)
+        timings["stages"]["validate"] = round(t_submit - t_request, 4)
+        timings["stages"]["queue_wait"] = round(max(0.0, time.perf_counter() - t_submit - worker_s), 4)
+        record_solve(solver, result["meta"])
+        if solver == "ortools":
+            WARM_STARTS.save(scenario, orders, result)
+        if key and not result.get("meta", {}).get("stopped_early"):
+            result.setdefault("meta", {})["cache"] = {"hit": False, "key": key}
+            RESULTS.put(key, result)
+
+    prepare = None
+    if solver == "ortools" and metric != "road":
+        def prepare(kwargs):
+            # the matrix cache lives in this process (one copy, one byte budget, visible to /clear and
+            # /metrics); the worker gets the finished matrix, whichever worker it is
+            coords = np.vstack([[float(depot["lat"]), float(depot["lon"])], point_array(orders)])
+            kwargs["matrix"] = prebuilt_matrix(coords, scenario)
+
+    t_submit = time.perf_counter()
+    try:
+        job_id = QUEUE.submit(run_optimize, solver, dict(depot), list(vehicles), orders, cluster_k, time_limit,
+                              warm, stall_seconds if warm else None, search_options, repair, tour_method,
+                              sa_params, scenario_key=scenario, params=params,
+                              time_budget=time_limit if solver != "hybrid" else None, on_done=remember,
+                              key=key if cache else None, stream=solver == "ortools", prepare=prepare)
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=f"Solver queue full: {e}")
+    return {"job_id": job_id, "status": "pending"}
+
+def _check_format(fmt: str):
+    if fmt not in RESULT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {list(RESULT_FORMATS)}")
+
+@app.get("/jobs/{job_id}")
+def api_job(job_id: str, format: str = "full"):
+    # format=compact: routes as encoded polylines, no coords/routes_coords (see app.encoding.compact)
+    _check_format(format)
+    job = QUEUE.status(job_id)
+    if job["status"] == "not_found":
+        raise HTTPException(status_code=404, detail="Job not found")
+    # serialised directly: FastAPI's encoder walks every coordinate of a big plan
+    return Response(dumps(format_job(job, format)), media_type="application/json")
+
+@app.get("/jobs/{job_id}/stream")
+async def api_job_stream(job_id: str, format: str = "full"):
+    # Server-sent events: "solution" for each improving solution, then one final event named
+    # after the job's end state (done/failed/cancelled) carrying the same body as GET /jobs/{id}.
+    # format=compact: solution events only carry the routes that changed since the previous
+    # event ("routes_changed": {vehicle index: polyline}) and the final body is compact.
+    # A job run by another API worker only gets its final event (solutions stay in the owning process).
+    _check_format(format)
+    if QUEUE.status(job_id)["status"] == "not_found":
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        seq = 0
+        sent: Dict[int, str] = {}
+        while True:
+            batch, active = QUEUE.events(job_id, seq)
+            for ev in batch:
+                seq = ev["seq"]
+                if format == "compact":
+                    lines = {i: encode_polyline(r) for i, r in enumerate(ev["routes_coords"])}
+                    changed = {i: p for i, p in lines.items() if sent.get(i) != p}
+                    sent = lines
+                    ev = {"seq": seq, "elapsed_s": ev["elapsed_s"], "distance_m": ev["distance_m"],
+                          "n_routes": len(lines), "routes_changed": changed}
+                yield f"event: solution\ndata: {dumps(ev).decode()}\n\n"
+            if not active:
+                job = await run_in_threadpool(QUEUE.status, job_id)
+                if job["status"] not in FINAL_STATES:
+                    await asyncio.sleep(1.0)  # another worker's job: wait for its end state in the DB
+                    continue
+                job = format_job(job, format)
+                yield f"event: {job['status']}\ndata: {dumps(job).decode()}\n\n"
+                return
+            await asyncio.sleep(0.2)
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/jobs/{job_id}/stop")
+def api_stop_job(job_id: str):
+    # unlike DELETE, the search ends early but its best solution so far becomes the result
+    if not QUEUE.stop(job_id):
+        job = QUEUE.status(job_id)
+        if job["status"] == "not_found":
+            raise HTTPException(status_code=404, detail="Job not found")
+        if job["status"] not in FINAL_STATES and not QUEUE.is_local(job_id):
+            raise HTTPException(status_code=409, detail="Job runs in another API worker; stop it through that worker")
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']} or does not support stopping")
+    return {"job_id": job_id, "status": "stopping"}
+
+@app.delete("/jobs/{job_id}")
+def api_cancel_job(job_id: str):
+    if not QUEUE.cancel(job_id):
+        job = QUEUE.status(job_id)
+        if job["status"] == "not_found":
+            raise HTTPException(status_code=404, detail="Job not found")
+        raise HTTPException(status_code=409, detail=f"Job already {job['status']}")
+    return {"job_id": job_id, "status": "cancelled"}
+
+@app.post("/evaluate")
+def api_evaluate(body: EvaluateIn, scenario: str = DEFAULT_SCENARIO):
+    # what-if scoring of edited plans against the scenario, without a solve
+    sc = SCENARIOS.get(scenario)
+    with sc.lock:
+        depot = sc.depot
+        vehicles = sc.vehicles.records()
+        orders = sc.orders.snapshot()
+    if not depot or not vehicles:
+        raise HTTPException(status_code=400, detail="Depot and vehicles required")
+    if body.metric not in METRICS:
+        raise HTTPException(status_code=400, detail=f"metric must be one of {list(METRICS)}")
+    if body.metric == "road" and not ROAD_GRAPH:
+        raise HTTPException(status_code=400, detail="metric=road needs QF_ROAD_GRAPH (an .osm/.osm.pbf/.csv road graph)")
+    try:
+        return evaluate_routes(depot, vehicles, orders, body.candidates, scenario_key=scenario, metric=body.metric)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/jobs")
+def api_jobs_stats():
+    return dict(QUEUE.stats(), result_cache=RESULTS.stats())
 
-    # Build minimal vehicle & orders cleaned lists
-    veh_list = vehicles
-    orders_list = orders
-
-    if solver == "ortools":
-        res = solve_vrp(veh_list, orders_list, depot)
-        # Build human-friendly lat/lon routes as well
-        coords = res.get("coords", [])
-        routes_idx = res.get("routes", [])
-        routes_coords = []
-        for route in routes_idx:
-            routes_coords.append([[coords[n][0], coords[n][1]] for n in route])
-        return {"coords": coords, "routes_idx": routes_idx, "routes_coords": routes_coords, "distance_m": res.get("distance"), "meta": res.get("meta", {})}
-    else:
-        # hybrid expects orders as list of tuples
-        orders_tuples = [(o["lat"], o["lon"]) for o in orders_list]
-        res = hybrid_optimize_cluster(k=cluster_k, depot=(depot["lat"], depot["lon"]), orders=orders_tuples)
-        coords = res.get("coords", [])
-        routes_idx = res.get("routes", [])
-        routes_coords = []
-        for route in routes_idx:
-            routes_coords.append([[coords[n][0], coords[n][1]] for n in route])
-        return {"coords": coords, "routes_idx": routes_idx, "routes_coords": routes_coords, "distance_m": res.get("distance"), "meta": res.get("meta", {})}
+@app.get("/metrics", response_class=PlainTextResponse)
+def api_metrics():
+    # Prometheus text format; cache/queue figures are gauges read at scrape time
+    gauges = dict(flat_gauges("qf_jobs", QUEUE.stats()), **flat_gauges("qf_result_cache", RESULTS.stats()),
+                  **flat_gauges("qf_matrix_cache", MATRIX_CACHE.stats()),
+                  **flat_gauges("qf_scenario_cache", SCENARIOS.stats))
+    return PlainTextResponse(REGISTRY.render(gauges), media_type="text/plain; version=0.0.4")